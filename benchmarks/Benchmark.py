@@ -0,0 +1,126 @@
+#
+# Copyright (C) 2015  Ilya Markov
+#
+# Full copyright notice can be found in LICENSE.
+#
+
+from __future__ import print_function
+
+import argparse
+import json
+import platform
+import sys
+import time
+
+from pyclick.click_models.Evaluation import LogLikelihood, Perplexity, PerplexityCond, RelevancePrediction
+from pyclick.click_models.UBM import UBM
+from pyclick.click_models.DBN import DBN
+from pyclick.click_models.SDBN import SDBN
+from pyclick.click_models.DCM import DCM
+from pyclick.click_models.CCM import CCM
+from pyclick.click_models.CTR import DCTR, RCTR, GCTR
+from pyclick.click_models.CM import CM
+from pyclick.click_models.PBM import PBM
+from pyclick.click_models.task_centric.SearchTask import SearchTask
+from pyclick.click_models.task_centric.TCM import TCM
+from pyclick.utils.SessionGenerator import SessionGenerator
+from pyclick.utils.Utils import Utils
+
+
+__author__ = 'Ilya Markov'
+
+
+CLICK_MODELS = [GCTR, RCTR, DCTR, PBM, CM, UBM, DCM, CCM, DBN, SDBN, TCM]
+"""The click models to benchmark (covering the MLE, EM and task-centric EM inference)."""
+
+
+def get_evaluations(generator):
+    return [('LogLikelihood', LogLikelihood()),
+            ('Perplexity', Perplexity()),
+            ('PerplexityCond', PerplexityCond()),
+            ('RelevancePrediction', RelevancePrediction(generator.relevances))]
+
+
+def benchmark_model(click_model_class, train_sessions, test_sessions, evaluations):
+    """
+    Trains the given click model and runs each of the given evaluations.
+
+    :returns: The dictionary with the time (in seconds) and throughput (in search sessions per second)
+        of training and of each evaluation.
+    """
+    click_model = click_model_class()
+    train_data = SearchTask.get_search_tasks(train_sessions) if click_model_class == TCM else train_sessions
+
+    start = time.time()
+    click_model.train(train_data)
+    train_time = time.time() - start
+    click_model.freeze()
+
+    result = {'model': click_model_class.__name__,
+              'inference': click_model._inference.__class__.__name__,
+              'train_time': train_time,
+              'train_sessions_per_sec': len(train_sessions) / train_time if train_time else None,
+              'evaluations': {}}
+
+    for evaluation_name, evaluation in evaluations:
+        start = time.time()
+        evaluation.evaluate(click_model, test_sessions)
+        evaluation_time = time.time() - start
+
+        result['evaluations'][evaluation_name] = {
+            'time': evaluation_time,
+            'sessions_per_sec': len(test_sessions) / evaluation_time if evaluation_time else None,
+        }
+
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Measures the throughput of training and evaluation of click models on synthetic search sessions.")
+    parser.add_argument('--scales', default='1000,10000,100000',
+                        help="the comma-separated numbers of training search sessions")
+    parser.add_argument('--models', default=','.join(model.__name__ for model in CLICK_MODELS),
+                        help="the comma-separated names of click models")
+    parser.add_argument('--test-fraction', type=float, default=0.25,
+                        help="the number of test search sessions relative to the number of training ones")
+    parser.add_argument('--queries', type=int, default=1000, help="the number of distinct queries")
+    parser.add_argument('--zipf', type=float, default=1.0, help="the exponent of the Zipf's law of query frequencies")
+    parser.add_argument('--depth', type=int, default=10, help="the number of results on a SERP")
+    parser.add_argument('--click-rate', type=float, default=0.2, help="the expected fraction of clicked results")
+    parser.add_argument('--seed', type=int, default=1, help="the seed of the session generator")
+    parser.add_argument('--output', help="the JSON file to write the results to (stdout if not set)")
+    args = parser.parse_args()
+
+    models = dict((model.__name__, model) for model in CLICK_MODELS)
+    click_model_classes = [models[name] for name in args.models.split(',')]
+
+    results = []
+    for scale in [int(scale) for scale in args.scales.split(',')]:
+        generator = SessionGenerator(args.queries, args.zipf, args.depth, args.click_rate, seed=args.seed)
+        train_sessions = generator.generate(scale)
+        test_sessions = Utils.filter_sessions(generator.generate(int(scale * args.test_fraction)),
+                                              Utils.get_unique_queries(train_sessions))
+        evaluations = get_evaluations(generator)
+
+        for click_model_class in click_model_classes:
+            result = benchmark_model(click_model_class, train_sessions, test_sessions, evaluations)
+            result.update({'train_sessions': len(train_sessions), 'test_sessions': len(test_sessions)})
+            results.append(result)
+
+            print("%s on %d sessions: training %.1f sessions/sec" %
+                  (click_model_class.__name__, scale, result['train_sessions_per_sec'] or 0), file=sys.stderr)
+
+    report = {
+        'python': platform.python_implementation() + ' ' + platform.python_version(),
+        'platform': platform.platform(),
+        'config': vars(args),
+        'results': results,
+    }
+
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(report, output_file, indent=2, sort_keys=True)
+    else:
+        json.dump(report, sys.stdout, indent=2, sort_keys=True)
+        print()
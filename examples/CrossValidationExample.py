@@ -0,0 +1,66 @@
+#
+# Copyright (C) 2015  Ilya Markov
+#
+# Full copyright notice can be found in LICENSE.
+#
+
+from __future__ import print_function
+
+import sys
+
+from pyclick.click_models.CrossValidation import CrossValidation
+from pyclick.click_models.Evaluation import LogLikelihood, Perplexity
+from pyclick.click_models.UBM import UBM
+from pyclick.click_models.DBN import DBN
+from pyclick.click_models.SDBN import SDBN
+from pyclick.click_models.DCM import DCM
+from pyclick.click_models.CCM import CCM
+from pyclick.click_models.CTR import DCTR, RCTR, GCTR
+from pyclick.click_models.CM import CM
+from pyclick.click_models.PBM import PBM
+from pyclick.utils.YandexRelPredChallengeParser import YandexRelPredChallengeParser
+
+
+__author__ = 'Ilya Markov'
+
+
+if __name__ == "__main__":
+    print("===============================")
+    print("This is an example of cross-validating click models with PyClick.")
+    print("===============================")
+
+    if len(sys.argv) < 6:
+        print("USAGE: %s <click_models> <dataset> <sessions_max> <fold_num> <processes> [query|time]" % sys.argv[0])
+        print("\tclick_models - the comma-separated names of click models to use.")
+        print("\tdataset - the path to the dataset from Yandex Relevance Prediction Challenge")
+        print("\tsessions_max - the maximum number of one-query search sessions to consider")
+        print("\tfold_num - the number of folds")
+        print("\tprocesses - the number of worker processes")
+        print("\tquery|time - whether to split search sessions into folds by query (default) or by time")
+        print("")
+        sys.exit(1)
+
+    click_model_classes = [globals()[name] for name in sys.argv[1].split(',')]
+    search_sessions_path = sys.argv[2]
+    search_sessions_num = int(sys.argv[3])
+    fold_num = int(sys.argv[4])
+    processes = int(sys.argv[5])
+    split_by = sys.argv[6] if len(sys.argv) > 6 else CrossValidation.SPLIT_BY_QUERY
+
+    search_sessions = YandexRelPredChallengeParser().parse(search_sessions_path, search_sessions_num)
+
+    cross_validation = CrossValidation(click_model_classes, [LogLikelihood(), Perplexity()],
+                                       fold_num, split_by, processes)
+    results = cross_validation.run(search_sessions)
+
+    for click_model_class in click_model_classes:
+        result = results[click_model_class.__name__]
+        (ll_mean, (perp_mean, _)), (ll_std, (perp_std, _)) = result.mean, result.std
+
+        print("-------------------------------")
+        print("%s (%d folds, split by %s)" % (click_model_class.__name__, fold_num, split_by))
+        print("-------------------------------")
+        for fold, (ll_value, (perp_value, _)) in enumerate(result.folds):
+            print("\tfold %d: log-likelihood: %f; perplexity: %f; training time: %i secs" %
+                  (fold, ll_value, perp_value, result.train_times[fold]))
+        print("\tmean: log-likelihood: %f (+/- %f); perplexity: %f (+/- %f)" % (ll_mean, ll_std, perp_mean, perp_std))
@@ -10,7 +10,7 @@ import sys
 
 import time
 
-from pyclick.click_models.Evaluation import LogLikelihood, Perplexity
+from pyclick.click_models.Evaluation import LogLikelihood, MultiEvaluation, Perplexity
 from pyclick.click_models.UBM import UBM
 from pyclick.click_models.DBN import DBN
 from pyclick.click_models.SDBN import SDBN
@@ -65,15 +65,9 @@ if __name__ == "__main__":
     print("Testing on %d search sessions (%d unique queries)." % (len(test_sessions), len(test_queries)))
     print("-------------------------------")
 
-    loglikelihood = LogLikelihood()
-    perplexity = Perplexity()
+    evaluation = MultiEvaluation([LogLikelihood(), Perplexity()])
 
     start = time.time()
-    ll_value = loglikelihood.evaluate(click_model, test_sessions)
+    ll_value, (perp_value, _) = evaluation.evaluate(click_model, test_sessions)
     end = time.time()
-    print("\tlog-likelihood: %f; time: %i secs" % (ll_value, end - start))
-
-    start = time.time()
-    perp_value = perplexity.evaluate(click_model, test_sessions)[0]
-    end = time.time()
-    print("\tperplexity: %f; time: %i secs" % (perp_value, end - start))
+    print("\tlog-likelihood: %f; perplexity: %f; time: %i secs" % (ll_value, perp_value, end - start))
@@ -91,6 +91,27 @@ class CCM(ClickModel):
         session_params = self.get_session_params(search_session)
         return self._get_tail_clicks(search_session, 0, session_params)[0]
 
+    def _sample_session_clicks(self, search_session, sample):
+        attr_params = self.params[self.param_names.attr]
+        tau_1 = self.params[self.param_names.cont_noclick].get().value()
+        tau_2 = self.params[self.param_names.cont_click_nonrel].get().value()
+        tau_3 = self.params[self.param_names.cont_click_rel].get().value()
+        clicks = [0] * len(search_session.web_results)
+
+        for rank, result in enumerate(search_session.web_results):
+            attr = attr_params.get(search_session.query, result.id).value()
+            if sample() < attr:
+                clicks[rank] = 1
+                # The attractiveness is also the probability that the clicked result is relevant
+                cont = tau_3 if sample() < attr else tau_2
+            else:
+                cont = tau_1
+
+            if sample() >= cont:
+                break
+
+        return clicks
+
     def predict_relevance(self, query, search_result):
         attr = self.params[self.param_names.attr].get(query, search_result).value()
         return attr**2
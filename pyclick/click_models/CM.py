@@ -64,8 +64,19 @@ class CM(ClickModel):
 
         return click_probs
 
+    def _sample_session_clicks(self, search_session, sample):
+        attr_params = self.params[self.param_names.attr]
+        clicks = [0] * len(search_session.web_results)
+
+        for rank, result in enumerate(search_session.web_results):
+            if sample() < attr_params.get(search_session.query, result.id).value():
+                clicks[rank] = 1
+                break
+
+        return clicks
+
     def predict_relevance(self, query, search_result):
-        return self.params[self.param_names.ctr].get(query, search_result).value()
+        return self.params[self.param_names.attr].get(query, search_result).value()
 
 
 class CMAttrMLE(ParamMLE):
@@ -9,6 +9,7 @@ from pyclick.click_models.ClickModel import ClickModel
 from pyclick.click_models.Inference import MLEInference
 from pyclick.click_models.Param import ParamMLE
 from pyclick.click_models.ParamContainer import QueryDocumentParamContainer, RankParamContainer, SingleParamContainer
+from pyclick.click_models.SketchParamContainer import SketchCTRParamContainer
 
 __author__ = 'Ilya Markov, Luka Stout'
 
@@ -76,6 +77,31 @@ class DCTR(CTR):
         return self.params[self.param_names.ctr].get(search_session.query, search_session.web_results[rank].id)
 
 
+class SketchDCTR(DCTR):
+    """
+    The document-based CTR click model (DCTR) with a fixed memory budget,
+    where clicks and impressions of query-document pairs are counted in count-min sketches
+    (see SketchCTRParamContainer), except for the pairs of the given head queries, which are counted exactly.
+    """
+
+    def __init__(self, width=SketchCTRParamContainer.WIDTH_DEFAULT, depth=SketchCTRParamContainer.DEPTH_DEFAULT,
+                 head_queries=None, seed=0):
+        """
+        Initializes the model.
+
+        :param width: The width of the sketches.
+        :param depth: The depth of the sketches.
+            The sketches use 16 * width * depth bytes.
+        :param head_queries: The collection of queries, whose parameters are counted exactly.
+        :param seed: The seed of the hash functions of the sketches.
+        """
+        self._sketch_args = (width, depth, head_queries, seed)
+        super(SketchDCTR, self).__init__()
+
+    def _init_ctr_params(self):
+        return SketchCTRParamContainer(CTRParamMLE, *self._sketch_args)
+
+
 class RCTR(CTR):
     """
     The rank-based CTR click model (DCTR),
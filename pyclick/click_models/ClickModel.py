@@ -4,9 +4,20 @@
 # Full copyright notice can be found in LICENSE.
 #
 from abc import abstractmethod
+import copy
+import gc
+import gzip
 import json
+import os
+import random
 from enum import Enum
 
+from pyclick.click_models.DiskParamContainer import DiskQueryDocumentParamContainer
+from pyclick.click_models.ParamContainer import QueryDocumentParamContainer
+from pyclick.click_models.ShardedParamContainer import ShardedQueryDocumentParamContainer
+from pyclick.click_models.SQLiteParamContainer import SQLiteQueryDocumentParamContainer
+from pyclick.utils.BinaryFormat import BinaryFormat
+
 __author__ = 'Ilya Markov'
 
 
@@ -23,9 +34,126 @@ class ClickModel(object):
         self.params = {}
         self._inference = None
 
-    def train(self, search_sessions):
-        """Trains the click model using the given list of search sessions."""
-        self._inference.infer_params(self, search_sessions)
+    def train(self, search_sessions, callbacks=None, initial_model=None):
+        """
+        Trains the click model using the given list of search sessions.
+
+        :param search_sessions: The list of search sessions.
+        :param callbacks: The list of callbacks to notify about the progress of training
+            (see InferenceCallback, e.g., InferenceProfiler).
+        :param initial_model: The previously trained click model of the same class,
+            whose parameter values are used instead of the priors in the first iteration of EM (warm start).
+            It can be loaded in any supported way, e.g., using from_json, from_binary or from_shards,
+            and is not modified by training.
+        :returns: The number of iterations performed by the inference method (1 for MLE).
+        """
+        if self.is_frozen():
+            raise RuntimeError("Cannot train a frozen click model, call unfreeze() first")
+        if initial_model is not None and type(initial_model) != type(self):
+            raise ValueError("Cannot warm-start %s from %s" % (self.__class__.__name__,
+                                                               initial_model.__class__.__name__))
+
+        return self._inference.infer_params(self, search_sessions, callbacks, initial_model)
+
+    def freeze(self):
+        """
+        Switches all parameter containers of the model to the read-only mode (see ParamContainer.freeze).
+        Parameters of unseen queries and documents then take their prior values without being stored,
+        so the model does not grow when it is used for prediction or evaluation.
+        Should be called after training.
+        """
+        for param in self.params.values():
+            param.freeze()
+
+    def unfreeze(self):
+        """Switches all parameter containers of the model back to the default (trainable) mode."""
+        for param in self.params.values():
+            param.unfreeze()
+
+    def is_frozen(self):
+        """
+        Checks whether the model is frozen.
+
+        :returns: True if any of the parameter containers of the model is frozen and False otherwise.
+        """
+        return any(param.is_frozen() for param in self.params.values())
+
+    def compile(self):
+        """
+        Returns an immutable inference-only snapshot of the trained model.
+
+        The snapshot is an instance of the same click model class
+        (so it provides the same get_full_click_probs, get_conditional_click_probs and predict_relevance),
+        but its parameters hold precomputed values (see ParamContainer.compile).
+        The snapshot cannot be trained.
+
+        :returns: The compiled copy of the model.
+        """
+        compiled_model = copy.copy(self)
+        compiled_model.params = dict((param_name, param.compile()) for param_name, param in self.params.items())
+        compiled_model._inference = None
+        return compiled_model
+
+    def prune(self, min_observation_num=None, epsilon=None):
+        """
+        Removes rarely observed query-document parameters and those that do not differ from the prior
+        (see QueryDocumentParamContainer.prune).
+        Models loaded with from_shards or from_store cannot be pruned:
+        they should be pruned before being written with to_shards or to_store.
+
+        :param min_observation_num: The minimum number of observations of a parameter to keep.
+        :param epsilon: The maximum absolute difference between the value of a parameter and the prior
+            to prune the parameter.
+        :returns: The number of pruned parameters.
+        """
+        containers = [param for param in self.params.values() if isinstance(param, QueryDocumentParamContainer)]
+        for container in containers:
+            if isinstance(container, (ShardedQueryDocumentParamContainer, DiskQueryDocumentParamContainer)):
+                raise RuntimeError("Cannot prune parameters stored in %s, prune the model before writing it" %
+                                   container.__class__.__name__)
+
+        return sum(container.prune(min_observation_num, epsilon) for container in containers)
+
+    def spill_to_disk(self, max_params=SQLiteQueryDocumentParamContainer.MAX_PARAMS_DEFAULT):
+        """
+        Replaces the containers of query-document parameters with SQLite-backed ones,
+        which keep only the given number of parameters in memory (see SQLiteQueryDocumentParamContainer).
+        This way, the model can be trained on more query-document pairs than fit in memory, at the cost of speed.
+        The current parameters are moved to the new containers.
+
+        :param max_params: The maximum number of parameters to keep in memory per container.
+        """
+        for param_name, param in list(self.params.items()):
+            if type(param) == QueryDocumentParamContainer:
+                container = SQLiteQueryDocumentParamContainer(param._param_class, '', max_params, *param._param_args)
+                container += param
+                if param.is_frozen():
+                    container.freeze()
+                self.params[param_name] = container
+
+    def get_memory_footprint(self):
+        """
+        Estimates the memory used by the parameters of the click model in bytes
+        (see ParamContainer.get_memory_footprint).
+        Objects shared between containers, e.g., queries and documents, are counted in the first container only.
+
+        :returns: The dictionary with the footprint of each container under the key 'containers'
+            ({param_name: footprint}) and the keys of a container footprint summed over all containers.
+        """
+        seen = set()
+        containers = dict((param_name.name, self.params[param_name].get_memory_footprint(seen))
+                          for param_name in self.param_names if param_name in self.params)
+
+        footprint = {'containers': containers, 'compact': {}}
+        for container in containers.values():
+            for part, size in container.items():
+                if part == 'compact':
+                    for representation, compact_size in size.items():
+                        footprint['compact'][representation] = \
+                            footprint['compact'].get(representation, 0) + compact_size
+                else:
+                    footprint[part] = footprint.get(part, 0) + size
+        return footprint
 
     def to_json(self):
         """
@@ -49,6 +177,183 @@ class ClickModel(object):
             param_name = self.param_names[json_param_name]
             self.params[param_name].from_json(json_param)
 
+    def to_binary(self, stream, compress=False):
+        """
+        Writes the model in the binary format to the given stream (e.g., a file opened in the 'wb' mode).
+
+        Unlike to_json, the binary format stores each parameter container in its own section
+        and writes parameters in chunks, so neither saving nor loading
+        needs to hold the serialized model in memory.
+
+        :param stream: The binary stream to write to.
+        :param compress: Whether to compress the model using gzip.
+        """
+        stream.write(BinaryFormat.MAGIC)
+        BinaryFormat.write_uint8(stream, BinaryFormat.VERSION)
+        BinaryFormat.write_uint8(stream, int(compress))
+
+        if compress:
+            stream = gzip.GzipFile(fileobj=stream, mode='wb', mtime=0)
+
+        try:
+            BinaryFormat.write_uint32(stream, len(self.params))
+            for param_name, param in self.params.items():
+                BinaryFormat.write_string(stream, param_name.name)
+                param.to_binary(stream)
+        finally:
+            if compress:
+                stream.close()
+
+    def from_binary(self, stream):
+        """
+        Initializes the model from the given binary stream (see to_binary).
+
+        :param stream: The binary stream to read from (e.g., a file opened in the 'rb' mode).
+        """
+        if BinaryFormat.read_exactly(stream, len(BinaryFormat.MAGIC)) != BinaryFormat.MAGIC:
+            raise ValueError("Not a binary click model")
+
+        version = BinaryFormat.read_uint8(stream)
+        if version != BinaryFormat.VERSION:
+            raise ValueError("Unsupported version of a binary click model: %d" % version)
+
+        if BinaryFormat.read_uint8(stream):
+            stream = gzip.GzipFile(fileobj=stream, mode='rb')
+
+        # Loading creates millions of parameters that cannot form reference cycles,
+        # so the cyclic garbage collector is paused instead of repeatedly scanning them.
+        gc_enabled = gc.isenabled()
+        gc.disable()
+
+        try:
+            for _ in range(BinaryFormat.read_uint32(stream)):
+                param_name = self.param_names[BinaryFormat.read_string(stream)]
+                self.params[param_name].from_binary(stream)
+        finally:
+            if gc_enabled:
+                gc.enable()
+
+    SHARDS_MANIFEST = 'shards.json'
+    """The name of the file that describes a sharded model (see to_shards)."""
+
+    SHARDS_MODEL = 'model.bin'
+    """
+    The name of the file that stores the parameters of a sharded (or disk-backed) model,
+    which are not sharded (see to_shards and to_store).
+    """
+
+    def to_shards(self, directory, shard_num, compress=False):
+        """
+        Writes the model into the given directory,
+        partitioning the parameters that depend on a query-document pair into shards by the hash of a query.
+        Other parameters are written into a single binary file (see to_binary).
+        A sharded model can be loaded lazily, shard by shard (see from_shards).
+
+        :param directory: The directory to write the model to. It is created if it does not exist.
+        :param shard_num: The number of shards.
+        :param compress: Whether to compress the model files using gzip.
+        """
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        model = copy.copy(self)
+        model.params = dict(self.params)
+        sharded_param_names = []
+
+        for param_name, param in self.params.items():
+            if type(param) == QueryDocumentParamContainer:
+                ShardedQueryDocumentParamContainer.write_shards(
+                    param, os.path.join(directory, param_name.name), shard_num, compress)
+                model.params[param_name] = QueryDocumentParamContainer(param._param_class, *param._param_args)
+                sharded_param_names.append(param_name.name)
+
+        with open(os.path.join(directory, self.SHARDS_MODEL), 'wb') as model_file:
+            model.to_binary(model_file, compress)
+
+        with open(os.path.join(directory, self.SHARDS_MANIFEST), 'w') as manifest_file:
+            json.dump({'shard_num': shard_num, 'compress': compress, 'params': sharded_param_names}, manifest_file)
+
+    def from_shards(self, directory, max_params=None):
+        """
+        Initializes the model from the given directory (see to_shards).
+        The parameters that depend on a query-document pair are not loaded immediately:
+        a shard is loaded on the first access to any of its queries (see ShardedQueryDocumentParamContainer).
+        The resulting model is frozen.
+
+        :param directory: The directory of a sharded model.
+        :param max_params: The maximum number of parameters to keep in memory per sharded container.
+            If not set, loaded shards are never evicted.
+        """
+        with open(os.path.join(directory, self.SHARDS_MANIFEST)) as manifest_file:
+            manifest = json.load(manifest_file)
+
+        with open(os.path.join(directory, self.SHARDS_MODEL), 'rb') as model_file:
+            self.from_binary(model_file)
+
+        for param_name in manifest['params']:
+            param = self.params[self.param_names[param_name]]
+            self.params[self.param_names[param_name]] = ShardedQueryDocumentParamContainer(
+                param._param_class, os.path.join(directory, param_name), manifest['shard_num'],
+                max_params, manifest['compress'], *param._param_args)
+
+        self.freeze()
+
+    STORE_MANIFEST = 'store.json'
+    """The name of the file that describes a disk-backed model (see to_store)."""
+
+    def to_store(self, directory):
+        """
+        Writes the model into the given directory,
+        storing the parameters that depend on a query-document pair in key-value stores (see dbm), one per parameter.
+        Other parameters are written into a single binary file (see to_binary).
+        Parameters of a disk-backed model are read from disk query by query (see from_store).
+
+        :param directory: The directory to write the model to. It is created if it does not exist.
+        """
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        model = copy.copy(self)
+        model.params = dict(self.params)
+        stored_param_names = []
+
+        for param_name, param in self.params.items():
+            if type(param) == QueryDocumentParamContainer:
+                DiskQueryDocumentParamContainer.write_store(param, os.path.join(directory, param_name.name))
+                model.params[param_name] = QueryDocumentParamContainer(param._param_class, *param._param_args)
+                stored_param_names.append(param_name.name)
+
+        with open(os.path.join(directory, self.SHARDS_MODEL), 'wb') as model_file:
+            model.to_binary(model_file)
+
+        with open(os.path.join(directory, self.STORE_MANIFEST), 'w') as manifest_file:
+            json.dump({'params': stored_param_names}, manifest_file)
+
+    def from_store(self, directory, max_params=None):
+        """
+        Initializes the model from the given directory (see to_store).
+        The parameters that depend on a query-document pair are read from disk on the first access to a query
+        and cached in memory (see DiskQueryDocumentParamContainer).
+        The resulting model is frozen.
+
+        :param directory: The directory of a disk-backed model.
+        :param max_params: The maximum number of parameters (not bytes) to keep in memory
+            per disk-backed container (see DiskQueryDocumentParamContainer).
+            If not set, loaded queries are never evicted.
+        """
+        with open(os.path.join(directory, self.STORE_MANIFEST)) as manifest_file:
+            manifest = json.load(manifest_file)
+
+        with open(os.path.join(directory, self.SHARDS_MODEL), 'rb') as model_file:
+            self.from_binary(model_file)
+
+        for param_name in manifest['params']:
+            param = self.params[self.param_names[param_name]]
+            self.params[self.param_names[param_name]] = DiskQueryDocumentParamContainer(
+                param._param_class, os.path.join(directory, param_name), max_params, *param._param_args)
+
+        self.freeze()
+
     def __iadd__(self, other):
         """
         Concatenates the current click model and the _other_ click model.
@@ -111,6 +416,33 @@ class ClickModel(object):
         """
         pass
 
+    def sample_clicks(self, search_sessions, seed=None):
+        """
+        Samples clicks on the given SERPs according to the generative process of the click model,
+        e.g., to simulate click logs from a trained model.
+        For better throughput, sample from a frozen or compiled model (see freeze and compile).
+
+        :param search_sessions: The iterable of search sessions, whose queries and results define SERPs
+            (observed clicks are ignored).
+        :param seed: The seed of the random generator.
+        :returns: The list of sampled clicks, one list per search session,
+            where clicks[i] is 1 if the i-th result is clicked and 0 otherwise.
+        """
+        sample = random.Random(seed).random
+        return [self._sample_session_clicks(search_session, sample) for search_session in search_sessions]
+
+    def _sample_session_clicks(self, search_session, sample):
+        """
+        Samples clicks on the given SERP.
+        By default, results are clicked independently with their full click probabilities,
+        so models where clicks depend on previous clicks must override this method.
+
+        :param search_session: The search session.
+        :param sample: The function that returns a random number in [0, 1).
+        :returns: The list of sampled clicks.
+        """
+        return [int(sample() < click_prob) for click_prob in self.get_full_click_probs(search_session)]
+
     @abstractmethod
     def predict_relevance(self, query, search_result):
         """
@@ -121,3 +453,22 @@ class ClickModel(object):
         :returns: Predicted relevance.
         """
         pass
+
+    def predict_relevances(self, query_results):
+        """
+        Predicts the relevance of each of the given query-result pairs (see predict_relevance).
+        The relevance of each distinct pair is predicted once,
+        so repeated pairs (e.g., judged results observed in many search sessions) cost a single lookup.
+
+        :param query_results: The iterable of pairs (query, search_result).
+        :returns: The list of predicted relevances, in the order of the given pairs.
+        """
+        predictions = {}
+        relevances = []
+
+        for query_result in query_results:
+            if query_result not in predictions:
+                predictions[query_result] = self.predict_relevance(*query_result)
+            relevances.append(predictions[query_result])
+
+        return relevances
@@ -0,0 +1,166 @@
+#
+# Copyright (C) 2015  Ilya Markov
+#
+# Full copyright notice can be found in LICENSE.
+#
+from __future__ import division
+import collections
+import math
+import random
+import time
+
+from pyclick.click_models.Evaluation import ClickProbEvaluation, MultiEvaluation
+from pyclick.utils.Utils import Utils
+
+__author__ = 'Ilya Markov'
+
+
+CrossValidationResult = collections.namedtuple('CrossValidationResult', 'folds mean std train_times')
+"""
+The result of cross-validating a click model:
+the list of metric values on each fold, the mean and standard deviation of metric values over folds
+and the list of training times (in seconds) on each fold.
+"""
+
+
+class CrossValidation(object):
+    """
+    The k-fold cross-validation of click models.
+
+    Search sessions are split into folds either by query (all sessions of a query are in the same fold)
+    or by time (each fold is a contiguous block of sessions, assuming that sessions are ordered by time).
+    Each click model is trained on all folds but one and evaluated on the remaining fold.
+    Training and evaluation on different folds and of different click models run in parallel worker processes,
+    which share search sessions with the current process (see Utils.fork_imap).
+    """
+
+    SPLIT_BY_QUERY = 'query'
+    SPLIT_BY_TIME = 'time'
+
+    def __init__(self, click_model_classes, evaluations, fold_num=5, split_by=SPLIT_BY_QUERY, processes=1,
+                 seed=None):
+        """
+        Initializes the cross-validation.
+
+        :param click_model_classes: The list of click model classes to cross-validate, e.g., [PBM, UBM, DBN],
+            or the dictionary {name: factory} of functions that create configured untrained click models,
+            e.g., {'UBM': UBM, 'UBM-10': functools.partial(UBM, EMInference(10))}
+            (see Utils.get_click_model_factories).
+        :param evaluations: The list of evaluation methods, e.g., [LogLikelihood(), Perplexity()].
+        :param fold_num: The number of folds.
+        :param split_by: How to split search sessions into folds: SPLIT_BY_QUERY or SPLIT_BY_TIME.
+            When splitting by time, test sessions of queries that do not occur in the training folds are discarded
+            (as in examples/Example.py).
+        :param processes: The number of worker processes.
+        :param seed: The seed of the random assignment of queries to folds.
+        """
+        if split_by not in (self.SPLIT_BY_QUERY, self.SPLIT_BY_TIME):
+            raise ValueError("Unknown split: %s" % split_by)
+
+        self.click_model_classes = click_model_classes
+        self.evaluations = evaluations
+        self.fold_num = fold_num
+        self.split_by = split_by
+        self.processes = processes
+        self.seed = seed
+
+    def get_folds(self, search_sessions):
+        """
+        Splits the given search sessions into folds.
+
+        :param search_sessions: The list of search sessions.
+        :returns: The list of folds, each fold is a list of search sessions.
+        """
+        folds = [[] for _ in range(self.fold_num)]
+
+        if self.split_by == self.SPLIT_BY_TIME:
+            for i, search_session in enumerate(search_sessions):
+                folds[i * self.fold_num // len(search_sessions)].append(search_session)
+        else:
+            queries = sorted(Utils.get_unique_queries(search_sessions), key=str)
+            random.Random(self.seed).shuffle(queries)
+            query_folds = dict((query, i % self.fold_num) for i, query in enumerate(queries))
+
+            for search_session in search_sessions:
+                folds[query_folds[search_session.query]].append(search_session)
+
+        return folds
+
+    def run(self, search_sessions):
+        """
+        Cross-validates the click models on the given search sessions.
+
+        :param search_sessions: The list of search sessions.
+        :returns: The dictionary {click_model_name: CrossValidationResult}.
+            The values of metrics are listed in the order of the given evaluation methods.
+        """
+        folds = self.get_folds(search_sessions)
+        jobs = [(click_model_name, click_model_factory, fold)
+                for click_model_name, click_model_factory in Utils.get_click_model_factories(self.click_model_classes)
+                for fold in range(self.fold_num)]
+
+        # Jobs are passed to worker processes by index, since factories (e.g., lambdas) may not be picklable
+        run_job = lambda job: self._run_fold(jobs[job][1], folds, jobs[job][2])
+        if self.processes > 1:
+            job_results = Utils.fork_imap(run_job, range(len(jobs)), self.processes)
+        else:
+            job_results = map(run_job, range(len(jobs)))
+
+        fold_results = collections.defaultdict(list)
+        train_times = collections.defaultdict(list)
+        for (click_model_name, _, _), (train_time, values) in zip(jobs, job_results):
+            fold_results[click_model_name].append(values)
+            train_times[click_model_name].append(train_time)
+
+        results = {}
+        for click_model_name, values in fold_results.items():
+            mean = _aggregate(_mean, values)
+            std = _aggregate(_std, values)
+            results[click_model_name] = CrossValidationResult(values, mean, std, train_times[click_model_name])
+        return results
+
+    def _run_fold(self, click_model_factory, folds, test_fold):
+        """
+        Trains a new click model on all folds but the given one and evaluates it on the given fold.
+
+        :returns: The training time and the list of metric values.
+        """
+        train_sessions = [search_session for fold, fold_sessions in enumerate(folds) if fold != test_fold
+                          for search_session in fold_sessions]
+        test_sessions = folds[test_fold]
+        if self.split_by == self.SPLIT_BY_TIME:
+            test_sessions = Utils.filter_sessions(test_sessions, Utils.get_unique_queries(train_sessions))
+
+        click_model = click_model_factory()
+        start = time.time()
+        click_model.train(train_sessions)
+        train_time = time.time() - start
+        click_model.freeze()
+
+        if all(isinstance(evaluation, ClickProbEvaluation) for evaluation in self.evaluations):
+            values = MultiEvaluation(self.evaluations).evaluate(click_model, test_sessions)
+        else:
+            values = [evaluation.evaluate(click_model, test_sessions) for evaluation in self.evaluations]
+
+        return train_time, values
+
+
+def _mean(values):
+    return sum(values) / len(values)
+
+
+def _std(values):
+    if len(values) < 2:
+        return 0.0
+    mean = _mean(values)
+    return math.sqrt(sum((x - mean) ** 2 for x in values) / (len(values) - 1))
+
+
+def _aggregate(func, values):
+    """
+    Aggregates the given metric values, which can be numbers or (nested) lists or tuples of numbers,
+    by applying the given function to each number over all values.
+    """
+    if isinstance(values[0], (list, tuple)):
+        return type(values[0])(_aggregate(func, [value[i] for value in values]) for i in range(len(values[0])))
+    return func(values)
@@ -82,6 +82,22 @@ class DBN(ClickModel):
         session_params = self.get_session_params(search_session)
         return self._get_tail_clicks(search_session, 0, session_params)[0]
 
+    def _sample_session_clicks(self, search_session, sample):
+        attr_params = self.params[self.param_names.attr]
+        sat_params = self.params[self.param_names.sat]
+        cont = self.params[self.param_names.cont].get().value()
+        clicks = [0] * len(search_session.web_results)
+
+        for rank, result in enumerate(search_session.web_results):
+            if sample() < attr_params.get(search_session.query, result.id).value():
+                clicks[rank] = 1
+                if sample() < sat_params.get(search_session.query, result.id).value():
+                    break
+            if sample() >= cont:
+                break
+
+        return clicks
+
     def predict_relevance(self, query, search_result):
         attr = self.params[self.param_names.attr].get(query, search_result).value()
         sat = self.params[self.param_names.sat].get(query, search_result).value()
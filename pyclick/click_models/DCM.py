@@ -72,6 +72,19 @@ class DCM(ClickModel):
 
         return click_probs
 
+    def _sample_session_clicks(self, search_session, sample):
+        attr_params = self.params[self.param_names.attr]
+        cont_params = self.params[self.param_names.cont]
+        clicks = [0] * len(search_session.web_results)
+
+        for rank, result in enumerate(search_session.web_results):
+            if sample() < attr_params.get(search_session.query, result.id).value():
+                clicks[rank] = 1
+                if sample() >= cont_params.get(rank).value():
+                    break
+
+        return clicks
+
     def predict_relevance(self, query, search_result):
         return self.params[self.param_names.attr].get(query, search_result).value()
 
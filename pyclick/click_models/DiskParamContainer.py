@@ -0,0 +1,181 @@
+#
+# Copyright (C) 2015  Ilya Markov
+#
+# Full copyright notice can be found in LICENSE.
+#
+from collections import OrderedDict
+
+try:
+    import dbm
+except ImportError:
+    import anydbm as dbm
+
+from pyclick.click_models.Param import ParamStatic
+from pyclick.click_models.ParamContainer import QueryDocumentParamContainer
+from pyclick.utils.BinaryFormat import BinaryFormat
+
+__author__ = 'Ilya Markov'
+
+
+class DiskQueryDocumentParamContainer(QueryDocumentParamContainer):
+    """
+    A read-only container of click model parameters that depend on a query-document pair,
+    which are stored on disk in a key-value store (see dbm) with a bounded in-memory cache.
+
+    The parameters of a query are read from the store on the first access to this query
+    and are kept in memory until the cache exceeds the given budget,
+    in which case the least recently used queries are evicted.
+    So, frequent queries are served from memory, while the long tail is read from disk.
+    Unlike ShardedQueryDocumentParamContainer, a miss reads a single query rather than a whole shard.
+
+    The memory budget is given as the number of parameters kept in memory (see __init__).
+    A parameter costs about get_memory_footprint()['total'] / get_memory_footprint()['param_num'] bytes
+    of a fully loaded container (including its query and document),
+    so a budget in bytes can be converted by dividing it by this number.
+
+    The container is always frozen (see ParamContainer.freeze):
+    parameters of unseen query-document pairs take the prior value.
+    A compiled container (see compile) reads queries from the store as well.
+    """
+
+    _STATE_SIZE_KEY = b'#state_size'
+    """The key of the number of values in the state of a parameter (keys of queries start with a type tag)."""
+
+    def __init__(self, param_class, path, max_params=None, *args):
+        """
+        Initializes the container.
+
+        :param param_class: The class of parameters to be stored in the container.
+        :param path: The path of the key-value store (see write_store).
+        :param max_params: The memory budget: the maximum number of parameters (not bytes) to keep in memory
+            (a query that is not in the store counts as one parameter).
+            If not set, loaded queries are never evicted.
+        :param args: The arguments needed to create a parameter instance (optional).
+        """
+        super(DiskQueryDocumentParamContainer, self).__init__(param_class, *args)
+        self.path = path
+        self.max_params = max_params
+
+        self.hit_num = 0
+        """The number of lookups of queries that were in memory."""
+        self.miss_num = 0
+        """The number of lookups of queries that were read from disk."""
+
+        self._container = OrderedDict()
+        """The loaded queries in the order of their last use: {query: {search_result: param}}."""
+        self._param_num = 0
+        """The number of loaded parameters."""
+        self._stored_param_class = param_class
+        """The class of parameters in the store, which does not change when the container is compiled."""
+        self._stored_param_args = args
+
+        state_size = len(self._param_class(*self._param_args).get_state())
+        self._state_struct = self._get_state_struct(state_size)
+        self._store = dbm.open(path, 'r')
+
+        stored_state_size = int(self._store[self._STATE_SIZE_KEY])
+        if stored_state_size != state_size:
+            self._store.close()
+            raise ValueError("Parameters of %s have %d values, but %d are stored" %
+                             (self._param_class.__name__, state_size, stored_state_size))
+
+        self.freeze()
+
+    @classmethod
+    def write_store(cls, container, path):
+        """
+        Writes the parameters of the given container into a new key-value store.
+
+        :param container: The container of parameters that depend on a query-document pair.
+        :param path: The path of the key-value store.
+        """
+        state_size = len(container._param_class(*container._param_args).get_state())
+        state_struct = cls._get_state_struct(state_size)
+
+        store = dbm.open(path, 'n')
+        try:
+            store[cls._STATE_SIZE_KEY] = str(state_size).encode('ascii')
+            for query, results in container._container.items():
+                key = bytearray()
+                BinaryFormat.pack_key(key, query)
+                value = bytearray()
+                cls._pack_query(value, (query, results), state_struct)
+                store[bytes(key)] = bytes(value)
+        finally:
+            store.close()
+
+    def get(self, query, search_result):
+        results = self._container.get(query)
+
+        if results is None:
+            self.miss_num += 1
+            results = self._load_query(query)
+        else:
+            self.hit_num += 1
+            self._container[query] = self._container.pop(query)
+
+        if search_result not in results:
+            return self._prior
+        return results[search_result]
+
+    def unfreeze(self):
+        raise RuntimeError("Cannot unfreeze a disk-backed parameter container")
+
+    def prune(self, min_observation_num=None, epsilon=None):
+        raise RuntimeError("Cannot prune a disk-backed parameter container, prune the container before writing it")
+
+    def compile(self):
+        """
+        Returns an inference-only snapshot of the container (see ParamContainer.compile).
+        The snapshot shares the store with the container (so closing either of them closes both):
+        it compiles the loaded queries and each query it reads later, and keeps the same memory budget.
+
+        :returns: The compiled copy of the container.
+        """
+        compiled = super(DiskQueryDocumentParamContainer, self).compile()
+        compiled._container = OrderedDict(compiled._container)
+        return compiled
+
+    def get_hit_rate(self):
+        """
+        Returns the fraction of lookups of queries that were served from memory.
+
+        :returns: The hit rate of the cache or None if there were no lookups.
+        """
+        lookup_num = self.hit_num + self.miss_num
+        return self.hit_num / float(lookup_num) if lookup_num else None
+
+    def close(self):
+        """Closes the key-value store. The container cannot read new queries after that."""
+        self._store.close()
+
+    def _new_param(self, state):
+        param = self._stored_param_class(*self._stored_param_args)
+        param.set_state(state)
+        return ParamStatic(param.value()) if self._compiled else param
+
+    def _load_query(self, query):
+        """
+        Reads the parameters of the given query from the store into memory
+        and evicts the least recently used queries if the number of loaded parameters exceeds the budget.
+
+        :param query: The query.
+        :returns: The dictionary of parameters of the search results of the query.
+        """
+        key = bytearray()
+        BinaryFormat.pack_key(key, query)
+        value = self._store.get(bytes(key))
+
+        results = {}
+        if value is not None:
+            (_, query_results), _ = self._unpack_query(value, 0, self._state_struct)
+            results = dict(query_results)
+
+        self._container[query] = results
+        self._param_num += max(len(results), 1)
+
+        while self.max_params is not None and self._param_num > self.max_params and len(self._container) > 1:
+            _, evicted_results = self._container.popitem(last=False)
+            self._param_num -= max(len(evicted_results), 1)
+
+        return results
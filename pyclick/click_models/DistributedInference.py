@@ -0,0 +1,201 @@
+#
+# Copyright (C) 2015  Ilya Markov
+#
+# Full copyright notice can be found in LICENSE.
+#
+import copy
+import io
+import time
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client, Listener
+
+from pyclick.click_models.Inference import EMInference
+
+__author__ = 'Ilya Markov'
+
+
+class DistributedEMInference(EMInference):
+    """
+    The expectation-maximization (EM) inference distributed over worker processes, possibly on different hosts.
+
+    Each worker holds a shard of the training search sessions (see run_worker).
+    In each iteration, the coordinator (see infer_params) sends the current parameters to all workers,
+    each worker computes the parameters of a new click model on its shard,
+    i.e., the sufficient statistics of EM, and sends them back,
+    and the coordinator merges them using ClickModel.__iadd__.
+    The coordinator can also hold a shard, which it processes while waiting for the workers.
+    The result is the same as that of EMInference on all shards together
+    (up to the order of summation of floating point numbers).
+
+    Click models are sent in the binary format (see ClickModel.to_binary) over multiprocessing.connection,
+    so no objects are unpickled. Connections are authenticated with the given key.
+
+    Profiling callbacks (see InferenceProfiler) are supported on the coordinator only:
+    the time of iterations and the throughput cover all shards,
+    while the time spent on session parameters and updates covers the shard of the coordinator.
+    Workers are not instrumented.
+    """
+
+    CONNECT_TIMEOUT = 60
+    """The number of seconds a worker waits for the coordinator to start listening."""
+
+    _ITERATE = b'I'
+    _STOP = b'S'
+
+    def __init__(self, address, authkey, worker_num=1, iter_num=EMInference.ITERATION_NUM, tolerance=None):
+        """
+        Initializes the distributed EM inference.
+
+        :param address: The address of the coordinator, e.g., ('0.0.0.0', 6000) for the coordinator
+            and ('coordinator-host', 6000) for workers.
+        :param authkey: The secret key (bytes) shared by the coordinator and the workers.
+        :param worker_num: The number of workers the coordinator waits for (not used by workers).
+        :param iter_num: The (maximum) number of iterations to use.
+        :param tolerance: If set, the inference stops as soon as no parameter changes by more than the tolerance
+            during an iteration (see EMInference.get_max_delta).
+        """
+        super(DistributedEMInference, self).__init__(iter_num, tolerance)
+        self.address = address
+        self.authkey = authkey
+        self.worker_num = worker_num
+        self.session_num = 0
+        """The total number of search sessions of the coordinator and the workers in the last call of infer_params."""
+
+    def infer_params(self, click_model, search_sessions, callbacks=None, initial_model=None):
+        """
+        Coordinates the inference: waits for worker_num workers to connect and runs the iterations of EM.
+        Connections that fail the authentication or break before the worker reports its shard are dropped.
+        Callbacks are notified with the total number of search sessions of all shards
+        (see InferenceCallback.on_train_begin).
+
+        :param click_model: The click model to train.
+        :param search_sessions: The shard of search sessions processed by the coordinator (can be empty).
+        :param callbacks: The list of callbacks to notify about the progress of inference (see InferenceCallback).
+        :param initial_model: The click model to take the initial values of parameters from (see ClickModel.train).
+        :returns: The number of performed iterations.
+        """
+        search_sessions = search_sessions or []
+        callbacks = callbacks or []
+        profilers = self._get_profilers(callbacks)
+
+        listener = Listener(self.address, authkey=self.authkey)
+        connections = []
+        iterations_done = 0
+
+        try:
+            self.session_num = len(search_sessions)
+            while len(connections) < self.worker_num:
+                connection = None
+                try:
+                    connection = listener.accept()
+                    self.session_num += int(connection.recv_bytes())
+                except (AuthenticationError, EOFError, IOError, OSError):
+                    # A connection without the shared key or a broken one is dropped,
+                    # the coordinator keeps waiting for workers
+                    if connection is not None:
+                        connection.close()
+                    continue
+                connections.append(connection)
+
+            for callback in callbacks:
+                callback.on_train_begin(click_model, search_sessions, self.iter_num, session_num=self.session_num)
+
+            orig_click_model = copy.deepcopy(click_model)
+            current_click_model = initial_model if initial_model is not None else click_model
+
+            for iteration in range(self.iter_num):
+                for callback in callbacks:
+                    callback.on_iteration_begin(iteration)
+
+                message = self._ITERATE + self._to_bytes(current_click_model)
+                for connection in connections:
+                    connection.send_bytes(message)
+
+                new_click_model = copy.deepcopy(orig_click_model)
+                read_only_model = self._get_read_only_copy(current_click_model)
+                self._run_iteration(iteration, search_sessions,
+                                    lambda sessions: self._update_params(read_only_model, new_click_model,
+                                                                         sessions, profilers),
+                                    callbacks)
+
+                for connection in connections:
+                    new_click_model += self._from_bytes(orig_click_model, connection.recv_bytes())
+
+                converged = self._is_converged(current_click_model, new_click_model)
+                click_model.params = new_click_model.params
+                current_click_model = click_model
+                iterations_done = iteration + 1
+
+                for callback in callbacks:
+                    callback.on_iteration_end(iteration, click_model)
+
+                if converged:
+                    break
+        finally:
+            for connection in connections:
+                try:
+                    connection.send_bytes(self._STOP)
+                except (IOError, OSError):
+                    pass
+                connection.close()
+            listener.close()
+
+        for callback in callbacks:
+            callback.on_train_end(click_model)
+
+        return iterations_done
+
+    def run_worker(self, click_model, search_sessions):
+        """
+        Runs a worker: connects to the coordinator and computes the parameters of a new click model
+        on the given shard of search sessions in each iteration, until the coordinator stops the inference.
+
+        :param click_model: The untrained click model of the same class as the one trained by the coordinator.
+        :param search_sessions: The shard of search sessions held by the worker.
+        """
+        connection = self._connect()
+
+        try:
+            connection.send_bytes(str(len(search_sessions)).encode('ascii'))
+            orig_click_model = copy.deepcopy(click_model)
+
+            while True:
+                message = connection.recv_bytes()
+                if message[:1] != self._ITERATE:
+                    break
+
+                current_click_model = self._from_bytes(orig_click_model, message, offset=len(self._ITERATE))
+                current_click_model.freeze()
+                new_click_model = copy.deepcopy(orig_click_model)
+                # Workers are not instrumented, see the profiling on the coordinator
+                self._update_params(current_click_model, new_click_model, search_sessions, [])
+
+                connection.send_bytes(self._to_bytes(new_click_model))
+        finally:
+            connection.close()
+
+    def _connect(self):
+        """Connects to the coordinator, retrying until it starts listening or CONNECT_TIMEOUT expires."""
+        deadline = time.time() + self.CONNECT_TIMEOUT
+        while True:
+            try:
+                return Client(self.address, authkey=self.authkey)
+            except (IOError, OSError):
+                if time.time() > deadline:
+                    raise
+                time.sleep(0.1)
+
+    @staticmethod
+    def _to_bytes(click_model):
+        stream = io.BytesIO()
+        click_model.to_binary(stream)
+        return stream.getvalue()
+
+    @staticmethod
+    def _from_bytes(orig_click_model, data, offset=0):
+        """Returns a copy of the given untrained click model with the parameters read from the given bytes."""
+        click_model = copy.deepcopy(orig_click_model)
+        stream = io.BytesIO(data)
+        stream.seek(offset)
+        click_model.from_binary(stream)
+        return click_model
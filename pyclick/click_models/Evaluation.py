@@ -5,17 +5,73 @@
 #
 from __future__ import division, print_function
 from abc import abstractmethod
-#from sklearn.metrics import roc_auc_score
-#from scipy.stats import pearsonr
-#import numpy as np
+from functools import partial
+from itertools import chain, islice
+from operator import itemgetter
 import math
 import collections
+import random
 import sys
 
+from pyclick.utils.Statistics import Statistics
+from pyclick.utils.Utils import Utils
+
+try:
+    from itertools import zip_longest
+except ImportError:
+    from itertools import izip_longest as zip_longest
+
 __author__ = 'Luka Stout, Finde Xumara, Ilya Markov'
 
 
-RANK_MAX = 10
+LOG_2 = math.log(2)
+"""The natural logarithm of 2, used to compute base-2 logarithms the same way as math.log(x, 2) does."""
+
+
+def _get_click_prob_matrix(get_click_probs, search_sessions):
+    """
+    Computes click probabilities for a batch of search sessions.
+
+    :param get_click_probs: The function that returns click probabilities for a search session,
+        e.g., click_model.get_conditional_click_probs.
+    :param search_sessions: The list of search sessions.
+    :returns: The list of lists of click probabilities, one list per search session.
+    """
+    return [get_click_probs(search_session) for search_session in search_sessions]
+
+
+def _group_by_depth(click_prob_matrix):
+    """
+    Groups the lists of click probabilities of search sessions by their length,
+    so that each group can be reduced per rank.
+
+    :param click_prob_matrix: The list of lists of click probabilities, one list per search session.
+    :returns: The dictionary {depth: [click_probs1, click_probs2, ...]}.
+    """
+    groups = collections.defaultdict(list)
+    for click_probs in click_prob_matrix:
+        groups[len(click_probs)].append(click_probs)
+    return groups
+
+
+def _add_log2_sums_at_rank(click_prob_matrix, log2_sum_at_rank):
+    """
+    Adds base-2 logarithms of the given click probabilities of search sessions of the same depth
+    to the given sums at the corresponding ranks (None probabilities are skipped).
+    Each rank is reduced at once: the logarithms of its column are summed with math.fsum.
+    The list of sums grows if the sessions are deeper than the sessions added so far.
+
+    :param click_prob_matrix: The list of lists of click probabilities of search sessions of the same depth.
+    :param log2_sum_at_rank: The list of sums of base-2 logarithms, one sum per rank, which is updated in place.
+    """
+    depth = len(click_prob_matrix[0]) if click_prob_matrix else 0
+    if depth > len(log2_sum_at_rank):
+        log2_sum_at_rank.extend([0.0] * (depth - len(log2_sum_at_rank)))
+
+    for rank, column in enumerate(zip(*click_prob_matrix)):
+        if None in column:
+            column = [click_prob for click_prob in column if click_prob is not None]
+        log2_sum_at_rank[rank] += math.fsum(map(math.log, column)) / LOG_2
 
 
 class Evaluation(object):
@@ -29,35 +85,250 @@ class Evaluation(object):
         This method must be implemented by subclasses.
 
         :param click_model: The click model to evaluate.
-        :param search_sessions: The list of search sessions (also known as test set).
+        :param search_sessions: The iterable of search sessions (also known as test set).
         :return: The quality of the click model, given the set of test search sessions.
         """
         pass
 
 
-class LogLikelihood(Evaluation):
+class ClickProbEvaluation(Evaluation):
+    """
+    An abstract evaluation method that is based on click probabilities predicted by a click model.
+
+    The evaluation is computed by an accumulator (see MetricAccumulator),
+    which is fed with batches of search sessions and the corresponding click probabilities.
+    This way, multiple evaluation methods can share a single pass over the test set (see MultiEvaluation).
+    """
+
+    uses_conditional_click_probs = False
+    """Whether the evaluation method needs conditional click probabilities (see ClickModel)."""
+
+    uses_full_click_probs = False
+    """Whether the evaluation method needs full click probabilities (see ClickModel)."""
+
+    def evaluate(self, click_model, search_sessions):
+        return MultiEvaluation([self]).evaluate(click_model, search_sessions)[0]
+
+    @abstractmethod
+    def get_accumulator(self):
+        """
+        Creates an empty accumulator of the evaluation method.
+
+        :returns: The accumulator of the evaluation method.
+        """
+        pass
+
+
+class MetricAccumulator(object):
+    """
+    An abstract accumulator of an evaluation metric over batches of search sessions.
+
+    An accumulator keeps a constant-size summary of the search sessions added so far,
+    so a test set can be streamed through it in batches.
+    Accumulators computed on different parts of a test set (e.g., shards) can be concatenated using +=.
+    """
+
+    @abstractmethod
+    def add(self, search_sessions, conditional_click_probs, full_click_probs):
+        """
+        Adds the given batch of search sessions to the metric.
+
+        :param search_sessions: The batch of search sessions.
+        :param conditional_click_probs: The list of conditional click probabilities for each search session
+            (None if the metric does not use them).
+        :param full_click_probs: The list of full click probabilities for each search session
+            (None if the metric does not use them).
+        """
+        pass
+
+    @abstractmethod
+    def get_result(self):
+        """
+        Returns the value of the metric over all search sessions added so far.
+
+        :returns: The value of the metric.
+        """
+        pass
+
+    @abstractmethod
+    def get_session_stats(self, search_sessions, conditional_click_probs, full_click_probs):
+        """
+        Returns the contribution of each of the given search sessions to the metric
+        as a list of additive statistics (see BootstrapEvaluation).
+        Lists of different search sessions may have different lengths;
+        missing statistics at the end of a list are zeros.
+
+        :param search_sessions: The batch of search sessions.
+        :param conditional_click_probs: The list of conditional click probabilities for each search session
+            (None if the metric does not use them).
+        :param full_click_probs: The list of full click probabilities for each search session
+            (None if the metric does not use them).
+        :returns: The list of lists of statistics, one list per search session.
+        """
+        pass
+
+    @abstractmethod
+    def get_result_from_stats(self, stats):
+        """
+        Returns the value of the metric, given the (possibly weighted) sums of statistics over search sessions
+        (see get_session_stats).
+
+        :param stats: The list of sums of statistics.
+        :returns: The value of the metric.
+        """
+        pass
+
+    @abstractmethod
+    def __iadd__(self, other):
+        """
+        Concatenates the current accumulator and the _other_ accumulator of the same metric,
+        e.g., computed on another part of the test set.
+        Returns the concatenated accumulator.
+
+        :param other: The accumulator to concatenate with the current one.
+        :returns: The concatenated accumulator.
+        """
+        pass
+
+
+class LogLikelihood(ClickProbEvaluation):
     """
     The log-likelihood evaluation of click models.
     """
     #TODO: according to what paper?
 
+    uses_conditional_click_probs = True
+
     def evaluate(self, click_model, search_sessions):
         """
         Returns the log-likelihood of search sessions, given a click model.
         LL(Sessions | Model) = sum_{session in Sessions} P(clicks in the session | Model)
         """
-        loglikelihood = 0
+        return super(LogLikelihood, self).evaluate(click_model, search_sessions)
 
-        for session in search_sessions:
-            click_probs = click_model.get_conditional_click_probs(session)
-            log_click_probs = [math.log(prob) for prob in click_probs]
-            loglikelihood += sum(log_click_probs) / len(log_click_probs)
-        loglikelihood /= len(search_sessions)
+    def get_accumulator(self):
+        return LogLikelihoodAccumulator()
+
+
+class LogLikelihoodAccumulator(MetricAccumulator):
+    """The accumulator of the log-likelihood (see LogLikelihood)."""
+
+    def __init__(self):
+        self.loglikelihood = 0
+        self.session_num = 0
+
+    def add(self, search_sessions, conditional_click_probs, full_click_probs):
+        # The log-likelihood of a search session is averaged over its ranks,
+        # so the logarithms of all sessions of the same depth are summed at once
+        for depth, click_prob_matrix in _group_by_depth(conditional_click_probs).items():
+            self.loglikelihood += math.fsum(map(math.log, chain.from_iterable(click_prob_matrix))) / depth
+        self.session_num += len(conditional_click_probs)
+
+    def get_result(self):
+        return self.loglikelihood / self.session_num
+
+    def get_session_stats(self, search_sessions, conditional_click_probs, full_click_probs):
+        return [[sum(map(math.log, click_probs)) / len(click_probs), 1] for click_probs in conditional_click_probs]
+
+    def get_result_from_stats(self, stats):
+        loglikelihood, session_num = stats
+        return loglikelihood / session_num
+
+    def __iadd__(self, other):
+        self.loglikelihood += other.loglikelihood
+        self.session_num += other.session_num
+        return self
+
+
+class PerplexityAccumulator(MetricAccumulator):
+    """
+    The accumulator of the perplexity (see Perplexity and PerplexityCond).
+    Sums base-2 logarithms of the probabilities of observed clicks and skips at each rank
+    and counts search sessions by their depth, so SERPs of any depth can be evaluated.
+    The perplexity at a given rank is averaged over search sessions that have a result at this rank.
+    """
+
+    def __init__(self, conditional):
+        """
+        Initializes the accumulator.
+
+        :param conditional: Whether to compute the conditional perplexity (see PerplexityCond)
+            or the standard one (see Perplexity).
+        """
+        self.conditional = conditional
+        self.log2_sum_at_rank = []
+        self.session_num_by_depth = collections.Counter()
+
+    def add(self, search_sessions, conditional_click_probs, full_click_probs):
+        observed_click_probs = self._get_observed_click_probs(search_sessions, conditional_click_probs,
+                                                              full_click_probs)
+        for depth, click_prob_matrix in _group_by_depth(observed_click_probs).items():
+            _add_log2_sums_at_rank(click_prob_matrix, self.log2_sum_at_rank)
+            self.session_num_by_depth[depth] += len(click_prob_matrix)
+
+    def get_session_stats(self, search_sessions, conditional_click_probs, full_click_probs):
+        # The sum of base-2 logarithms and the number of search sessions at each rank, interleaved
+        return [[x for p in click_probs for x in (math.log(p, 2) if p is not None else 0.0, 1)]
+                for click_probs in self._get_observed_click_probs(search_sessions, conditional_click_probs,
+                                                                  full_click_probs)]
+
+    def get_result_from_stats(self, stats):
+        perplexity_at_rank = [2 ** (-x / session_num) if session_num else float('nan')
+                              for x, session_num in zip(stats[0::2], stats[1::2])]
+        perplexity = sum(perplexity_at_rank) / len(perplexity_at_rank)
+        return perplexity, perplexity_at_rank
+
+    def _get_observed_click_probs(self, search_sessions, conditional_click_probs, full_click_probs):
+        """
+        Yields the probabilities of the observed clicks and skips of each search session, to be used by the perplexity.
+        Non-positive probabilities are replaced with None.
+        """
+        if self.conditional:
+            for click_probs in conditional_click_probs:
+                yield click_probs
+            return
+
+        for click_probs, session in zip(full_click_probs, search_sessions):
+            # Probabilities of the observed clicks and skips
+            click_probs = [click_prob if click else 1 - click_prob
+                           for click_prob, click in zip(click_probs, session.get_clicks())]
+
+            if click_probs and min(click_probs) <= 0:
+                for rank, p in enumerate(click_probs):
+                    if p <= 0:
+                        print('Click probability is not positive: %f' % p, file=sys.stderr)
+                        click_probs[rank] = None
+
+            yield click_probs
+
+    def get_session_num_at_rank(self):
+        """
+        Returns the number of search sessions that have a result at each rank.
+
+        :returns: The list of numbers of search sessions, one number per rank.
+        """
+        session_num_at_rank = [0] * len(self.log2_sum_at_rank)
+        for depth, session_num in self.session_num_by_depth.items():
+            for rank in range(depth):
+                session_num_at_rank[rank] += session_num
+        return session_num_at_rank
+
+    def get_result(self):
+        perplexity_at_rank = [2 ** (-x / session_num)
+                              for x, session_num in zip(self.log2_sum_at_rank, self.get_session_num_at_rank())]
+        perplexity = sum(perplexity_at_rank) / len(perplexity_at_rank)
+        return perplexity, perplexity_at_rank
 
-        return loglikelihood 
+    def __iadd__(self, other):
+        assert self.conditional == other.conditional
 
+        self.log2_sum_at_rank = [x + y for x, y in zip_longest(self.log2_sum_at_rank, other.log2_sum_at_rank,
+                                                               fillvalue=0.0)]
+        self.session_num_by_depth.update(other.session_num_by_depth)
+        return self
 
-class Perplexity(Evaluation):
+
+class Perplexity(ClickProbEvaluation):
     """
     The perplexity evaluation of click models.
 
@@ -66,33 +337,20 @@ class Perplexity(Evaluation):
     Proceedings of SIGIR, pages 331-338, 2008.
     """
 
+    uses_full_click_probs = True
+
     def evaluate(self, click_model, search_sessions):
         """
         Given a click model and search sessions, returns the following:
         perplexity, [perplexity_at_1, ..., perplexity_at_N]
         """
-        perplexity_at_rank = [0.0] * RANK_MAX
+        return super(Perplexity, self).evaluate(click_model, search_sessions)
 
-        for session in search_sessions:
-            click_probs = click_model.get_full_click_probs(session)
-
-            for rank, click_prob in enumerate(click_probs):
-                if session.web_results[rank].click:
-                    p = click_prob
-                else:
-                    p = 1 - click_prob
+    def get_accumulator(self):
+        return PerplexityAccumulator(False)
 
-                if p > 0:
-                    perplexity_at_rank[rank] += math.log(p, 2)
-                else:
-                    print('Click probability is not positive: %f' % p, file=sys.stderr)
 
-        perplexity_at_rank = [2 ** (-x / len(search_sessions)) for x in perplexity_at_rank]
-        perplexity = sum(perplexity_at_rank) / len(perplexity_at_rank)
-        return perplexity, perplexity_at_rank
-
-
-class PerplexityCond(Evaluation):
+class PerplexityCond(ClickProbEvaluation):
     """
     The conditional perplexity evaluation of click models.
 
@@ -101,28 +359,270 @@ class PerplexityCond(Evaluation):
     Proceedings of SIGIR, pages 331-338, 2008.
     """
 
+    uses_conditional_click_probs = True
+
     def evaluate(self, click_model, search_sessions):
         """
         Given a click model and search sessions, returns the following:
         perplexity, [perplexity_at_1, ..., perplexity_at_N]
         """
-        perplexity_at_rank = [0.0] * RANK_MAX
+        return super(PerplexityCond, self).evaluate(click_model, search_sessions)
 
-        for session in search_sessions:
-            click_probs = click_model.get_conditional_click_probs(session)
+    def get_accumulator(self):
+        return PerplexityAccumulator(True)
 
-            for rank, click_prob in enumerate(click_probs):
-                perplexity_at_rank[rank] += math.log(click_prob, 2)
 
-        perplexity_at_rank = [2 ** (-x / len(search_sessions)) for x in perplexity_at_rank]
-        perplexity = sum(perplexity_at_rank) / len(perplexity_at_rank)
-        return perplexity, perplexity_at_rank
+class MultiEvaluation(Evaluation):
+    """
+    Computes multiple evaluation metrics in a single pass over search sessions.
+
+    Click probabilities are computed once per search session and batch
+    and are shared by all metrics (see ClickProbEvaluation),
+    so reporting several metrics costs about the same as reporting one of them.
+
+    Search sessions are read in batches from any iterable (e.g., a generator that parses a log file),
+    so only one batch per process is held in memory.
+    Each batch is accumulated separately and then the batch accumulators are concatenated in the order of batches.
+    So, batches can be evaluated in parallel worker processes,
+    and the result does not depend on the number of processes.
+    """
+
+    BATCH_SIZE = 1000
+    """The default number of search sessions, for which click probabilities are computed at once."""
+
+    def __init__(self, evaluations, batch_size=BATCH_SIZE, processes=1):
+        """
+        Initializes the evaluation with the given metrics.
+
+        :param evaluations: The list of evaluation methods to compute (instances of ClickProbEvaluation),
+            e.g., [LogLikelihood(), Perplexity(), PerplexityCond()].
+        :param batch_size: The number of search sessions, for which click probabilities are computed at once.
+        :param processes: The number of worker processes to evaluate batches in (see Utils.fork_imap).
+            Workers share a read-only copy of the click model with the current process,
+            while batches of search sessions are sent to them.
+        """
+        for evaluation in evaluations:
+            if not isinstance(evaluation, ClickProbEvaluation):
+                raise ValueError("%s cannot be computed in a single pass" % evaluation.__class__.__name__)
+
+        self.evaluations = evaluations
+        self.batch_size = batch_size
+        self.processes = processes
+
+    def evaluate(self, click_model, search_sessions):
+        """
+        Returns the list of values of the metrics, in the order of the given evaluation methods.
+        """
+        return [accumulator.get_result() for accumulator in self.accumulate(click_model, search_sessions)]
+
+    def accumulate(self, click_model, search_sessions):
+        """
+        Accumulates the metrics over the given search sessions without computing their final values.
+        Accumulators of different parts of a test set can be concatenated using +=
+        and then the values of the metrics can be obtained by calling get_result of each accumulator.
+
+        :param click_model: The click model to evaluate.
+        :param search_sessions: The iterable of search sessions.
+        :returns: The list of accumulators (see MetricAccumulator), in the order of the given evaluation methods.
+        """
+        evaluate_batch = partial(self._evaluate_batch, click_model)
+
+        if self.processes > 1:
+            batch_accumulators = Utils.fork_imap(evaluate_batch, self._get_batches(search_sessions), self.processes)
+        else:
+            batch_accumulators = map(evaluate_batch, self._get_batches(search_sessions))
+
+        accumulators = [evaluation.get_accumulator() for evaluation in self.evaluations]
+        for batch_accumulator in batch_accumulators:
+            for accumulator, batch_metric_accumulator in zip(accumulators, batch_accumulator):
+                accumulator += batch_metric_accumulator
+
+        return accumulators
+
+    def _get_batches(self, search_sessions):
+        """
+        Splits the given iterable of search sessions into batches.
+
+        :param search_sessions: The iterable of search sessions.
+        :returns: The generator of batches (lists of search sessions).
+        """
+        search_sessions = iter(search_sessions)
+        batch = list(islice(search_sessions, self.batch_size))
+        while batch:
+            yield batch
+            batch = list(islice(search_sessions, self.batch_size))
+
+    def _evaluate_batch(self, click_model, search_sessions):
+        """
+        Computes click probabilities for the given batch of search sessions
+        and accumulates all metrics over this batch.
+
+        :param click_model: The click model to evaluate.
+        :param search_sessions: The batch of search sessions.
+        :returns: The list of accumulators, one per evaluation method.
+        """
+        conditional_click_probs, full_click_probs = self._get_click_probs(click_model, search_sessions)
+
+        accumulators = [evaluation.get_accumulator() for evaluation in self.evaluations]
+        for accumulator in accumulators:
+            accumulator.add(search_sessions, conditional_click_probs, full_click_probs)
+
+        return accumulators
+
+    def _get_click_probs(self, click_model, search_sessions):
+        """
+        Computes the click probabilities needed by the metrics for the given batch of search sessions.
+
+        :param click_model: The click model to evaluate.
+        :param search_sessions: The batch of search sessions.
+        :returns: The lists of conditional and full click probabilities for each search session
+            (None instead of a list if no metric uses them).
+        """
+        conditional_click_probs = _get_click_prob_matrix(click_model.get_conditional_click_probs, search_sessions) \
+            if any(evaluation.uses_conditional_click_probs for evaluation in self.evaluations) else None
+        full_click_probs = _get_click_prob_matrix(click_model.get_full_click_probs, search_sessions) \
+            if any(evaluation.uses_full_click_probs for evaluation in self.evaluations) else None
+        return conditional_click_probs, full_click_probs
+
+
+BootstrapEstimate = collections.namedtuple('BootstrapEstimate', 'value mean std_error lower upper')
+"""
+The bootstrap estimate of a metric value: the value on the test set,
+the mean and standard error of the value over resamples
+and the bounds of the percentile confidence interval.
+"""
+
+
+class BootstrapEvaluation(MultiEvaluation):
+    """
+    Computes bootstrap confidence intervals of multiple evaluation metrics.
+
+    The contribution of each search session to each metric (see MetricAccumulator.get_session_stats)
+    is computed once. A bootstrap resample is then represented by the indices of the drawn search sessions
+    and each metric is computed from the sums of statistics over the drawn sessions
+    (i.e., the sums weighted by the number of times each session is drawn).
+    So, click probabilities are not recomputed for resamples and the cost of a resample
+    is linear in the number of search sessions and statistics.
+
+    Efron, Bradley and Tibshirani, Robert J.
+    An introduction to the bootstrap.
+    Chapman & Hall/CRC, 1994.
+    """
+
+    RESAMPLE_NUM = 1000
+    """The default number of bootstrap resamples."""
+
+    def __init__(self, evaluations, resample_num=RESAMPLE_NUM, confidence=0.95, seed=None,
+                 batch_size=MultiEvaluation.BATCH_SIZE, processes=1):
+        """
+        Initializes the evaluation with the given metrics.
+
+        :param evaluations: The list of evaluation methods to compute (instances of ClickProbEvaluation).
+        :param resample_num: The number of bootstrap resamples.
+        :param confidence: The confidence level of intervals.
+        :param seed: The seed of the random generator of resamples.
+        :param batch_size: The number of search sessions, for which click probabilities are computed at once.
+        :param processes: The number of worker processes to compute click probabilities in (see MultiEvaluation).
+        """
+        super(BootstrapEvaluation, self).__init__(evaluations, batch_size, processes)
+        self.resample_num = resample_num
+        self.confidence = confidence
+        self.seed = seed
+
+    def evaluate(self, click_model, search_sessions):
+        """
+        Returns the list of bootstrap estimates of the metrics, in the order of the given evaluation methods.
+        Each estimate has the same structure as the value of the corresponding metric,
+        where each number is replaced by a BootstrapEstimate,
+        e.g., for the perplexity: BootstrapEstimate, [BootstrapEstimate_at_1, ..., BootstrapEstimate_at_N].
+        """
+        stat_columns = self._get_stat_columns(click_model, search_sessions)
+        accumulators = [evaluation.get_accumulator() for evaluation in self.evaluations]
+        session_num = len(stat_columns[0][0]) if stat_columns[0] else 0
+
+        values = [accumulator.get_result_from_stats([sum(column) for column in columns])
+                  for accumulator, columns in zip(accumulators, stat_columns)]
+        resampled_values = [[] for _ in self.evaluations]
+
+        rnd = random.Random(self.seed)
+        for _ in range(self.resample_num):
+            # The drawn search sessions are gathered from each column by a single itemgetter call,
+            # so a weighted sum costs one lookup and one addition per drawn session
+            indices = [int(rnd.random() * session_num) for _ in range(session_num)]
+            get_drawn = itemgetter(*indices) if session_num > 1 else lambda column: [column[i] for i in indices]
+
+            for accumulator, columns, resampled in zip(accumulators, stat_columns, resampled_values):
+                resampled.append(accumulator.get_result_from_stats([sum(get_drawn(column)) for column in columns]))
+
+        return [self._get_estimate(value, resampled) for value, resampled in zip(values, resampled_values)]
+
+    def _get_stat_columns(self, click_model, search_sessions):
+        """
+        Computes the statistics of each search session for each metric.
+
+        :returns: For each metric, the list of columns of statistics (one value per search session in a column).
+        """
+        get_stats = partial(self._get_batch_stats, click_model)
+        if self.processes > 1:
+            batch_stats = Utils.fork_imap(get_stats, self._get_batches(search_sessions), self.processes)
+        else:
+            batch_stats = map(get_stats, self._get_batches(search_sessions))
+
+        session_stats = [[] for _ in self.evaluations]
+        for batch_evaluation_stats in batch_stats:
+            for stats, batch_session_stats in zip(session_stats, batch_evaluation_stats):
+                stats.extend(batch_session_stats)
+
+        return [[list(column) for column in zip_longest(*stats, fillvalue=0)] for stats in session_stats]
+
+    def _get_batch_stats(self, click_model, search_sessions):
+        conditional_click_probs, full_click_probs = self._get_click_probs(click_model, search_sessions)
+        return [evaluation.get_accumulator().get_session_stats(search_sessions, conditional_click_probs,
+                                                               full_click_probs)
+                for evaluation in self.evaluations]
+
+    def _get_estimate(self, value, resampled):
+        """
+        Computes the bootstrap estimate of the given metric value,
+        which can be a number or a (nested) list or tuple of numbers.
+
+        :param value: The value of the metric on the test set.
+        :param resampled: The list of values of the metric on resamples.
+        :returns: The value of the same structure, where each number is replaced by a BootstrapEstimate.
+        """
+        if isinstance(value, (list, tuple)):
+            return type(value)(self._get_estimate(element, [r[i] for r in resampled])
+                               for i, element in enumerate(value))
+
+        # Resamples that do not contain any search session with a result at some rank are skipped
+        resampled = sorted(x for x in resampled if not math.isnan(x))
+        if not resampled:
+            nan = float('nan')
+            return BootstrapEstimate(value, nan, nan, nan, nan)
+
+        mean = sum(resampled) / len(resampled)
+        std_error = math.sqrt(sum((x - mean) ** 2 for x in resampled) / (len(resampled) - 1)) \
+            if len(resampled) > 1 else 0.0
+        alpha = (1 - self.confidence) / 2
+        return BootstrapEstimate(value, mean, std_error,
+                                 Statistics.percentile(resampled, alpha), Statistics.percentile(resampled, 1 - alpha))
 
 
 class CTRPrediction(Evaluation):
 
     CLICK_TRESHOLD = .75
 
+    def __init__(self, click_model_factory=None):
+        """
+        Initializes the evaluation.
+
+        :param click_model_factory: The function that creates an untrained click model for each train set,
+            e.g., functools.partial(UBM, EMInference(10)) or lambda: SketchDCTR(2 ** 16).
+            If not set, the class of the evaluated click model is instantiated without arguments,
+            so a click model with a non-default configuration (e.g., inference) needs a factory.
+        """
+        self.click_model_factory = click_model_factory
+
     def _group_sessions(self, sessions):
         """
             Group sessions based on query
@@ -136,36 +636,32 @@ class CTRPrediction(Evaluation):
         """
             Splits the sessions in a set of train sets and a set of test sets.
             test_sets[i] belongs to train_sets[i]
+
+            For each document that occurs at the first position,
+            the test set contains all sessions with this document at the first position
+            and the train set contains all other sessions with this document at any other position.
+            Both sets are read from an index of documents built in a single pass over the sessions,
+            so each session is added to at most one test set and to a bounded number of train sets
+            (one per distinct document below the first position).
         """
-        # For every session find out whether there is a document at the first position that also occurs in other positions
+        first_pos_index = collections.OrderedDict()
+        other_pos_index = collections.defaultdict(list)
+
+        for session in sessions:
+            pos_1 = session.web_results[0].id
+            first_pos_index.setdefault(pos_1, []).append(session)
+
+            for doc in set(result.id for result in session.web_results[1:]):
+                if doc != pos_1:
+                    other_pos_index[doc].append(session)
+
         test_sets = []
         train_sets = []
-        for s_idx, session in enumerate(sessions):
-            pos_1 = session.web_results[0].id
-            found_in_other_test_set = False
-
-            #Check whether session is already in a test set.
-            for test in test_sets:
-                if pos_1 == test[0].web_results[0].id:
-                    found_in_other_test_set = True
-            if found_in_other_test_set:
-                break
-                    
-            #If not already in a test set create a new test/train pair
-            test = [session]
-            train = []
-            
-            for session_2 in sessions[:s_idx] + sessions[s_idx+1:]:
-
-                #Add session to test set if they have same doc in pos 1
-                if pos_1 == session_2.web_results[0].id:
-                    test.append(session_2)
-                #Add session to train set if it is in another place than the first
-                elif pos_1 in [result.id for result in session_2.web_results[1:]]:
-                    train.append(session_2)
-            
+        for pos_1, test in first_pos_index.items():
+            train = other_pos_index.get(pos_1)
+
             #Only add if there is both a test and train set.
-            if test and train:
+            if train:
                 test_sets.append(test)
                 train_sets.append(train)
         return train_sets, test_sets
@@ -175,7 +671,11 @@ class CTRPrediction(Evaluation):
             Returns the RMSE of the CTR wrt the given sessions.
             Calculated according section 4.2 of:
             "A Dynamic Bayesian Network Click Model for Web Search Ranking" Chappele and Zhang, 2009
+
+            A new click model (see click_model_factory) is trained for each train set,
+            so the given model is left unchanged.
         """
+        click_model_factory = self.click_model_factory or click_model.__class__
 
         session_dict = self._group_sessions(search_sessions)
         MSEs, weights = [], []
@@ -186,20 +686,18 @@ class CTRPrediction(Evaluation):
             
             # Train the model on the train set and get the predicted clicks of the test set.
             for test, train in zip(test_sets,train_sets):
-                click_model.train(train)
-                pred_clicks, true_clicks = [], []
-                pred_click_prob =  click_model.get_full_click_probs(test[0])[0]
-                for t in test:
-                    true_clicks.append( t.web_results[0].click )
+                split_model = click_model_factory()
+                split_model.train(train)
+                pred_click_prob = split_model.get_full_click_probs(test[0])[0]
 
-                true_ctr = sum(1 for true_click in true_clicks if true_click)/len(true_clicks)
+                true_ctr = sum(1 for t in test if t.web_results[0].click) / len(test)
                 MSE = (pred_click_prob - true_ctr) ** 2
                 MSEs.append(MSE)
 
                 weights.append(len(test))
             
         # Average MSE over all queries
-        return math.sqrt(np.average(MSEs,weights=weights))
+        return math.sqrt(sum(MSE * weight for MSE, weight in zip(MSEs, weights)) / sum(weights))
 
 
 class RelevancePrediction(Evaluation):
@@ -213,22 +711,26 @@ class RelevancePrediction(Evaluation):
         """
             Returns the AUC of the true relevances and the predicted relevances by the model and the Pearson correlation between the two.
             AUC: a statistically consistent and more discriminating measure than accuracy. Charles X. Ling and Jin Huang and Harry Zhang. 2003
+            For AUC, search results with the true relevance greater than zero are considered relevant (see Statistics.auc).
         """
 
-        pred_relevances = []
+        judged_results = []
         true_relevances = []
-        current_i = 0
 
         for session in search_sessions:
-            for rank, result in enumerate(session.web_results):
-                if session.query in self.relevances:
-                    if result.id in self.relevances[session.query]:
-                        true_rel = self.relevances[session.query][result.id]
-                        true_relevances.append(true_rel)
-                        pred_relevances.append(click_model.predict_relevance(session.query, result.id))
-                
-        auc = roc_auc_score(true_relevances, pred_relevances)
-        cor, p = pearsonr(true_relevances, pred_relevances)
+            query_relevances = self.relevances.get(session.query)
+            if query_relevances is None:
+                continue
+
+            for result in session.web_results:
+                if result.id in query_relevances:
+                    judged_results.append((session.query, result.id))
+                    true_relevances.append(query_relevances[result.id])
+
+        pred_relevances = click_model.predict_relevances(judged_results)
+
+        auc = Statistics.auc(true_relevances, pred_relevances)
+        cor, p = Statistics.pearson(zip(true_relevances, pred_relevances))
         return auc, cor, p
 
 
@@ -4,8 +4,26 @@
 # Full copyright notice can be found in LICENSE.
 #
 import copy
+import hashlib
+import json
+import os
+import signal
 from abc import abstractmethod
 
+try:
+    from time import perf_counter as _timer
+except ImportError:
+    from time import time as _timer
+
+try:
+    from os import replace as _replace_file
+except ImportError:
+    # Python 2: rename replaces an existing file atomically on POSIX systems
+    from os import rename as _replace_file
+
+from pyclick.click_models.ParamContainer import QueryDocumentParamContainer
+from pyclick.utils.BinaryFormat import BinaryFormat
+
 __author__ = 'Ilya Markov'
 
 
@@ -13,16 +31,123 @@ class Inference(object):
     """An abstract inference algorithm for click models."""
 
     @abstractmethod
-    def infer_params(self, click_model, search_sessions):
-        """Infers parameters of the given click models based on the given list of search sessions."""
+    def infer_params(self, click_model, search_sessions, callbacks=None, initial_model=None):
+        """
+        Infers parameters of the given click models based on the given list of search sessions.
+
+        :param click_model: The click model to train.
+        :param search_sessions: The list of search sessions.
+        :param callbacks: The list of callbacks to notify about the progress of inference (see InferenceCallback).
+        :param initial_model: The click model to take the initial values of parameters from (see ClickModel.train).
+        :returns: The number of performed iterations.
+        """
         pass
 
+    @staticmethod
+    def _get_read_only_copy(click_model):
+        """
+        Returns a shallow copy of the given click model with frozen copies of its parameter containers,
+        so that looking up parameters in the copy does not add parameters to the given model.
+        """
+        read_only_model = copy.copy(click_model)
+        read_only_model.params = {}
+        for param_name, param in click_model.params.items():
+            read_only_model.params[param_name] = copy.copy(param)
+            read_only_model.params[param_name].freeze()
+        return read_only_model
+
+    @staticmethod
+    def _run_iteration(iteration, search_sessions, update_params, callbacks, updated_model=None):
+        """
+        Performs an iteration of inference by calling update_params on the given search sessions.
+        If some callbacks need to be notified every N search sessions (see InferenceCallback.session_interval),
+        search sessions are processed in chunks of the smallest such N.
+
+        :param iteration: The number of the iteration.
+        :param search_sessions: The list of search sessions (or search tasks).
+        :param update_params: The function that updates parameters given a list of search sessions.
+        :param callbacks: The list of callbacks.
+        :param updated_model: The click model whose parameters update_params changes in place,
+            if the inference is single-pass (see InferenceCallback.on_sessions).
+        """
+        intervals = [callback.session_interval for callback in callbacks if callback.session_interval]
+        if not intervals:
+            update_params(search_sessions)
+            return
+
+        interval = min(intervals)
+        for start in range(0, len(search_sessions), interval):
+            update_params(search_sessions[start:start + interval])
+
+            session_num = min(start + interval, len(search_sessions))
+            for callback in callbacks:
+                callback.on_sessions(iteration, session_num, updated_model)
+
+    @staticmethod
+    def _get_profilers(callbacks):
+        """Returns the callbacks that collect profiling data (see InferenceCallback.profile)."""
+        return [callback for callback in callbacks if callback.profile]
+
+    @staticmethod
+    def _get_profiled_session_params(click_model, search_session, profilers):
+        """Returns click_model.get_session_params(search_session) and reports its time to the given profilers."""
+        start = _timer()
+        session_params = click_model.get_session_params(search_session)
+        elapsed = _timer() - start
+
+        for profiler in profilers:
+            profiler.on_session_params(elapsed)
+        return session_params
+
+    @staticmethod
+    def _profiled_update(param, profilers, *args):
+        """Calls param.update(*args) and reports its time to the given profilers."""
+        start = _timer()
+        param.update(*args)
+        elapsed = _timer() - start
+
+        for profiler in profilers:
+            profiler.on_update(param.__class__, elapsed)
+
 
 class MLEInference(Inference):
     """The maximum likelihood estimation (MLE) approach to parameter inference."""
 
-    def infer_params(self, click_model, search_sessions):
+    def infer_params(self, click_model, search_sessions, callbacks=None, initial_model=None):
+        if initial_model is not None:
+            raise ValueError("MLE inference estimates parameters in a single pass and cannot be warm-started")
         if search_sessions is None or len(search_sessions) == 0:
+            return 0
+
+        callbacks = callbacks or []
+        profilers = self._get_profilers(callbacks)
+
+        for callback in callbacks:
+            callback.on_train_begin(click_model, search_sessions, 1)
+            callback.on_iteration_begin(0)
+
+        self._run_iteration(0, search_sessions,
+                            lambda sessions: self._update_params(click_model, sessions, profilers), callbacks,
+                            click_model)
+
+        for callback in callbacks:
+            callback.on_iteration_end(0, click_model)
+            callback.on_train_end(click_model)
+
+        return 1
+
+    def _update_params(self, click_model, search_sessions, profilers):
+        """
+        Updates the parameters of the given click model based on the given search sessions.
+        If there are profilers, reports the time of each step to them.
+        """
+        if profilers:
+            for search_session in search_sessions:
+                session_params = self._get_profiled_session_params(click_model, search_session, profilers)
+
+                for rank, result in enumerate(search_session.web_results):
+                    for param_name, param in session_params[rank].items():
+                        self._profiled_update(param, profilers, search_session, rank)
             return
 
         for search_session in search_sessions:
@@ -39,29 +164,307 @@ class EMInference(Inference):
     ITERATION_NUM = 50
     """Number of iterations of the EM algorithm."""
 
-    def __init__(self, iter_num=ITERATION_NUM):
+    def __init__(self, iter_num=ITERATION_NUM, tolerance=None, checkpoint_path=None, checkpoint_interval=1):
         """
         Initializes the EM inference method with a given number of iterations.
 
-        :param iter_num: The number of iterations to use.
+        :param iter_num: The (maximum) number of iterations to use.
+        :param tolerance: If set, the inference stops as soon as no parameter changes by more than the tolerance
+            during an iteration (see get_max_delta).
+        :param checkpoint_path: If set, the parameters and the number of completed iterations are written to this file
+            every checkpoint_interval iterations and when the process receives SIGTERM.
+            If the file exists when the inference starts, the inference resumes from it
+            and produces the same parameters as an uninterrupted run.
+            A checkpoint written for another click model class, other search sessions
+            or other settings of the inference (iter_num, tolerance) is refused with ValueError.
+            The file is removed when the inference finishes.
+        :param checkpoint_interval: The number of iterations between checkpoints.
         """
         self.iter_num = iter_num
+        self.tolerance = tolerance
+        self.checkpoint_path = checkpoint_path
+        self.checkpoint_interval = checkpoint_interval
 
-    def infer_params(self, click_model, search_sessions):
+    def infer_params(self, click_model, search_sessions, callbacks=None, initial_model=None):
+        """
+        Infers parameters of the given click model based on the given list of search sessions
+        (see Inference.infer_params).
+
+        :returns: The number of performed iterations, including those resumed from a checkpoint
+            (less than iter_num if the inference converged, see tolerance).
+        """
         if search_sessions is None or len(search_sessions) == 0:
-            return
+            return 0
+
+        callbacks = callbacks or []
+        profilers = self._get_profilers(callbacks)
 
         orig_click_model = copy.deepcopy(click_model)
+        # The current parameters are looked up in a read-only copy,
+        # so that the E-step does not add parameters to the model (e.g., those removed by ParamPruning)
+        current_click_model = self._get_read_only_copy(initial_model if initial_model is not None else click_model)
+
+        start_iteration = 0
+        # The checkpoint of this run, which is not kept after the run
+        checkpoint = None
+        if self.checkpoint_path is not None:
+            checkpoint = _Checkpoint(self.checkpoint_path, click_model, {
+                'model': click_model.__class__.__name__,
+                'session_num': len(search_sessions),
+                'session_hash': self._get_session_hash(search_sessions),
+                'iter_num': self.iter_num,
+                'tolerance': self.tolerance,
+            })
+            if os.path.exists(self.checkpoint_path):
+                start_iteration = checkpoint.read()
+                current_click_model = self._get_read_only_copy(click_model)
+            checkpoint.update(start_iteration, click_model.params, written=True)
+
+        for callback in callbacks:
+            callback.on_train_begin(click_model, search_sessions, self.iter_num)
+
+        prev_sigterm_handler = self._set_sigterm_handler(checkpoint)
+        iterations_done = start_iteration
+
+        try:
+            for iteration in range(start_iteration, self.iter_num):
+                for callback in callbacks:
+                    callback.on_iteration_begin(iteration)
+
+                new_click_model = copy.deepcopy(orig_click_model)
+                self._run_iteration(iteration, search_sessions,
+                                    lambda sessions: self._update_params(current_click_model, new_click_model,
+                                                                         sessions, profilers),
+                                    callbacks)
+                converged = self._is_converged(current_click_model, new_click_model)
+                if checkpoint is not None:
+                    checkpoint.update(iteration + 1, new_click_model.params)
+                click_model.params = new_click_model.params
+                iterations_done = iteration + 1
+
+                for callback in callbacks:
+                    callback.on_iteration_end(iteration, click_model)
+                current_click_model = self._get_read_only_copy(click_model)
+
+                if converged:
+                    break
+                if checkpoint is not None and (iteration + 1) % self.checkpoint_interval == 0:
+                    checkpoint.write()
+        finally:
+            if prev_sigterm_handler is not None:
+                signal.signal(signal.SIGTERM, prev_sigterm_handler)
+
+        if checkpoint is not None:
+            checkpoint.remove()
+
+        for callback in callbacks:
+            callback.on_train_end(click_model)
+
+        return iterations_done
+
+    @staticmethod
+    def _set_sigterm_handler(checkpoint):
+        """
+        If checkpoints are enabled, installs a SIGTERM handler that writes the given checkpoint
+        and then passes the signal to the previous handler (by default, terminating the process).
+
+        :returns: The previous handler or None if no handler was installed.
+        """
+        if checkpoint is None:
+            return None
+
+        def on_sigterm(signum, frame):
+            checkpoint.write()
+            signal.signal(signal.SIGTERM, prev_handler)
+            os.kill(os.getpid(), signal.SIGTERM)
+
+        try:
+            prev_handler = signal.signal(signal.SIGTERM, on_sigterm)
+        except ValueError:
+            # Signal handlers can be installed only in the main thread
+            return None
+
+        if prev_handler is None:
+            prev_handler = signal.SIG_DFL
+        return prev_handler
+
+    @staticmethod
+    def _get_session_hash(search_sessions):
+        """
+        Returns the hash of the queries, results and clicks of the given search sessions (or search tasks),
+        which identifies the training data of a checkpoint.
+        """
+        session_hash = hashlib.sha1()
+        for search_task in search_sessions:
+            # Search sessions of a task are prefixed with their number, so that task boundaries are hashed too
+            task_sessions = getattr(search_task, 'search_sessions', [search_task])
+            buf = bytearray()
+            BinaryFormat.pack_key(buf, len(task_sessions))
 
-        for iteration in range(self.iter_num):
-            new_click_model = copy.deepcopy(orig_click_model)
+            for search_session in task_sessions:
+                BinaryFormat.pack_key(buf, search_session.query)
+                BinaryFormat.pack_key(buf, len(search_session.web_results))
+                for result in search_session.web_results:
+                    BinaryFormat.pack_key(buf, result.id)
+                    BinaryFormat.pack_key(buf, int(result.click))
 
+            session_hash.update(bytes(buf))
+        return session_hash.hexdigest()
+
+    def _is_converged(self, click_model, new_click_model):
+        """Checks whether no parameter changed by more than the tolerance (if set) in the last iteration."""
+        if self.tolerance is None:
+            return False
+
+        max_delta = self.get_max_delta(click_model, new_click_model)
+        return max_delta is not None and max_delta <= self.tolerance
+
+    @staticmethod
+    def get_max_delta(click_model, new_click_model):
+        """
+        Returns the maximum absolute difference between the values of the corresponding parameters of two models.
+        Query-document parameters correspond to each other if they have the same query and search result
+        (so the models can come from different sources, e.g., an initial model of a warm start and an iteration of EM).
+        Other parameters correspond to each other if they are at the same position in the iteration over a container.
+
+        :param click_model: The click model.
+        :param new_click_model: The click model with new values of the parameters.
+        :returns: The maximum difference or None if the models have different sets of parameters.
+        """
+        max_delta = 0
+        for param_name, new_param in new_click_model.params.items():
+            param = click_model.params[param_name]
+
+            if isinstance(new_param, QueryDocumentParamContainer):
+                if not param.is_frozen():
+                    # Looking up parameters in a frozen copy does not add them to the model
+                    param = copy.copy(param)
+                    param.freeze()
+
+                param_num = 0
+                for query, results in new_param._items():
+                    for search_result, new_param_value in results.items():
+                        param_value = param.get(query, search_result)
+                        if param_value is param._prior:
+                            return None
+                        max_delta = max(max_delta, abs(param_value.value() - new_param_value.value()))
+                        param_num += 1
+
+                if param_num != sum(1 for _ in param):
+                    return None
+                continue
+
+            params = list(param)
+            new_params = list(new_param)
+            if len(params) != len(new_params):
+                return None
+
+            for param_value, new_param_value in zip(params, new_params):
+                max_delta = max(max_delta, abs(param_value.value() - new_param_value.value()))
+
+        return max_delta
+
+    def _update_params(self, click_model, new_click_model, search_sessions, profilers):
+        """
+        Updates the parameters of the new click model based on the given search sessions
+        and the parameters of the current click model.
+        If there are profilers, reports the time of each step to them.
+        """
+        if profilers:
             for search_session in search_sessions:
-                current_session_params = click_model.get_session_params(search_session)
-                new_session_params = new_click_model.get_session_params(search_session)
+                current_session_params = self._get_profiled_session_params(click_model, search_session, profilers)
+                new_session_params = self._get_profiled_session_params(new_click_model, search_session, profilers)
 
                 for rank, result in enumerate(search_session.web_results):
                     for param_name, param in new_session_params[rank].items():
-                        param.update(search_session, rank, current_session_params)
+                        self._profiled_update(param, profilers, search_session, rank, current_session_params)
+            return
+
+        for search_session in search_sessions:
+            current_session_params = click_model.get_session_params(search_session)
+            new_session_params = new_click_model.get_session_params(search_session)
+
+            for rank, result in enumerate(search_session.web_results):
+                for param_name, param in new_session_params[rank].items():
+                    param.update(search_session, rank, current_session_params)
+
+
+class _Checkpoint(object):
+    """
+    The checkpoint of a single run of EMInference.infer_params:
+    the parameters of the last completed iteration and the file they are written to.
+    """
+
+    def __init__(self, path, click_model, header):
+        """
+        Initializes the checkpoint.
+
+        :param path: The path of the checkpoint file.
+        :param click_model: The click model being trained.
+        :param header: The dictionary that identifies the run (the click model class, the search sessions
+            and the settings of the inference), which is written to the file and checked when resuming.
+        """
+        self.path = path
+        self.click_model = click_model
+        self.header = header
+
+        self._state = None
+        self._written_iteration = None
+
+    def update(self, iteration, params, written=False):
+        """
+        Sets the parameters of the last completed iteration.
+
+        :param iteration: The number of completed iterations.
+        :param params: The parameters of the click model after these iterations.
+        :param written: Whether these parameters are already in the checkpoint file (e.g., resumed from it).
+        """
+        # The state is replaced by a single assignment, so that SIGTERM never sees a partial update
+        self._state = (iteration, params)
+        if written:
+            self._written_iteration = iteration
+
+    def write(self):
+        """
+        Writes the parameters of the last completed iteration into the checkpoint file (unless already written).
+        The file is replaced atomically (os.replace, or os.rename on Python 2 and POSIX),
+        so an interrupted write leaves the previous checkpoint intact.
+        """
+        iteration, params = self._state
+        if iteration == self._written_iteration:
+            return
+
+        checkpoint_model = copy.copy(self.click_model)
+        checkpoint_model.params = params
+        tmp_path = self.path + '.tmp'
+
+        header = dict(self.header)
+        header['iteration'] = iteration
+        with open(tmp_path, 'wb') as checkpoint_file:
+            BinaryFormat.write_string(checkpoint_file, json.dumps(header, sort_keys=True))
+            checkpoint_model.to_binary(checkpoint_file)
+
+        _replace_file(tmp_path, self.path)
+        self._written_iteration = iteration
+
+    def read(self):
+        """
+        Loads the parameters from the checkpoint file into the click model.
+        Raises ValueError if the file was written by another run (see header).
+
+        :returns: The number of iterations completed before the checkpoint.
+        """
+        with open(self.path, 'rb') as checkpoint_file:
+            header = json.loads(BinaryFormat.read_string(checkpoint_file))
+            mismatched = sorted(key for key, value in self.header.items() if header.get(key) != value)
+            if mismatched:
+                raise ValueError("The checkpoint %s was written by another run (different %s)" %
+                                 (self.path, ', '.join(mismatched)))
+            self.click_model.from_binary(checkpoint_file)
+
+        return header['iteration']
 
-            click_model.params = new_click_model.params
+    def remove(self):
+        """Removes the checkpoint file."""
+        if os.path.exists(self.path):
+            os.remove(self.path)
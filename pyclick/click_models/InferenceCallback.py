@@ -0,0 +1,321 @@
+#
+# Copyright (C) 2015  Ilya Markov
+#
+# Full copyright notice can be found in LICENSE.
+#
+from __future__ import division, print_function
+import collections
+import sys
+
+try:
+    from time import perf_counter as _timer
+except ImportError:
+    from time import time as _timer
+
+from pyclick.utils.Utils import Utils
+
+__author__ = 'Ilya Markov'
+
+
+class InferenceCallback(object):
+    """
+    A callback that is notified about the progress of training a click model (see ClickModel.train).
+    Subclasses override the methods for the events they are interested in.
+    """
+
+    profile = False
+    """
+    Whether the callback collects profiling data (see InferenceProfiler).
+    If none of the callbacks does, the inference runs without any instrumentation.
+    """
+
+    session_interval = None
+    """
+    The number of search sessions, after which on_sessions is called within an iteration.
+    If not set, on_sessions is not called and search sessions are processed without interruption.
+    """
+
+    def on_train_begin(self, click_model, search_sessions, iter_num, session_num=None):
+        """
+        Called before training.
+
+        :param click_model: The click model being trained.
+        :param search_sessions: The list of training search sessions (or search tasks for task-centric models).
+        :param iter_num: The number of iterations of the inference method (1 for MLE).
+        :param session_num: The total number of training search sessions (or search tasks)
+            if not all of them are in search_sessions, e.g., in DistributedEMInference,
+            where search_sessions is the shard of the coordinator.
+            Callbacks used with DistributedEMInference should accept this argument.
+        """
+        pass
+
+    def on_iteration_begin(self, iteration):
+        """
+        Called before each iteration.
+
+        :param iteration: The number of the iteration, starting from 0.
+        """
+        pass
+
+    def on_sessions(self, iteration, session_num, click_model=None):
+        """
+        Called every session_interval search sessions within an iteration (only if session_interval is set).
+
+        :param iteration: The number of the iteration, starting from 0.
+        :param session_num: The number of search sessions (or search tasks) processed so far in this iteration.
+        :param click_model: In single-pass inference (MLE), the click model being trained,
+            whose parameters are updated in place.
+            None in iterative inference (EM), which updates a copy of the click model within an iteration.
+        """
+        pass
+
+    def on_iteration_end(self, iteration, click_model):
+        """
+        Called after each iteration, when the click model holds the parameters inferred in this iteration.
+
+        :param iteration: The number of the iteration, starting from 0.
+        :param click_model: The click model being trained.
+        """
+        pass
+
+    def on_train_end(self, click_model):
+        """
+        Called after training.
+
+        :param click_model: The trained click model.
+        """
+        pass
+
+    def on_session_params(self, elapsed):
+        """
+        Called after the parameters of a search session are constructed (only if profile is True).
+
+        :param elapsed: The time spent on constructing the parameters, in seconds.
+        """
+        pass
+
+    def on_update(self, param_class, elapsed):
+        """
+        Called after a parameter is updated (only if profile is True).
+
+        :param param_class: The class of the updated parameter.
+        :param elapsed: The time spent on the update, in seconds.
+        """
+        pass
+
+
+class InferenceProfiler(InferenceCallback):
+    """
+    A callback that profiles the inference of click model parameters.
+
+    For each iteration, records the wall time, the time spent on constructing session parameters
+    (see ClickModel.get_session_params), the time spent on updating parameters of each class,
+    the throughput (search sessions per second) and the number of parameters of the click model.
+    The timings include the overhead of instrumentation, so they should be compared with each other
+    rather than with the time of uninstrumented training.
+    """
+
+    profile = True
+
+    def __init__(self):
+        self.iterations = []
+        """
+        The list of profiles of iterations, each profile is a dictionary with the following keys:
+        time, session_params_time, update_time ({param_class_name: time}), sessions_per_sec, param_num.
+        """
+        self._session_num = 0
+        self._start = None
+        self._session_params_time = 0
+        self._update_time = None
+
+    def on_train_begin(self, click_model, search_sessions, iter_num, session_num=None):
+        if session_num is not None:
+            self._session_num = session_num
+        else:
+            self._session_num = sum(len(getattr(session, 'search_sessions', [session])) for session in search_sessions)
+
+    def on_iteration_begin(self, iteration):
+        self._session_params_time = 0
+        self._update_time = collections.defaultdict(float)
+        self._start = _timer()
+
+    def on_iteration_end(self, iteration, click_model):
+        elapsed = _timer() - self._start
+        self.iterations.append({
+            'time': elapsed,
+            'session_params_time': self._session_params_time,
+            'update_time': dict(self._update_time),
+            'sessions_per_sec': self._session_num / elapsed if elapsed else None,
+            'param_num': sum(sum(1 for _ in param) for param in click_model.params.values()),
+        })
+
+    def on_session_params(self, elapsed):
+        self._session_params_time += elapsed
+
+    def on_update(self, param_class, elapsed):
+        self._update_time[param_class.__name__] += elapsed
+
+    def get_summary(self):
+        """
+        Returns the profile of all iterations together.
+
+        :returns: The dictionary with the following keys:
+            time, session_params_time, update_time ({param_class_name: time}), iteration_num.
+        """
+        update_time = collections.defaultdict(float)
+        for iteration in self.iterations:
+            for param_class_name, elapsed in iteration['update_time'].items():
+                update_time[param_class_name] += elapsed
+
+        return {
+            'time': sum(iteration['time'] for iteration in self.iterations),
+            'session_params_time': sum(iteration['session_params_time'] for iteration in self.iterations),
+            'update_time': dict(update_time),
+            'iteration_num': len(self.iterations),
+        }
+
+
+class TrainingProgress(InferenceCallback):
+    """
+    A callback that reports the progress of training after each iteration and every session_interval search sessions.
+
+    Each report is a dictionary with the following keys:
+    iteration, iter_num, session_num (processed in the current iteration), elapsed (seconds since the beginning),
+    eta (the estimated remaining time in seconds), rss (the resident set size of the process in bytes, see Utils.get_rss).
+    Reports at the end of iterations also contain
+    loglikelihood (on a sample of training search sessions, see LogLikelihood)
+    and max_delta (the maximum absolute change of a parameter value during the iteration,
+    None if the set of parameters changed, e.g., in the first iteration).
+    """
+
+    LOGLIKELIHOOD_SAMPLE = 1000
+    """The default number of training search sessions, on which the log-likelihood is computed."""
+
+    def __init__(self, session_interval=None, report=None, loglikelihood_sample=LOGLIKELIHOOD_SAMPLE):
+        """
+        Initializes the callback.
+
+        :param session_interval: The number of search sessions between reports within an iteration.
+            If not set, reports are made only at the end of iterations.
+        :param report: The function that is called with each report.
+            If not set, reports are printed to stderr.
+        :param loglikelihood_sample: The number of first training search sessions to compute the log-likelihood on
+            (0 to skip computing the log-likelihood, which takes time comparable to an iteration on the sample).
+        """
+        self.session_interval = session_interval
+        self.report = report or self._print_report
+        self.loglikelihood_sample = loglikelihood_sample
+        self.history = []
+        """The list of reports made at the end of iterations."""
+
+        self._start = None
+        self._iter_num = 0
+        self._session_num = 0
+        self._loglikelihood_sessions = []
+        self._values = []
+
+    def on_train_begin(self, click_model, search_sessions, iter_num, session_num=None):
+        self._start = _timer()
+        self._iter_num = iter_num
+        self._session_num = session_num if session_num is not None else len(search_sessions)
+        self._values = self._get_values(click_model)
+
+        self._loglikelihood_sessions = []
+        for search_session in search_sessions:
+            if len(self._loglikelihood_sessions) >= self.loglikelihood_sample:
+                break
+            self._loglikelihood_sessions.extend(getattr(search_session, 'search_sessions', [search_session]))
+        del self._loglikelihood_sessions[self.loglikelihood_sample:]
+
+    def on_sessions(self, iteration, session_num, click_model=None):
+        self.report(self._get_report(iteration, session_num))
+
+    def on_iteration_end(self, iteration, click_model):
+        report = self._get_report(iteration, self._session_num)
+
+        if self._loglikelihood_sessions:
+            from pyclick.click_models.Evaluation import LogLikelihood
+            from pyclick.click_models.Inference import Inference
+            # Evaluated on a read-only copy, so that the lookups do not add parameters (e.g., pruned ones) to the model
+            report['loglikelihood'] = LogLikelihood().evaluate(Inference._get_read_only_copy(click_model),
+                                                               self._loglikelihood_sessions)
+
+        values = self._get_values(click_model)
+        report['max_delta'] = max([abs(x - y) for x, y in zip(values, self._values)] or [0]) \
+            if len(values) == len(self._values) else None
+        self._values = values
+
+        self.history.append(report)
+        self.report(report)
+
+    def _get_report(self, iteration, session_num):
+        elapsed = _timer() - self._start
+        total = self._iter_num * self._session_num
+        done = (iteration * self._session_num + session_num) / total if total else None
+
+        return {
+            'iteration': iteration,
+            'iter_num': self._iter_num,
+            'session_num': session_num,
+            'elapsed': elapsed,
+            'eta': elapsed * (1 - done) / done if done else None,
+            'rss': Utils.get_rss(),
+        }
+
+    @staticmethod
+    def _get_values(click_model):
+        return [param.value() for param_name in sorted(click_model.params, key=lambda name: name.name)
+                for param in click_model.params[param_name]]
+
+    @staticmethod
+    def _print_report(report):
+        message = 'Iteration %d/%d, %d sessions: %.1f secs elapsed, ETA %s secs, RSS %.1f MB' % (
+            report['iteration'] + 1, report['iter_num'], report['session_num'], report['elapsed'],
+            '%.1f' % report['eta'] if report['eta'] is not None else '?', report['rss'] / 2 ** 20)
+
+        if 'loglikelihood' in report:
+            message += ', log-likelihood %f' % report['loglikelihood']
+        if report.get('max_delta') is not None:
+            message += ', max delta %f' % report['max_delta']
+
+        print(message, file=sys.stderr)
+
+
+class ParamPruning(InferenceCallback):
+    """
+    A callback that prunes rarely observed query-document parameters and those that do not differ from the prior
+    during training (see ClickModel.prune), which bounds the memory used by long-tail queries.
+
+    Parameters are pruned at the end of each iteration.
+    EM looks up the current parameters in a read-only copy of the model (see EMInference),
+    so pruned parameters take the prior value in the next iteration without being added back.
+    In single-pass inference (MLE), parameters can also be pruned every session_interval search sessions,
+    so that the model does not grow with the number of distinct query-document pairs.
+    Then a pair observed less than min_observation_num times between two prunings is forgotten
+    and estimated from scratch when observed again, which loses only a few observations of frequent pairs.
+    """
+
+    def __init__(self, min_observation_num=None, epsilon=None, session_interval=None):
+        """
+        Initializes the callback.
+
+        :param min_observation_num: The minimum number of observations of a parameter to keep.
+        :param epsilon: The maximum absolute difference between the value of a parameter and the prior
+            to prune the parameter.
+        :param session_interval: The number of search sessions between prunings in single-pass inference.
+            If not set, parameters are pruned only at the end of iterations.
+        """
+        self.min_observation_num = min_observation_num
+        self.epsilon = epsilon
+        self.session_interval = session_interval
+        self.pruned_num = 0
+        """The total number of pruned parameters."""
+
+    def on_sessions(self, iteration, session_num, click_model=None):
+        # EM updates a copy of the click model within an iteration, so the current parameters are kept intact
+        if click_model is None:
+            return
+        self.pruned_num += click_model.prune(self.min_observation_num, self.epsilon)
+
+    def on_iteration_end(self, iteration, click_model):
+        self.pruned_num += click_model.prune(self.min_observation_num, self.epsilon)
@@ -0,0 +1,133 @@
+#
+# Copyright (C) 2015  Ilya Markov
+#
+# Full copyright notice can be found in LICENSE.
+#
+import collections
+import time
+
+from pyclick.click_models.Evaluation import ClickProbEvaluation, MultiEvaluation
+from pyclick.search_session import SearchSession
+from pyclick.utils.Utils import Utils
+
+__author__ = 'Ilya Markov'
+
+
+ModelReport = collections.namedtuple('ModelReport', 'train_time eval_time memory values')
+"""
+The report on a click model in a comparison:
+the training and evaluation times (in seconds),
+the peak memory used for training and evaluation (in bytes, see ModelComparison)
+and the list of metric values, in the order of evaluation methods.
+"""
+
+
+class ModelComparison(object):
+    """
+    Trains and evaluates multiple click models on the same train and test sets.
+
+    Search sessions are preprocessed once for all click models:
+    queries and search results are interned (see Utils.intern_sessions),
+    test sessions of queries that do not occur in the train set are discarded
+    and the clicks and the rank of the last click of each session are computed once
+    (see _IndexedSearchSession), instead of once per rank, parameter and iteration of each click model.
+    Then each click model is trained and evaluated in its own worker process forked from the current one,
+    so the preprocessed sessions are shared by all models without being copied or walked again,
+    and the time and peak memory of each model are measured in isolation.
+    """
+
+    def __init__(self, click_model_classes, evaluations, processes=1, filter_queries=True):
+        """
+        Initializes the comparison.
+
+        :param click_model_classes: The list of click model classes to compare, e.g., [GCTR, PBM, UBM, DBN],
+            or the dictionary {name: factory} of functions that create configured untrained click models
+            (see Utils.get_click_model_factories).
+        :param evaluations: The list of evaluation methods, e.g., [LogLikelihood(), Perplexity()].
+        :param processes: The number of models to train and evaluate in parallel.
+            Note that parallel models compete for CPU and memory bandwidth, which affects their times.
+        :param filter_queries: Whether to discard test sessions of queries that do not occur in the train set.
+        """
+        self.click_model_classes = click_model_classes
+        self.evaluations = evaluations
+        self.processes = processes
+        self.filter_queries = filter_queries
+
+    def prepare(self, train_sessions, test_sessions):
+        """
+        Preprocesses the given train and test sets once for all click models.
+
+        :param train_sessions: The list of training search sessions.
+        :param test_sessions: The list of test search sessions.
+        :returns: The preprocessed train and test sets.
+        """
+        Utils.intern_sessions(train_sessions)
+        Utils.intern_sessions(test_sessions)
+
+        if self.filter_queries:
+            test_sessions = Utils.filter_sessions(test_sessions, Utils.get_unique_queries(train_sessions))
+
+        return [_IndexedSearchSession(search_session) for search_session in train_sessions], \
+            [_IndexedSearchSession(search_session) for search_session in test_sessions]
+
+    def run(self, train_sessions, test_sessions):
+        """
+        Trains and evaluates all click models.
+
+        :param train_sessions: The list of training search sessions.
+        :param test_sessions: The list of test search sessions.
+        :returns: The dictionary {click_model_name: ModelReport}.
+        """
+        train_sessions, test_sessions = self.prepare(train_sessions, test_sessions)
+
+        factories = Utils.get_click_model_factories(self.click_model_classes)
+        # Models are passed to worker processes by index, since factories (e.g., lambdas) may not be picklable
+        run_model = lambda model: self._run_model(factories[model][1], train_sessions, test_sessions)
+        reports = Utils.fork_imap(run_model, range(len(factories)), self.processes, max_tasks_per_child=1)
+
+        return dict((click_model_name, report) for (click_model_name, _), report in zip(factories, reports))
+
+    def _run_model(self, click_model_factory, train_sessions, test_sessions):
+        """
+        Trains and evaluates the given click model in a fresh worker process.
+        The memory is measured as the increase of the peak RSS of the worker over its RSS before training.
+
+        :returns: The report on the click model.
+        """
+        rss = Utils.get_rss()
+
+        click_model = click_model_factory()
+        start = time.time()
+        click_model.train(train_sessions)
+        train_time = time.time() - start
+        click_model.freeze()
+
+        start = time.time()
+        if all(isinstance(evaluation, ClickProbEvaluation) for evaluation in self.evaluations):
+            values = MultiEvaluation(self.evaluations).evaluate(click_model, test_sessions)
+        else:
+            values = [evaluation.evaluate(click_model, test_sessions) for evaluation in self.evaluations]
+        eval_time = time.time() - start
+
+        return ModelReport(train_time, eval_time, max(Utils.get_peak_rss() - rss, 0), values)
+
+
+class _IndexedSearchSession(SearchSession):
+    """
+    A search session that shares the query and the results of the given one
+    and keeps its clicks and the rank of its last click, which click models look up for each rank
+    (e.g., DCM, SDBN, DBN and CCM in parameter updates and RankPrevClickParamContainer in UBM).
+    The clicks of the session must not change after it is created.
+    """
+
+    def __init__(self, search_session):
+        super(_IndexedSearchSession, self).__init__(search_session.query)
+        self.web_results = search_session.web_results
+        self._clicks = super(_IndexedSearchSession, self).get_clicks()
+        self._last_click_rank = super(_IndexedSearchSession, self).get_last_click_rank()
+
+    def get_clicks(self):
+        return self._clicks
+
+    def get_last_click_rank(self):
+        return self._last_click_rank
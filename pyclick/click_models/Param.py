@@ -24,6 +24,25 @@ class Param(object):
     def from_json(self, json_str):
         self.__dict__ = json_str
 
+    @abstractmethod
+    def get_state(self):
+        """
+        Returns the state of the parameter as a tuple of numbers
+        (used for the binary serialization of click models).
+
+        :returns: The state of the parameter.
+        """
+        pass
+
+    @abstractmethod
+    def set_state(self, state):
+        """
+        Restores the parameter from the given state (see get_state).
+
+        :param state: The state of the parameter.
+        """
+        pass
+
     @abstractmethod
     def value(self):
         """
@@ -33,6 +52,15 @@ class Param(object):
         """
         pass
 
+    def get_observation_num(self):
+        """
+        Returns the number of observations the parameter was estimated from
+        (used for pruning rarely observed parameters, see QueryDocumentParamContainer.prune).
+
+        :returns: The number of observations or None if it is not tracked by the parameter.
+        """
+        return None
+
     @abstractmethod
     def update(self, search_session, rank):
         """
@@ -66,6 +94,15 @@ class ParamMLE(Param):
     def value(self):
         return self._numerator / float(self._denominator)
 
+    def get_state(self):
+        return self._numerator, self._denominator
+
+    def set_state(self, state):
+        self._numerator, self._denominator = state
+
+    def get_observation_num(self):
+        return self._denominator - 2
+
     @abstractmethod
     def update(self, search_session, rank):
         pass
@@ -92,6 +129,15 @@ class ParamEM(Param):
     def value(self):
         return min(self._numerator / float(self._denominator), 1 - self.PROB_MIN)
 
+    def get_state(self):
+        return self._numerator, self._denominator
+
+    def set_state(self, state):
+        self._numerator, self._denominator = state
+
+    def get_observation_num(self):
+        return self._denominator - 2
+
     def update(self, search_session, rank, session_params):
         """
         Updates the value of the parameter based on the given search session
@@ -168,6 +214,12 @@ class ParamStatic(Param):
     def value(self):
         return self.param
 
+    def get_state(self):
+        return self.param,
+
+    def set_state(self, state):
+        self.param, = state
+
     def update(self, search_session, rank, *args):
         pass
 
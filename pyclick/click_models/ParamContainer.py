@@ -4,8 +4,15 @@
 # Full copyright notice can be found in LICENSE.
 #
 from abc import abstractmethod
+from array import array
 from collections import defaultdict
+import copy
 import json
+import struct
+import sys
+
+from pyclick.click_models.Param import ParamStatic
+from pyclick.utils.BinaryFormat import BinaryFormat
 
 __author__ = 'Ilya Markov'
 
@@ -13,6 +20,9 @@ __author__ = 'Ilya Markov'
 class ParamContainer(object):
     """An abstract container of parameters of a click model."""
 
+    PARAM_SIZE_SAMPLE = 100
+    """The number of parameters created to measure the size of a parameter object (see get_memory_footprint)."""
+
     def __init__(self, param_class, *args):
         """
         Initializes the container.
@@ -23,6 +33,73 @@ class ParamContainer(object):
         self._container = None
         self._param_class = param_class
         self._param_args = args
+        self._prior = None
+        self._compiled = False
+
+    def freeze(self):
+        """
+        Switches the container to the read-only mode.
+
+        In this mode, looking up a parameter that is not stored in the container
+        returns a shared parameter with the prior value instead of creating and storing a new one,
+        so the size of the container does not change.
+        The read-only mode is meant for serving and evaluating a trained click model.
+        """
+        self._prior = self._param_class(*self._param_args)
+
+    def unfreeze(self):
+        """
+        Switches the container back to the default mode,
+        where parameters are created and stored on first access.
+        """
+        if self._compiled:
+            raise RuntimeError("Cannot unfreeze a compiled parameter container")
+
+        self._prior = None
+
+    def is_frozen(self):
+        """
+        Checks whether the container is in the read-only mode.
+
+        :returns: True if the container is frozen and False otherwise.
+        """
+        return self._prior is not None
+
+    def compile(self):
+        """
+        Returns an inference-only snapshot of the container.
+
+        In the snapshot, each parameter is replaced with a static parameter holding its precomputed value,
+        so that reading the value does not involve any computation.
+        The snapshot is frozen (see freeze) and cannot be trained or unfrozen.
+
+        :returns: The compiled copy of the container.
+        """
+        compiled = copy.copy(self)
+        compiled._param_class = ParamStatic
+        compiled._param_args = (self._param_class(*self._param_args).value(),)
+        compiled._container = self._compile_container()
+        compiled._compiled = True
+        compiled.freeze()
+        return compiled
+
+    def is_compiled(self):
+        """
+        Checks whether the container is an inference-only snapshot (see compile).
+
+        :returns: True if the container is compiled and False otherwise.
+        """
+        return self._compiled
+
+    @abstractmethod
+    def _compile_container(self):
+        """
+        Returns a copy of the underlying data structure of the container,
+        where each parameter is replaced with a static parameter holding its current value.
+
+        :returns: The compiled copy of the underlying data structure.
+        """
+        pass
 
     def size(self):
         """
@@ -32,6 +109,113 @@ class ParamContainer(object):
         """
         return len(self._container)
 
+    def get_memory_footprint(self, seen=None):
+        """
+        Estimates the memory used by the container in bytes (as reported by sys.getsizeof).
+
+        The footprint is broken down into the structure overhead, i.e.,
+        the dictionaries and lists of the container (including the factories of defaultdicts)
+        and the parameter objects with their attributes (measured on a new parameter),
+        and the payload, i.e., the keys (e.g., queries and documents) and the numbers in the states of parameters.
+        Objects shared between parameters, e.g., small integers and interned strings, are counted once.
+
+        The footprint is also projected for compact representations that keep the same dictionaries of keys:
+        'slots' (parameter objects with __slots__ instead of attribute dictionaries),
+        'packed' (the states of parameters packed into arrays of doubles, see array.array)
+        and 'compiled' (only the values of parameters packed into arrays of doubles, see compile).
+
+        :param seen: The set of ids of objects that are already counted, e.g., in other containers of a click model.
+            It is updated with the objects of this container.
+        :returns: The dictionary with the following keys:
+            param_num, structure, objects, keys, values, overhead (structure + objects), payload (keys + values),
+            total, compact ({representation: total}).
+        """
+        seen = set() if seen is None else seen
+        footprint = dict.fromkeys(['structure', 'objects', 'keys', 'values'], 0)
+
+        def add(part, obj):
+            if id(obj) not in seen:
+                seen.add(id(obj))
+                footprint[part] += sys.getsizeof(obj)
+
+        param_num = 0
+        group_num = 0
+        stack = [self._container]
+
+        while stack:
+            item = stack.pop()
+
+            if isinstance(item, (dict, list)):
+                add('structure', item)
+                if isinstance(item, defaultdict) and item.default_factory is not None:
+                    add('structure', item.default_factory)
+
+                children = list(item.values()) if isinstance(item, dict) else item
+                if isinstance(item, dict):
+                    for key in item:
+                        add('keys', key)
+                if any(not isinstance(child, (dict, list)) for child in children):
+                    group_num += 1
+                stack.extend(children)
+            else:
+                param_num += 1
+                for value in item.get_state():
+                    add('values', value)
+
+        if not isinstance(self._container, (dict, list)):
+            group_num = 1
+
+        footprint['objects'] = param_num * self._get_param_size() if param_num else 0
+        overhead = footprint['structure'] + footprint['objects']
+        payload = footprint['keys'] + footprint['values']
+        state_size = len(self._param_class(*self._param_args).get_state())
+        slotted_class = type('SlottedParam', (object,), {'__slots__': tuple('s%d' % i for i in range(state_size))})
+        slots_size = sys.getsizeof(slotted_class())
+        array_size = sys.getsizeof(array('d'))
+
+        footprint.update({
+            'param_num': param_num,
+            'overhead': overhead,
+            'payload': payload,
+            'total': overhead + payload,
+            'compact': {
+                'slots': footprint['structure'] + param_num * slots_size + payload,
+                'packed': footprint['structure'] + footprint['keys'] + group_num * array_size +
+                          param_num * state_size * array('d').itemsize,
+                'compiled': footprint['structure'] + footprint['keys'] + group_num * array_size +
+                            param_num * array('d').itemsize,
+            },
+        })
+        return footprint
+
+    def _get_param_size(self):
+        """
+        Returns the memory used by a parameter object of the container, except for the numbers in its state.
+
+        The size is measured on new parameters using tracemalloc (if available),
+        because the attribute dictionary of an existing object is allocated on access in recent versions of Python.
+
+        :returns: The size of a parameter object in bytes.
+        """
+        try:
+            import tracemalloc
+        except ImportError:
+            param = self._param_class(*self._param_args)
+            return sys.getsizeof(param) + sys.getsizeof(param.__dict__)
+
+        started = not tracemalloc.is_tracing()
+        if started:
+            tracemalloc.start()
+        try:
+            before = tracemalloc.get_traced_memory()[0]
+            params = [self._param_class(*self._param_args) for _ in range(self.PARAM_SIZE_SAMPLE)]
+            size = tracemalloc.get_traced_memory()[0] - before - sys.getsizeof(params)
+        finally:
+            if started:
+                tracemalloc.stop()
+
+        return max(size // len(params), 0)
+
     def to_json(self):
         """
         Converts the parameter container into JSON and returns the corresponding string.
@@ -48,6 +232,82 @@ class ParamContainer(object):
         :param json_str: The JSON representation of the container.
         """
 
+    def to_binary(self, stream):
+        """
+        Writes the parameter container in the binary format to the given stream.
+        Parameters are stored as their states (see Param.get_state).
+
+        :param stream: The binary stream to write to.
+        """
+        state_size = len(self._param_class(*self._param_args).get_state())
+
+        BinaryFormat.write_string(stream, self._get_binary_name())
+        BinaryFormat.write_uint8(stream, state_size)
+        self._write_binary(stream, self._get_state_struct(state_size))
+
+    def from_binary(self, stream):
+        """
+        Initializes the parameter container from the given binary stream (see to_binary).
+
+        :param stream: The binary stream to read from.
+        """
+        state_size = len(self._param_class(*self._param_args).get_state())
+
+        container_name = BinaryFormat.read_string(stream)
+        if container_name != self._get_binary_name():
+            raise ValueError("Cannot read %s into %s" % (container_name, self.__class__.__name__))
+
+        stored_state_size = BinaryFormat.read_uint8(stream)
+        if stored_state_size != state_size:
+            raise ValueError("Parameters of %s have %d values, but %d are stored" %
+                             (self._param_class.__name__, state_size, stored_state_size))
+
+        self._read_binary(stream, self._get_state_struct(state_size))
+
+    def _get_binary_name(self):
+        """
+        Returns the name of the container in the binary format,
+        so that containers with the same format can read each other's output.
+
+        :returns: The name of the container in the binary format.
+        """
+        return self.__class__.__name__
+
+    @abstractmethod
+    def _write_binary(self, stream, state_struct):
+        """
+        Writes the parameters of the container to the given binary stream.
+
+        :param stream: The binary stream to write to.
+        :param state_struct: The struct used to pack the state of a parameter.
+        """
+        pass
+
+    @abstractmethod
+    def _read_binary(self, stream, state_struct):
+        """
+        Reads the parameters of the container from the given binary stream.
+
+        :param stream: The binary stream to read from.
+        :param state_struct: The struct used to unpack the state of a parameter.
+        """
+        pass
+
+    def _new_param(self, state):
+        """
+        Creates a parameter of the container and restores it from the given state.
+
+        :param state: The state of the parameter.
+        :returns: The new parameter.
+        """
+        param = self._param_class(*self._param_args)
+        param.set_state(state)
+        return param
+
+    @staticmethod
+    def _get_state_struct(state_size):
+        return struct.Struct('<%dd' % state_size)
+
     @abstractmethod
     def get(self, *args):
         """
@@ -131,6 +391,12 @@ class QueryDocumentParamContainer(ParamContainer):
         :param search_result: The search result.
         :return: A click model parameter that corresponds to the given query and search result.
         """
+        if self._prior is not None:
+            results = self._container.get(query)
+            if results is None or search_result not in results:
+                return self._prior
+            return results[search_result]
+
         return self._container[query][search_result]
 
     def set(self, param, query, search_result):
@@ -142,11 +408,60 @@ class QueryDocumentParamContainer(ParamContainer):
         """
         self._container[query][search_result] = param
 
+    def prune(self, min_observation_num=None, epsilon=None):
+        """
+        Removes rarely observed parameters and parameters that do not differ from the prior.
+        Pruned parameters are looked up as new ones,
+        i.e., they take the prior value (and are estimated from scratch during training).
+
+        :param min_observation_num: The minimum number of observations of a parameter to keep
+            (see Param.get_observation_num). If not set, parameters are not pruned by the number of observations.
+        :param epsilon: The maximum absolute difference between the value of a parameter and the prior
+            to prune the parameter. If not set, parameters are not pruned by the value.
+        :returns: The number of pruned parameters.
+        """
+        prior = self._param_class(*self._param_args).value()
+
+        pruned_num = 0
+        for query in list(self._container):
+            results = self._container[query]
+            pruned_results = [result for result, param in results.items()
+                              if self._is_pruned(param, prior, min_observation_num, epsilon)]
+            for result in pruned_results:
+                del results[result]
+            pruned_num += len(pruned_results)
+
+            if not results:
+                del self._container[query]
+
+        return pruned_num
+
+    @staticmethod
+    def _is_pruned(param, prior, min_observation_num, epsilon):
+        """Checks whether the given parameter should be pruned (see prune)."""
+        if min_observation_num is not None:
+            observation_num = param.get_observation_num()
+            if observation_num is not None and observation_num < min_observation_num:
+                return True
+        return epsilon is not None and abs(param.value() - prior) <= epsilon
+
+    def _items(self):
+        """
+        Returns the iterable of queries and the parameters of their search results.
+
+        :returns: The iterable of (query, {search_result: param}) pairs.
+        """
+        return self._container.items()
+
     def get_for_session_at_rank(self, search_session, rank):
         query = search_session.query
         result = search_session.web_results[rank].id
         return self.get(query, result)
 
+    def _compile_container(self):
+        return dict((query, dict((result, ParamStatic(param.value())) for result, param in results.items()))
+                    for query, results in self._container.items())
+
     def from_json(self, json_str):
         json_container = json.loads(json_str)
         for query in json_container:
@@ -154,6 +469,54 @@ class QueryDocumentParamContainer(ParamContainer):
                 self._container[query][result] = self._param_class(*self._param_args)
                 self._container[query][result].from_json(json_container[query][result])
 
+    def _write_binary(self, stream, state_struct):
+        BinaryFormat.write_chunks(stream, self._items(),
+                                  lambda buf, query_results: self._pack_query(buf, query_results, state_struct))
+
+    def _read_binary(self, stream, state_struct):
+        for query, results in BinaryFormat.read_chunks(
+                stream, lambda buf, offset: self._unpack_query(buf, offset, state_struct)):
+            self._container[query].update(results)
+
+    @staticmethod
+    def _pack_query(buf, query_results, state_struct):
+        """
+        Appends a query and the parameters of its search results to the given bytearray.
+
+        :param buf: The bytearray to append to.
+        :param query_results: The pair of a query and the dictionary of parameters of its search results.
+        :param state_struct: The struct used to pack the state of a parameter.
+        """
+        query, results = query_results
+        BinaryFormat.pack_key(buf, query)
+        BinaryFormat.pack_uint32(buf, len(results))
+
+        BinaryFormat.pack_keys(buf, list(results.keys()))
+        for param in results.values():
+            buf += state_struct.pack(*param.get_state())
+
+    def _unpack_query(self, buf, offset, state_struct):
+        """
+        Decodes a query and the parameters of its search results packed by _pack_query.
+
+        :param buf: The buffer.
+        :param offset: The offset of the query in the buffer.
+        :param state_struct: The struct used to unpack the state of a parameter.
+        :returns: The pair of a query and the iterable of (search result, parameter) pairs
+            and the offset right after the query.
+        """
+        state_size = state_struct.size // 8
+
+        query, offset = BinaryFormat.unpack_key(buf, offset)
+        result_num, offset = BinaryFormat.unpack_uint32(buf, offset)
+        results, offset = BinaryFormat.unpack_keys(buf, offset, result_num)
+
+        states = iter(struct.unpack_from('<%dd' % (result_num * state_size), buf, offset))
+        offset += result_num * state_struct.size
+        params = [self._new_param(state) for state in zip(*[states] * state_size)]
+
+        return (query, zip(results, params)), offset
+
     def __str__(self):
         param_str = ''
         counter = 0
@@ -171,9 +534,9 @@ class QueryDocumentParamContainer(ParamContainer):
     def __iadd__(self, other):
         assert type(self) == type(other)
 
-        for query in other._container:
-            for search_result in other._container[query]:
-                self._container[query][search_result] += other._container[query][search_result]
+        for query, results in other._items():
+            for search_result, param in results.items():
+                self._container[query][search_result] += param
 
         return self
 
@@ -220,6 +583,9 @@ class RankParamContainer(ParamContainer):
         :param rank: The rank.
         :returns: A click model parameter that corresponds to the given rank.
         """
+        if self._prior is not None and rank >= self.max_rank:
+            return self._prior
+
         return self._container[rank]
 
     def set(self, param, rank):
@@ -233,11 +599,24 @@ class RankParamContainer(ParamContainer):
     def get_for_session_at_rank(self, search_session, rank):
         return self.get(rank)
 
+    def _compile_container(self):
+        return [ParamStatic(param.value()) for param in self._container]
+
     def from_json(self, json_str):
         json_container = json.loads(json_str)
         for rank, param in enumerate(self._container):
             param.from_json(json_container[rank])
 
+    def _write_binary(self, stream, state_struct):
+        BinaryFormat.write_uint32(stream, self.max_rank)
+        for param in self._container:
+            stream.write(state_struct.pack(*param.get_state()))
+
+    def _read_binary(self, stream, state_struct):
+        self.max_rank = BinaryFormat.read_uint32(stream)
+        self._container = [self._new_param(state_struct.unpack(BinaryFormat.read_exactly(stream, state_struct.size)))
+                           for _ in range(self.max_rank)]
+
     def __str__(self):
         return '%s\n' % ' '.join([str(item) for item in self._container])
 
@@ -298,6 +677,9 @@ class RankPrevClickParamContainer(ParamContainer):
         :param rank_prev_click: The rank of the previously clicked search result.
         :returns: A click model parameter that corresponds to the given ranks.
         """
+        if self._prior is not None and (rank >= self.max_rank or rank_prev_click >= self.max_rank):
+            return self._prior
+
         return self._container[rank][rank_prev_click]
 
     def set(self, param, rank, rank_prev_click):
@@ -312,12 +694,25 @@ class RankPrevClickParamContainer(ParamContainer):
     def get_for_session_at_rank(self, search_session, rank):
         return self.get(rank, self._get_prev_clicked_rank(search_session, rank))
 
+    def _compile_container(self):
+        return [[ParamStatic(param.value()) for param in row] for row in self._container]
+
     def from_json(self, json_str):
         json_container = json.loads(json_str)
         for rank, _ in enumerate(self._container):
             for rank_prev_click, param in enumerate(self._container[rank]):
                 param.from_json(json_container[rank][rank_prev_click])
 
+    def _write_binary(self, stream, state_struct):
+        BinaryFormat.write_uint32(stream, self.max_rank)
+        for param in self:
+            stream.write(state_struct.pack(*param.get_state()))
+
+    def _read_binary(self, stream, state_struct):
+        self.max_rank = BinaryFormat.read_uint32(stream)
+        self._container = [[self._new_param(state_struct.unpack(BinaryFormat.read_exactly(stream, state_struct.size)))
+                            for _ in range(self.max_rank)] for _ in range(self.max_rank)]
+
     def __str__(self):
         return '\n'.join([' '.join(['{:8s}'.format(item) for item in row]) for row in self._container])
 
@@ -385,9 +780,18 @@ class SingleParamContainer(ParamContainer):
     def get_for_session_at_rank(self, search_session, rank):
         return self.get()
 
+    def _compile_container(self):
+        return ParamStatic(self._container.value())
+
     def from_json(self, json_str):
         self._container.from_json(json.loads(json_str))
 
+    def _write_binary(self, stream, state_struct):
+        stream.write(state_struct.pack(*self._container.get_state()))
+
+    def _read_binary(self, stream, state_struct):
+        self._container = self._new_param(state_struct.unpack(BinaryFormat.read_exactly(stream, state_struct.size)))
+
     def __str__(self):
         return '%s\n' % str(self._container)
 
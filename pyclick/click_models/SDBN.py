@@ -71,6 +71,19 @@ class SDBN(ClickModel):
 
         return click_probs
 
+    def _sample_session_clicks(self, search_session, sample):
+        attr_params = self.params[self.param_names.attr]
+        sat_params = self.params[self.param_names.sat]
+        clicks = [0] * len(search_session.web_results)
+
+        for rank, result in enumerate(search_session.web_results):
+            if sample() < attr_params.get(search_session.query, result.id).value():
+                clicks[rank] = 1
+                if sample() < sat_params.get(search_session.query, result.id).value():
+                    break
+
+        return clicks
+
     def predict_relevance(self, query, search_result):
         attr = self.params[self.param_names.attr].get(query, search_result).value()
         sat = self.params[self.param_names.sat].get(query, search_result).value()
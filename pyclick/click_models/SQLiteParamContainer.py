@@ -0,0 +1,403 @@
+#
+# Copyright (C) 2015  Ilya Markov
+#
+# Full copyright notice can be found in LICENSE.
+#
+from collections import OrderedDict
+import copy
+import json
+import os
+import sqlite3
+import tempfile
+
+try:
+    from urllib.request import pathname2url
+except ImportError:
+    from urllib import pathname2url
+
+from pyclick.click_models.Param import ParamStatic
+from pyclick.click_models.ParamContainer import QueryDocumentParamContainer
+from pyclick.utils.BinaryFormat import BinaryFormat
+
+__author__ = 'Ilya Markov'
+
+
+class SQLiteQueryDocumentParamContainer(QueryDocumentParamContainer):
+    """
+    A container of click model parameters that depend on a query-document pair,
+    which are stored in an SQLite database and buffered in memory.
+
+    The parameters of a query are read from the database on the first access to this query
+    and are kept in a write-back buffer.
+    When the buffer exceeds the given budget, the least recently used queries are written back
+    to the database in a batch and removed from memory.
+    So, the container can be trained on any number of query-document pairs,
+    at the cost of reading and writing the queries that do not fit in the buffer.
+
+    Unlike ShardedQueryDocumentParamContainer and DiskQueryDocumentParamContainer,
+    the container supports training, i.e., it can replace QueryDocumentParamContainer in any click model
+    (see ClickModel.spill_to_disk).
+    By default, the database is a temporary file in the directory given by the TMPDIR environment variable,
+    which is removed when no container uses it anymore.
+
+    A shallow copy of the container (e.g., the read-only copy of the current model in EMInference)
+    reads the same database through its own read-only connection and has its own empty buffer,
+    so it neither writes to the database nor evicts the buffered parameters of the container.
+    The buffered parameters are written to the database before copying, so the copy sees them
+    (later changes become visible to the copy when they are written back, as with shared parameters of a shallow copy).
+
+    SQLite connections cannot be used across fork, so a forked process (see Utils.fork_imap)
+    reopens the database read-only on the first access:
+    the parameters it changes stay in its buffer and are discarded on eviction
+    rather than written to the database of the parent process.
+    """
+
+    MAX_PARAMS_DEFAULT = 1000000
+    """The default maximum number of parameters in the buffer."""
+
+    WRITE_BACK_FRACTION = 0.25
+    """The fraction of the buffer written back to the database at once when the buffer is full."""
+
+    READ_BATCH_SIZE = 1000
+    """The number of queries read from the database at once when iterating over the container."""
+
+    def __init__(self, param_class, path='', max_params=MAX_PARAMS_DEFAULT, *args):
+        """
+        Initializes the container.
+
+        :param param_class: The class of parameters to be stored in the container.
+        :param path: The path of the SQLite database. If empty, a temporary database is used.
+        :param max_params: The maximum number of parameters to keep in the buffer
+            (a query without parameters counts as one parameter).
+        :param args: The arguments needed to create a parameter instance (optional).
+        """
+        super(SQLiteQueryDocumentParamContainer, self).__init__(param_class, *args)
+        self.path = path
+        self.max_params = max_params
+
+        self._container = OrderedDict()
+        """The buffered queries in the order of their last use: {query: {search_result: param}}."""
+        self._param_num = 0
+        """The number of buffered parameters."""
+
+        self._state_struct = self._get_state_struct(len(self._param_class(*self._param_args).get_state()))
+        self._temp_database = _TemporaryDatabase() if not path else None
+        self._read_only = False
+        self._open()
+
+    @property
+    def _connection(self):
+        """The connection to the database, which is reopened read-only in a forked process."""
+        if self._pid != os.getpid():
+            self._read_only = True
+            self._open()
+        return self._db_connection
+
+    def _open(self):
+        """Opens a connection to the database of the container in the current process."""
+        path = self._temp_database.path if self._temp_database is not None else self.path
+        self._db_connection = self._connect(path, self._read_only)
+        self._pid = os.getpid()
+
+    def _is_read_only(self):
+        """Checks whether the database is open read-only (in a copy or in a forked process)."""
+        return self._read_only or self._pid != os.getpid()
+
+    @staticmethod
+    def _connect(path, read_only=False):
+        if read_only:
+            try:
+                return sqlite3.connect('file:%s?mode=ro' % pathname2url(os.path.abspath(path)), uri=True)
+            except TypeError:
+                # Python 2 does not support URIs, the container does not write through the connection anyway
+                return sqlite3.connect(path)
+
+        connection = sqlite3.connect(path)
+        connection.execute('PRAGMA synchronous = OFF')
+        # Readers (e.g., read-only copies of the container) are not blocked by uncommitted writes
+        connection.execute('PRAGMA journal_mode = WAL')
+        connection.execute('CREATE TABLE IF NOT EXISTS params (query BLOB PRIMARY KEY, results BLOB NOT NULL)')
+        connection.commit()
+        return connection
+
+    def get(self, query, search_result):
+        results = self._get_results(query)
+
+        param = results.get(search_result)
+        if param is None:
+            if self._prior is not None:
+                return self._prior
+
+            param = self._param_class(*self._param_args)
+            self._add_param(results, search_result, param)
+
+        return param
+
+    def set(self, param, query, search_result):
+        results = self._get_results(query)
+        if search_result in results:
+            results[search_result] = param
+        else:
+            self._add_param(results, search_result, param)
+
+    def freeze(self):
+        self.flush()
+        super(SQLiteQueryDocumentParamContainer, self).freeze()
+
+    def compile(self):
+        """
+        Returns an inference-only snapshot of the container (see ParamContainer.compile).
+        The snapshot is an in-memory QueryDocumentParamContainer.
+
+        :returns: The compiled copy of the container.
+        """
+        compiled = QueryDocumentParamContainer(ParamStatic, self._param_class(*self._param_args).value())
+        compiled._container = self._compile_container()
+        compiled._compiled = True
+        compiled.freeze()
+        return compiled
+
+    def _compile_container(self):
+        return dict((query, dict((result, ParamStatic(param.value())) for result, param in results.items()))
+                    for query, results in self._items())
+
+    def size(self):
+        """
+        Returns the number of queries in the container.
+
+        :returns: The number of queries in the container.
+        """
+        self.flush()
+        return self._connection.execute('SELECT COUNT(*) FROM params').fetchone()[0]
+
+    def prune(self, min_observation_num=None, epsilon=None):
+        prior = self._param_class(*self._param_args).value()
+        self.flush()
+        self._container.clear()
+        self._param_num = 0
+
+        pruned_num = 0
+        for query, results in self._items():
+            pruned_results = [result for result, param in results.items()
+                              if self._is_pruned(param, prior, min_observation_num, epsilon)]
+            if not pruned_results:
+                continue
+
+            for result in pruned_results:
+                del results[result]
+            pruned_num += len(pruned_results)
+
+            if results:
+                self._write_queries([(query, results)])
+            else:
+                self._connection.execute('DELETE FROM params WHERE query = ?', (self._get_key(query),))
+
+        self._connection.commit()
+        return pruned_num
+
+    def flush(self):
+        """
+        Writes all buffered parameters to the database. The parameters stay in the buffer.
+        Does nothing if the database is open read-only (in a copy or in a forked process).
+        """
+        if self._is_read_only():
+            return
+        self._write_queries(self._container.items())
+        self._connection.commit()
+
+    def to_json(self):
+        return json.dumps(dict(self._items()), default=lambda o: o.__dict__)
+
+    def from_json(self, json_str):
+        json_container = json.loads(json_str)
+        for query in json_container:
+            for result in json_container[query]:
+                param = self._param_class(*self._param_args)
+                param.from_json(json_container[query][result])
+                self.set(param, query, result)
+
+    def _get_binary_name(self):
+        return QueryDocumentParamContainer.__name__
+
+    def _read_binary(self, stream, state_struct):
+        for query, results in BinaryFormat.read_chunks(
+                stream, lambda buf, offset: self._unpack_query(buf, offset, state_struct)):
+            for result, param in results:
+                self.set(param, query, result)
+
+    def __str__(self):
+        return '%s with %d buffered queries\n' % (self.__class__.__name__, len(self._container))
+
+    def __iadd__(self, other):
+        assert isinstance(other, QueryDocumentParamContainer)
+
+        for query, results in other._items():
+            for search_result, param in results.items():
+                self.get(query, search_result).__iadd__(param)
+
+        return self
+
+    def __copy__(self):
+        """
+        Returns a copy of the container that reads the same database through its own read-only connection.
+        The buffer of the copy is empty, the parameters are read from the database on access.
+        """
+        self.flush()
+
+        copied = self._copy_empty()
+        copied._read_only = True
+        copied._open()
+        return copied
+
+    def __deepcopy__(self, memo):
+        """
+        Copies the container into a new temporary database.
+        The buffer of the copy is empty, the parameters are read from the database on access.
+        """
+        self.flush()
+
+        copied = self._copy_empty()
+        copied.path = ''
+        copied._prior = copy.deepcopy(self._prior, memo)
+        copied._temp_database = _TemporaryDatabase()
+        copied._read_only = False
+        copied._open()
+
+        copied._connection.executemany('INSERT INTO params VALUES (?, ?)',
+                                       self._connection.execute('SELECT query, results FROM params'))
+        copied._connection.commit()
+        return copied
+
+    def _copy_empty(self):
+        """Returns a shallow copy of the container with an empty buffer."""
+        copied = self.__class__.__new__(self.__class__)
+        copied.__dict__.update(self.__dict__)
+        copied._container = OrderedDict()
+        copied._param_num = 0
+        return copied
+
+    def _iterator(self):
+        for _, results in self._items():
+            for param in results.values():
+                yield param
+
+    def _items(self):
+        """
+        Returns the iterable of all queries in the container and the parameters of their search results.
+        Queries are read from the database in batches (see READ_BATCH_SIZE).
+        The parameters of buffered queries are the buffered objects,
+        other parameters are read-only copies that are not written back.
+        """
+        self.flush()
+
+        last_key = sqlite3.Binary(b'')
+        while True:
+            rows = self._connection.execute('SELECT query, results FROM params WHERE query > ? ORDER BY query LIMIT ?',
+                                            (last_key, self.READ_BATCH_SIZE)).fetchall()
+            if not rows:
+                return
+
+            for key, value in rows:
+                (query, results), _ = self._unpack_query(value, 0, self._state_struct)
+                buffered_results = self._container.get(query)
+                yield query, buffered_results if buffered_results is not None else dict(results)
+            last_key = rows[-1][0]
+
+    def _get_results(self, query):
+        """
+        Returns the buffered parameters of the given query, reading them from the database if needed.
+
+        :param query: The query.
+        :returns: The dictionary of parameters of the search results of the query.
+        """
+        results = self._container.get(query)
+        if results is not None:
+            self._container[query] = self._container.pop(query)
+            return results
+
+        row = self._connection.execute('SELECT results FROM params WHERE query = ?',
+                                       (self._get_key(query),)).fetchone()
+        results = {}
+        if row is not None:
+            (_, query_results), _ = self._unpack_query(row[0], 0, self._state_struct)
+            results = dict(query_results)
+
+        self._container[query] = results
+        self._param_num += max(len(results), 1)
+        self._evict()
+        return results
+
+    def _add_param(self, results, search_result, param):
+        results[search_result] = param
+        if len(results) > 1:
+            self._param_num += 1
+            self._evict()
+
+    def _evict(self):
+        """
+        Writes back and removes the least recently used queries from the buffer if it exceeds the budget.
+        The most recently used query is always kept, since its parameters may be in use.
+        """
+        if self._param_num <= self.max_params:
+            return
+
+        target_param_num = self.max_params * (1 - self.WRITE_BACK_FRACTION)
+        evicted = []
+        while self._param_num > target_param_num and len(self._container) > 1:
+            query, results = self._container.popitem(last=False)
+            self._param_num -= max(len(results), 1)
+            evicted.append((query, results))
+
+        if self._prior is None and not self._is_read_only():
+            # Committed, so that copies and forked processes read the evicted parameters from the database
+            self._write_queries(evicted)
+            self._connection.commit()
+
+    def _write_queries(self, query_results):
+        """
+        Writes the given queries and the parameters of their search results to the database.
+
+        :param query_results: The iterable of (query, {search_result: param}) pairs.
+        """
+        rows = []
+        for query, results in query_results:
+            if results:
+                value = bytearray()
+                self._pack_query(value, (query, results), self._state_struct)
+                rows.append((self._get_key(query), sqlite3.Binary(value)))
+
+        self._connection.executemany('INSERT OR REPLACE INTO params VALUES (?, ?)', rows)
+
+    @staticmethod
+    def _get_key(query):
+        """
+        Returns the database key of the given query.
+        Keys and values are bound as sqlite3.Binary, so that they are stored as BLOBs on Python 2 as well,
+        where bytes is str and would be stored as TEXT.
+        """
+        key = bytearray()
+        BinaryFormat.pack_key(key, query)
+        return sqlite3.Binary(key)
+
+
+class _TemporaryDatabase(object):
+    """
+    A temporary database file shared by a container and its read-only copies,
+    which is removed when none of them uses it anymore.
+    """
+
+    def __init__(self):
+        fd, self.path = tempfile.mkstemp(prefix='pyclick-', suffix='.sqlite')
+        os.close(fd)
+        self._pid = os.getpid()
+
+    def __del__(self):
+        # The database belongs to the process that created it, not to forked processes
+        if os.getpid() != self._pid:
+            return
+
+        for path in (self.path, self.path + '-wal', self.path + '-shm'):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
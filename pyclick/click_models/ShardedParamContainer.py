@@ -0,0 +1,171 @@
+#
+# Copyright (C) 2015  Ilya Markov
+#
+# Full copyright notice can be found in LICENSE.
+#
+from collections import OrderedDict
+import gzip
+import zlib
+
+from pyclick.click_models.ParamContainer import QueryDocumentParamContainer
+from pyclick.utils.BinaryFormat import BinaryFormat
+
+__author__ = 'Ilya Markov'
+
+
+class ShardedQueryDocumentParamContainer(QueryDocumentParamContainer):
+    """
+    A read-only container of click model parameters that depend on a query-document pair,
+    which are stored on disk in shards partitioned by the hash of a query.
+
+    The parameters of a shard are loaded on the first access to any query of this shard.
+    If the number of loaded parameters exceeds the given budget,
+    the least recently used shards are evicted from memory.
+    So, the memory used by the container follows the set of queries that are actually requested.
+
+    The container is always frozen (see ParamContainer.freeze):
+    parameters of unseen query-document pairs take the prior value.
+    A compiled container (see compile) loads shards lazily as well.
+    """
+
+    SHARD_FILE_FORMAT = '%s-%05d.bin'
+    """The format of shard file names: the path prefix and the number of a shard."""
+
+    def __init__(self, param_class, path_prefix, shard_num, max_params=None, compress=False, *args):
+        """
+        Initializes the container.
+
+        :param param_class: The class of parameters to be stored in the container.
+        :param path_prefix: The path prefix of shard files (see SHARD_FILE_FORMAT).
+        :param shard_num: The number of shards.
+        :param max_params: The maximum number of parameters to keep in memory.
+            If not set, loaded shards are never evicted.
+            The most recently used shard is kept in memory even if it alone exceeds the budget.
+        :param compress: Whether the shard files are compressed using gzip.
+        :param args: The arguments needed to create a parameter instance (optional).
+        """
+        super(ShardedQueryDocumentParamContainer, self).__init__(param_class, *args)
+        self.path_prefix = path_prefix
+        self.shard_num = shard_num
+        self.max_params = max_params
+        self.compress = compress
+
+        self._shards = OrderedDict()
+        """The loaded shards in the order of their last use: {shard: [query1, query2, ...]}."""
+        self._param_num = 0
+        """The number of loaded parameters."""
+        self._stored_param_class = param_class
+        """The class of parameters in shard files, which does not change when the container is compiled."""
+        self._stored_param_args = args
+
+        self.freeze()
+
+    @staticmethod
+    def get_shard(query, shard_num):
+        """
+        Returns the shard of the given query.
+        Unlike the built-in hash function, the shard does not change between runs of Python.
+
+        :param query: The query.
+        :param shard_num: The number of shards.
+        :returns: The shard of the given query.
+        """
+        key = str(query).encode('ascii') if BinaryFormat.is_int_key(query) else BinaryFormat.encode_key(query)
+        return (zlib.crc32(key) & 0xffffffff) % shard_num
+
+    @classmethod
+    def write_shards(cls, container, path_prefix, shard_num, compress=False):
+        """
+        Writes the parameters of the given container into shard files.
+
+        :param container: The container of parameters that depend on a query-document pair.
+        :param path_prefix: The path prefix of shard files (see SHARD_FILE_FORMAT).
+        :param shard_num: The number of shards.
+        :param compress: Whether to compress the shard files using gzip.
+        """
+        shard_queries = [[] for _ in range(shard_num)]
+        for query in container._container:
+            shard_queries[cls.get_shard(query, shard_num)].append(query)
+
+        for shard, queries in enumerate(shard_queries):
+            shard_container = QueryDocumentParamContainer(container._param_class, *container._param_args)
+            shard_container._container = dict((query, container._container[query]) for query in queries)
+
+            with cls._open_shard(path_prefix, shard, 'wb', compress) as shard_file:
+                shard_container.to_binary(shard_file)
+
+    def get(self, query, search_result):
+        shard = self.get_shard(query, self.shard_num)
+
+        if shard in self._shards:
+            self._shards[shard] = self._shards.pop(shard)
+        else:
+            self._load_shard(shard)
+
+        return super(ShardedQueryDocumentParamContainer, self).get(query, search_result)
+
+    def unfreeze(self):
+        raise RuntimeError("Cannot unfreeze a sharded parameter container")
+
+    def prune(self, min_observation_num=None, epsilon=None):
+        raise RuntimeError("Cannot prune a sharded parameter container, prune the container before writing shards")
+
+    def compile(self):
+        """
+        Returns an inference-only snapshot of the container (see ParamContainer.compile).
+        The snapshot shares the shard files with the container:
+        it compiles the loaded shards and each shard it loads later.
+
+        :returns: The compiled copy of the container.
+        """
+        compiled = super(ShardedQueryDocumentParamContainer, self).compile()
+        compiled._shards = OrderedDict(self._shards)
+        return compiled
+
+    def size(self):
+        """
+        Returns the number of queries in the loaded shards.
+
+        :returns: The number of queries in the loaded shards.
+        """
+        return len(self._container)
+
+    def get_loaded_shards(self):
+        """
+        Returns the list of loaded shards, from the least to the most recently used one.
+
+        :returns: The list of loaded shards.
+        """
+        return list(self._shards)
+
+    def _load_shard(self, shard):
+        """
+        Loads the given shard into memory and evicts the least recently used shards
+        if the number of loaded parameters exceeds the budget.
+
+        :param shard: The shard to load.
+        """
+        shard_container = QueryDocumentParamContainer(self._stored_param_class, *self._stored_param_args)
+        with self._open_shard(self.path_prefix, shard, 'rb', self.compress) as shard_file:
+            shard_container.from_binary(shard_file)
+        if self._compiled:
+            shard_container = shard_container.compile()
+
+        queries = list(shard_container._container)
+        for query in queries:
+            results = shard_container._container[query]
+            self._container[query] = results
+            self._param_num += len(results)
+        self._shards[shard] = queries
+
+        while self.max_params is not None and self._param_num > self.max_params and len(self._shards) > 1:
+            _, evicted_queries = self._shards.popitem(last=False)
+            for query in evicted_queries:
+                self._param_num -= len(self._container.pop(query))
+
+    @classmethod
+    def _open_shard(cls, path_prefix, shard, mode, compress):
+        shard_path = cls.SHARD_FILE_FORMAT % (path_prefix, shard)
+        if compress:
+            return gzip.GzipFile(shard_path, mode, mtime=0)
+        return open(shard_path, mode)
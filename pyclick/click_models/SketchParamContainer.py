@@ -0,0 +1,179 @@
+#
+# Copyright (C) 2015  Ilya Markov
+#
+# Full copyright notice can be found in LICENSE.
+#
+from array import array
+import copy
+import math
+import struct
+import sys
+
+from pyclick.click_models.Param import Param
+from pyclick.click_models.ParamContainer import QueryDocumentParamContainer
+from pyclick.utils.BinaryFormat import BinaryFormat
+from pyclick.utils.CountMinSketch import CountMinSketch
+
+__author__ = 'Ilya Markov'
+
+
+class SketchCTRParamContainer(QueryDocumentParamContainer):
+    """
+    A container of CTR parameters that depend on a query-document pair (see DCTR),
+    which counts clicks and impressions in two count-min sketches instead of storing a parameter per pair.
+    So, the memory used by the container is fixed (16 * width * depth bytes), however many pairs are counted.
+
+    Pairs of the given head queries are counted exactly in regular parameters,
+    so their CTR is the same as in QueryDocumentParamContainer.
+    For other pairs, the numbers of clicks and impressions are overestimated:
+    with probability at least 1 - exp(-depth), each of them exceeds the true number
+    by at most e / width times the total number of clicks or impressions of these pairs, respectively
+    (see CountMinSketch and get_error_bounds).
+    The CTR is estimated as (clicks + 1) / (impressions + 2), as in CTRParamMLE.
+
+    Iterating over the container yields only the parameters of the head queries,
+    since the pairs counted in the sketches are not stored.
+    """
+
+    WIDTH_DEFAULT = 2 ** 20
+    """The default width of the sketches."""
+
+    DEPTH_DEFAULT = 4
+    """The default depth of the sketches."""
+
+    def __init__(self, param_class, width=WIDTH_DEFAULT, depth=DEPTH_DEFAULT, head_queries=None, seed=0, *args):
+        """
+        Initializes the container.
+
+        :param param_class: The class of parameters of the head queries (e.g., CTRParamMLE).
+        :param width: The width of the sketches.
+        :param depth: The depth of the sketches.
+        :param head_queries: The collection of queries, whose parameters are counted exactly.
+        :param seed: The seed of the hash functions of the sketches, an integer in [0, 2^32) (see CountMinSketch).
+        :param args: The arguments needed to create a parameter instance (optional).
+        """
+        super(SketchCTRParamContainer, self).__init__(param_class, *args)
+        self.head_queries = frozenset(head_queries or [])
+        self.clicks = CountMinSketch(width, depth, seed)
+        """The sketch of the numbers of clicks of query-document pairs that are not in the head."""
+        self.impressions = CountMinSketch(width, depth, seed)
+        """The sketch of the numbers of impressions of query-document pairs that are not in the head."""
+
+    def get(self, query, search_result):
+        if query in self.head_queries:
+            return super(SketchCTRParamContainer, self).get(query, search_result)
+
+        key = bytearray()
+        BinaryFormat.pack_key(key, query)
+        BinaryFormat.pack_key(key, search_result)
+        return SketchCTRParam(self, self.clicks.get_indices(bytes(key)))
+
+    def set(self, param, query, search_result):
+        if query not in self.head_queries:
+            raise RuntimeError("Cannot set a parameter counted in a sketch")
+
+        super(SketchCTRParamContainer, self).set(param, query, search_result)
+
+    def get_error_bounds(self):
+        """
+        Returns the maximum overestimation of the numbers of clicks and impressions of pairs outside of the head,
+        which holds with the given probability (see CountMinSketch.get_error).
+
+        :returns: The dictionary with the following keys: clicks, impressions, probability.
+        """
+        return {
+            'clicks': self.clicks.get_error(),
+            'impressions': self.impressions.get_error(),
+            'probability': 1 - math.exp(-self.clicks.depth),
+        }
+
+    def compile(self):
+        compiled = super(SketchCTRParamContainer, self).compile()
+        compiled.clicks = copy.deepcopy(self.clicks)
+        compiled.impressions = copy.deepcopy(self.impressions)
+        return compiled
+
+    def get_memory_footprint(self, seen=None):
+        footprint = super(SketchCTRParamContainer, self).get_memory_footprint(seen)
+
+        sketch_size = sum(sys.getsizeof(sketch.get_counters()) for sketch in (self.clicks, self.impressions))
+        for part in ('values', 'payload', 'total'):
+            footprint[part] += sketch_size
+        for representation in footprint['compact']:
+            footprint['compact'][representation] += sketch_size
+        return footprint
+
+    def to_json(self):
+        raise RuntimeError("Cannot convert count-min sketches into JSON, use to_binary instead")
+
+    def _write_binary(self, stream, state_struct):
+        super(SketchCTRParamContainer, self)._write_binary(stream, state_struct)
+        BinaryFormat.write_chunks(stream, self.head_queries, BinaryFormat.pack_key)
+
+        BinaryFormat.write_uint32(stream, self.clicks.width)
+        BinaryFormat.write_uint32(stream, self.clicks.depth)
+        BinaryFormat.write_uint32(stream, self.clicks.seed)
+        for sketch in (self.clicks, self.impressions):
+            stream.write(struct.pack('<d', sketch.total))
+            counters = sketch.get_counters()
+            if sys.byteorder != 'little':
+                counters = array('d', counters)
+                counters.byteswap()
+            stream.write(counters.tostring() if sys.version_info[0] < 3 else counters.tobytes())
+
+    def _read_binary(self, stream, state_struct):
+        super(SketchCTRParamContainer, self)._read_binary(stream, state_struct)
+        self.head_queries = frozenset(BinaryFormat.read_chunks(stream, BinaryFormat.unpack_key))
+
+        width = BinaryFormat.read_uint32(stream)
+        depth = BinaryFormat.read_uint32(stream)
+        seed = BinaryFormat.read_uint32(stream)
+        self.clicks = CountMinSketch(width, depth, seed)
+        self.impressions = CountMinSketch(width, depth, seed)
+
+        for sketch in (self.clicks, self.impressions):
+            total, = struct.unpack('<d', BinaryFormat.read_exactly(stream, 8))
+            counters = array('d')
+            data = BinaryFormat.read_exactly(stream, 8 * width * depth)
+            if sys.version_info[0] < 3:
+                counters.fromstring(data)
+            else:
+                counters.frombytes(data)
+            if sys.byteorder != 'little':
+                counters.byteswap()
+            sketch.set_counters(counters, total)
+
+    def __iadd__(self, other):
+        super(SketchCTRParamContainer, self).__iadd__(other)
+        self.clicks += other.clicks
+        self.impressions += other.impressions
+        return self
+
+
+class SketchCTRParam(Param):
+    """
+    The CTR parameter of a query-document pair counted in the sketches of SketchCTRParamContainer.
+    The parameter is a view of the counters of the pair, it is created on each lookup.
+    """
+
+    def __init__(self, container, indices):
+        self._container = container
+        self._indices = indices
+
+    def value(self):
+        numerator, denominator = self.get_state()
+        return numerator / float(denominator)
+
+    def get_state(self):
+        return (self._container.clicks.estimate_at(self._indices) + 1,
+                self._container.impressions.estimate_at(self._indices) + 2)
+
+    def set_state(self, state):
+        raise RuntimeError("Cannot set the state of a parameter counted in a sketch")
+
+    def update(self, search_session, rank):
+        self._container.clicks.add_at(self._indices, search_session.web_results[rank].click)
+        self._container.impressions.add_at(self._indices, 1)
+
+    def __iadd__(self, other):
+        raise RuntimeError("Cannot merge parameters counted in a sketch, merge the containers instead")
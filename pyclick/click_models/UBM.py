@@ -75,6 +75,21 @@ class UBM(ClickModel):
 
         return click_probs
 
+    def _sample_session_clicks(self, search_session, sample):
+        attr_params = self.params[self.param_names.attr]
+        exam_params = self.params[self.param_names.exam]
+        clicks = [0] * len(search_session.web_results)
+        rank_prev_click = len(search_session.web_results) - 1
+
+        for rank, result in enumerate(search_session.web_results):
+            attr = attr_params.get(search_session.query, result.id).value()
+            exam = exam_params.get(rank, rank_prev_click).value()
+            if sample() < attr * exam:
+                clicks[rank] = 1
+                rank_prev_click = rank
+
+        return clicks
+
     def predict_relevance(self, query, search_result):
         return self.params[self.param_names.attr].get(query, search_result).value()
 
@@ -85,10 +100,14 @@ class UBM(ClickModel):
 
         :param search_session: The current search session.
         :param rank: The rank of a search result.
-        :param rank_prev_click: The rank of the previously clicked search result.
+        :param rank_prev_click: The rank of the previously clicked search result (-1 if there is none).
 
         :returns: The click probability for a given search result.
         """
+        if rank_prev_click < 0:
+            # Examination without previous clicks is stored at the last rank of the SERP,
+            # as in training (see RankPrevClickParamContainer)
+            rank_prev_click = len(search_session.web_results) - 1
         attr = self.params[self.param_names.attr].get(search_session.query, search_session.web_results[rank].id).value()
         exam = self.params[self.param_names.exam].get(rank, rank_prev_click).value()
         return attr * exam
@@ -14,20 +14,26 @@ class TaskCentricEMInference(EMInference):
     for task-centric click models.
     """
 
-    def infer_params(self, click_model, search_tasks):
-        if search_tasks is None or len(search_tasks) == 0:
-            return
-
-        for iteration in range(self.iter_num):
-            new_click_model = click_model.__class__()
-
+    def _update_params(self, click_model, new_click_model, search_tasks, profilers):
+        if profilers:
             for search_task in search_tasks:
                 for search_session in search_task.search_sessions:
-                    current_session_params = click_model.get_session_params(search_session)
-                    new_session_params = new_click_model.get_session_params(search_session)
+                    current_session_params = self._get_profiled_session_params(click_model, search_session,
+                                                                               profilers)
+                    new_session_params = self._get_profiled_session_params(new_click_model, search_session,
+                                                                           profilers)
 
                     for rank, result in enumerate(search_session.web_results):
                         for param_name, param in new_session_params[rank].items():
-                            param.update(search_task, search_session, rank, current_session_params)
+                            self._profiled_update(param, profilers, search_task, search_session, rank,
+                                                  current_session_params)
+            return
+
+        for search_task in search_tasks:
+            for search_session in search_task.search_sessions:
+                current_session_params = click_model.get_session_params(search_session)
+                new_session_params = new_click_model.get_session_params(search_session)
 
-            click_model.params = new_click_model.params
+                for rank, result in enumerate(search_session.web_results):
+                    for param_name, param in new_session_params[rank].items():
+                        param.update(search_task, search_session, rank, current_session_params)
@@ -0,0 +1,229 @@
+#
+# Copyright (C) 2015  Ilya Markov
+#
+# Full copyright notice can be found in LICENSE.
+#
+from __future__ import division
+import copy
+import io
+import math
+import shutil
+import tempfile
+import unittest
+
+from pyclick.click_models.CCM import CCM
+from pyclick.click_models.CM import CM
+from pyclick.click_models.CTR import DCTR
+from pyclick.click_models.DBN import DBN
+from pyclick.click_models.DCM import DCM
+from pyclick.click_models.Inference import EMInference
+from pyclick.click_models.InferenceCallback import InferenceCallback, ParamPruning
+from pyclick.click_models.SDBN import SDBN
+from pyclick.click_models.UBM import UBM
+from pyclick.utils.SessionGenerator import SessionGenerator
+from pyclick.utils.Utils import Utils
+
+
+__author__ = 'Ilya Markov'
+
+
+class ContainerSizeCallback(InferenceCallback):
+    """Records the number of query-document parameters of the current model before and after each iteration."""
+
+    def __init__(self):
+        self.sizes = []
+        self._click_model = None
+        self._attr = None
+
+    def on_train_begin(self, click_model, search_sessions, iter_num):
+        self._click_model = click_model
+
+    def on_iteration_begin(self, iteration):
+        self._attr = self._click_model.params[self._click_model.param_names.attr]
+        self.sizes.append([sum(1 for _ in self._attr)])
+
+    def on_iteration_end(self, iteration, click_model):
+        self.sizes[-1].append(sum(1 for _ in self._attr))
+
+
+class ClickModelTestCase(unittest.TestCase):
+
+    def setUp(self):
+        generator = SessionGenerator(query_num=50, serp_depth=5, docs_per_query=8, seed=1)
+        self.train_sessions = generator.generate(300)
+        self.test_sessions = generator.generate(100)
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _train(self, click_model):
+        click_model.train(self.train_sessions)
+        click_model.freeze()
+        return click_model
+
+    def _assert_same_click_probs(self, click_model, expected_click_model):
+        for search_session in self.test_sessions:
+            for click_prob, expected_click_prob in zip(click_model.get_full_click_probs(search_session),
+                                                       expected_click_model.get_full_click_probs(search_session)):
+                self.assertAlmostEqual(click_prob, expected_click_prob)
+
+    def test_compile_sharded(self):
+        click_model = self._train(UBM())
+        click_model.to_shards(self.directory, 4)
+
+        sharded_click_model = UBM()
+        sharded_click_model.from_shards(self.directory, max_params=20)
+        sharded_click_model.get_full_click_probs(self.test_sessions[0])
+        compiled_click_model = sharded_click_model.compile()
+
+        self._assert_same_click_probs(sharded_click_model, click_model)
+        self._assert_same_click_probs(compiled_click_model, click_model)
+
+    def test_compile_store(self):
+        click_model = self._train(UBM())
+        click_model.to_store(self.directory)
+
+        stored_click_model = UBM()
+        stored_click_model.from_store(self.directory, max_params=20)
+        stored_click_model.get_full_click_probs(self.test_sessions[0])
+        compiled_click_model = stored_click_model.compile()
+
+        self._assert_same_click_probs(stored_click_model, click_model)
+        self._assert_same_click_probs(compiled_click_model, click_model)
+
+        container = compiled_click_model.params[compiled_click_model.param_names.attr]
+        self.assertTrue(container.is_compiled())
+        self.assertLessEqual(container._param_num, 20 + 8)
+        self.assertGreater(container.miss_num, 0)
+        container.close()
+
+    def test_compile_sqlite(self):
+        click_model = self._train(UBM())
+        sqlite_click_model = UBM()
+        sqlite_click_model.spill_to_disk(max_params=20)
+        self._train(sqlite_click_model)
+        self._assert_same_click_probs(sqlite_click_model, click_model)
+        self._assert_same_click_probs(sqlite_click_model.compile(), click_model)
+
+        # Keys and values are stored as BLOBs, so that keys are ordered by bytes on all Python versions
+        attr = sqlite_click_model.params[sqlite_click_model.param_names.attr]
+        self.assertEqual(attr._connection.execute('SELECT DISTINCT typeof(query), typeof(results) FROM params')
+                         .fetchall(), [('blob', 'blob')])
+
+        stream = io.BytesIO()
+        sqlite_click_model.to_binary(stream)
+        stream.seek(0)
+        decoded_click_model = UBM()
+        decoded_click_model.spill_to_disk(max_params=20)
+        decoded_click_model.from_binary(stream)
+        decoded_click_model.freeze()
+        self._assert_same_click_probs(decoded_click_model, click_model)
+
+    def test_sqlite_copy(self):
+        click_model = DCTR()
+        click_model.spill_to_disk(max_params=20)
+        click_model.train(self.train_sessions)
+        container = click_model.params[click_model.param_names.ctr]
+        search_session = self.test_sessions[0]
+        param = container.get(search_session.query, search_session.web_results[0].id)
+        param.update(search_session, 0)
+        buffered = dict(container._container)
+
+        # The copy evicts its own buffer and does not write to the database
+        copied = copy.copy(container)
+        copied.freeze()
+        self.assertEqual(sum(1 for _ in copied), sum(1 for _ in container))
+        for test_session in self.test_sessions:
+            for result in test_session.web_results:
+                copied.get(test_session.query, result.id)
+        self.assertEqual(dict(container._container), buffered)
+        self.assertAlmostEqual(copied.get(search_session.query, search_session.web_results[0].id).value(),
+                               param.value())
+        self.assertRaises(Exception, copied._connection.execute, 'DELETE FROM params')
+
+        # Forked processes open their own connections
+        click_probs = Utils.fork_map(click_model.get_full_click_probs, self.test_sessions, 2)
+        self.assertEqual(click_probs, [click_model.get_full_click_probs(test_session)
+                                       for test_session in self.test_sessions])
+
+    def test_memory_footprint(self):
+        # An empty container holds only its dictionary
+        attr_footprint = UBM().get_memory_footprint()['containers']['attr']
+        self.assertEqual(attr_footprint['param_num'], 0)
+        self.assertEqual(attr_footprint['payload'], 0)
+        self.assertLess(attr_footprint['total'], 1024)
+
+        footprints = []
+        for session_num in (50, 100, 300):
+            click_model = UBM()
+            click_model.train(self.train_sessions[:session_num])
+            footprint = click_model.get_memory_footprint()
+            self.assertEqual(footprint['param_num'], sum(sum(1 for _ in container)
+                                                         for container in click_model.params.values()))
+            self.assertEqual(footprint['total'], footprint['overhead'] + footprint['payload'])
+            self.assertEqual(footprint['total'], sum(container['total']
+                                                     for container in footprint['containers'].values()))
+            self.assertTrue(all(size < footprint['total'] for size in footprint['compact'].values()))
+            footprints.append(footprint)
+
+        # The footprint grows with the number of parameters
+        for footprint, next_footprint in zip(footprints, footprints[1:]):
+            self.assertGreater(next_footprint['param_num'], footprint['param_num'])
+            for part in ('structure', 'objects', 'keys', 'values', 'total'):
+                self.assertGreater(next_footprint[part], footprint[part])
+
+    def test_sample_clicks(self):
+        replication_num = 1000
+        serps = self.test_sessions[:20]
+        sessions = serps * replication_num
+
+        for click_model in [CM(), DCM(), SDBN(), DBN(EMInference(5)), CCM(EMInference(5)), UBM(EMInference(5))]:
+            self._train(click_model)
+            clicks = click_model.sample_clicks(sessions, seed=1)
+            self.assertEqual(clicks, click_model.sample_clicks(sessions, seed=1))
+            if isinstance(click_model, CM):
+                # The cascade model stops after the first click
+                self.assertTrue(all(sum(session_clicks) <= 1 for session_clicks in clicks))
+
+            # The click rate at each rank matches the full click probability, averaged over SERPs
+            full_click_probs = [click_model.get_full_click_probs(serp) for serp in serps]
+            for rank in range(5):
+                click_rate = sum(session_clicks[rank] for session_clicks in clicks) / len(sessions)
+                click_prob = sum(click_probs[rank] for click_probs in full_click_probs) / len(serps)
+                std_error = math.sqrt(click_prob * (1 - click_prob) / len(sessions))
+                self.assertLess(abs(click_rate - click_prob), 5 * std_error + 1e-9,
+                                '%s at rank %d' % (click_model.__class__.__name__, rank))
+
+    def test_prune_during_em(self):
+        pruning = ParamPruning(min_observation_num=5)
+        sizes = ContainerSizeCallback()
+        click_model = UBM(EMInference(5))
+        click_model.train(self.train_sessions, [pruning, sizes])
+
+        self.assertGreater(pruning.pruned_num, 0)
+        # The E-step does not add pruned parameters back to the current model
+        for size_before, size_after in sizes.sizes[1:]:
+            self.assertEqual(size_after, size_before)
+        self.assertEqual(click_model.prune(min_observation_num=5), 0)
+
+    def test_prune_single_em_iteration(self):
+        # A single EM iteration updates a copy of the click model, which is pruned only at the end of the iteration
+        click_model = UBM(EMInference(1))
+        click_model.train(self.train_sessions)
+        expected_click_model = copy.deepcopy(click_model)
+        expected_pruning = ParamPruning(min_observation_num=5)
+        expected_click_model.train(self.train_sessions, [expected_pruning])
+
+        pruning = ParamPruning(min_observation_num=5, session_interval=50)
+        click_model.train(self.train_sessions, [pruning])
+        self.assertEqual(pruning.pruned_num, expected_pruning.pruned_num)
+        self._assert_same_click_probs(click_model, expected_click_model)
+
+    def test_prune_sharded(self):
+        click_model = self._train(UBM())
+        click_model.to_shards(self.directory, 4)
+
+        sharded_click_model = UBM()
+        sharded_click_model.from_shards(self.directory)
+        self.assertRaises(RuntimeError, sharded_click_model.prune, 5)
@@ -0,0 +1,93 @@
+#
+# Copyright (C) 2015  Ilya Markov
+#
+# Full copyright notice can be found in LICENSE.
+#
+from __future__ import division
+from collections import Counter
+import io
+import math
+import random
+import struct
+import unittest
+import zlib
+
+from pyclick.click_models.CTR import CTRParamMLE
+from pyclick.click_models.SketchParamContainer import SketchCTRParamContainer
+from pyclick.utils.BinaryFormat import BinaryFormat
+from pyclick.utils.CountMinSketch import CountMinSketch
+
+
+__author__ = 'Ilya Markov'
+
+
+class CountMinSketchTestCase(unittest.TestCase):
+
+    @staticmethod
+    def _get_keys(key_num):
+        """Returns the keys of distinct query-document pairs, as packed by SketchCTRParamContainer."""
+        keys = []
+        for i in range(key_num):
+            key = bytearray()
+            BinaryFormat.pack_key(key, 'query%d' % (i // 10))
+            BinaryFormat.pack_key(key, 'doc%d' % (i % 10))
+            keys.append(bytes(key))
+        return keys
+
+    def test_collisions(self):
+        key_num = 100000
+        sketch = CountMinSketch(2 ** 16, 4)
+        indices = [sketch.get_indices(key) for key in self._get_keys(key_num)]
+
+        # No pair of keys shares all counters
+        self.assertEqual(len(set(tuple(key_indices) for key_indices in indices)), key_num)
+
+        # In each row, a pair of keys shares a counter with probability about 1 / width
+        expected_pair_num = key_num * (key_num - 1) / 2 / sketch.width
+        for row in range(sketch.depth):
+            counts = Counter(key_indices[row] for key_indices in indices)
+            pair_num = sum(count * (count - 1) / 2 for count in counts.values())
+            self.assertLess(abs(pair_num - expected_pair_num), 0.02 * expected_pair_num)
+
+    def test_crc32_collision(self):
+        # Keys of the same length with the same CRC-32 (which would have the same 32-bit hash),
+        # found among random keys by the birthday paradox
+        rnd = random.Random(1)
+        keys_by_crc = {}
+        while True:
+            key = struct.pack('<QQ', rnd.getrandbits(64), rnd.getrandbits(64))
+            other_key = keys_by_crc.setdefault(zlib.crc32(key), key)
+            if other_key != key:
+                break
+
+        for seed in range(10):
+            sketch = CountMinSketch(2 ** 16, 4, seed)
+            self.assertNotEqual(sketch.get_indices(key), sketch.get_indices(other_key))
+
+    def test_error_bound(self):
+        rnd = random.Random(1)
+        keys = self._get_keys(50000)
+        # Zipf-like counts
+        counts = [int(1000 / (rank + 1)) + rnd.randint(0, 1) for rank in range(len(keys))]
+
+        sketch = CountMinSketch(2 ** 10, 3, seed=7)
+        for key, count in zip(keys, counts):
+            sketch.add(key, count)
+        self.assertEqual(sketch.total, sum(counts))
+
+        errors = [sketch.estimate(key) - count for key, count in zip(keys, counts)]
+        self.assertGreaterEqual(min(errors), 0)
+        exceeding_num = sum(1 for error in errors if error > sketch.get_error())
+        self.assertLessEqual(exceeding_num / len(keys), math.exp(-sketch.depth))
+
+    def test_seed(self):
+        self.assertRaises(ValueError, CountMinSketch, 16, 2, -1)
+        self.assertRaises(ValueError, CountMinSketch, 16, 2, 2 ** 32)
+
+        container = SketchCTRParamContainer(CTRParamMLE, 16, 2, seed=2 ** 32 - 1)
+        stream = io.BytesIO()
+        container.to_binary(stream)
+        stream.seek(0)
+        decoded_container = SketchCTRParamContainer(CTRParamMLE, 16, 2)
+        decoded_container.from_binary(stream)
+        self.assertEqual(decoded_container.clicks.seed, 2 ** 32 - 1)
@@ -0,0 +1,218 @@
+#
+# Copyright (C) 2015  Ilya Markov
+#
+# Full copyright notice can be found in LICENSE.
+#
+from __future__ import division
+import math
+import random
+import unittest
+
+from pyclick.click_models.CTR import DCTR, SketchDCTR
+from pyclick.click_models.CrossValidation import CrossValidation
+from pyclick.click_models.Evaluation import BootstrapEvaluation, CTRPrediction, LogLikelihood, MultiEvaluation, \
+    Perplexity, PerplexityCond, _add_log2_sums_at_rank
+from pyclick.click_models.Inference import EMInference
+from pyclick.click_models.UBM import UBM
+from pyclick.utils.SessionGenerator import SessionGenerator
+
+
+__author__ = 'Ilya Markov'
+
+
+class EvaluationTestCase(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        generator = SessionGenerator(query_num=50, serp_depth=6, docs_per_query=10, seed=1)
+        cls.click_model = UBM()
+        cls.click_model.train(generator.generate(500))
+        cls.click_model.freeze()
+
+        cls.test_sessions = generator.generate(200)
+        # SERPs of different depths
+        for search_session in cls.test_sessions[::5]:
+            del search_session.web_results[3:]
+
+    def _get_loop_results(self):
+        """Computes the metrics with straightforward loops over search sessions and ranks."""
+        loglikelihood = 0.0
+        log2_sum_at_rank = [0.0] * 6
+        log2_cond_sum_at_rank = [0.0] * 6
+        session_num_at_rank = [0] * 6
+
+        for search_session in self.test_sessions:
+            conditional_click_probs = self.click_model.get_conditional_click_probs(search_session)
+            full_click_probs = self.click_model.get_full_click_probs(search_session)
+            loglikelihood += sum(math.log(p) for p in conditional_click_probs) / len(conditional_click_probs)
+
+            for rank, result in enumerate(search_session.web_results):
+                p = full_click_probs[rank] if result.click else 1 - full_click_probs[rank]
+                log2_sum_at_rank[rank] += math.log(p, 2)
+                log2_cond_sum_at_rank[rank] += math.log(conditional_click_probs[rank], 2)
+                session_num_at_rank[rank] += 1
+
+        perplexities = []
+        for log2_sums in (log2_sum_at_rank, log2_cond_sum_at_rank):
+            perplexity_at_rank = [2 ** (-x / n) for x, n in zip(log2_sums, session_num_at_rank)]
+            perplexities.append((sum(perplexity_at_rank) / len(perplexity_at_rank), perplexity_at_rank))
+
+        return [loglikelihood / len(self.test_sessions)] + perplexities
+
+    def _assert_results_equal(self, results, expected_results):
+        loglikelihood, perplexity, perplexity_cond = results
+        expected_loglikelihood, expected_perplexity, expected_perplexity_cond = expected_results
+
+        self.assertAlmostEqual(loglikelihood, expected_loglikelihood, places=12)
+        for (value, value_at_rank), (expected_value, expected_value_at_rank) in \
+                [(perplexity, expected_perplexity), (perplexity_cond, expected_perplexity_cond)]:
+            self.assertAlmostEqual(value, expected_value, places=12)
+            self.assertEqual(len(value_at_rank), len(expected_value_at_rank))
+            for x, expected_x in zip(value_at_rank, expected_value_at_rank):
+                self.assertAlmostEqual(x, expected_x, places=12)
+
+    def test_metrics_match_loops(self):
+        evaluations = [LogLikelihood(), Perplexity(), PerplexityCond()]
+        expected_results = self._get_loop_results()
+
+        self._assert_results_equal([evaluation.evaluate(self.click_model, self.test_sessions)
+                                    for evaluation in evaluations], expected_results)
+        for batch_size in (1, 7, len(self.test_sessions)):
+            results = MultiEvaluation(evaluations, batch_size=batch_size).evaluate(self.click_model,
+                                                                                   iter(self.test_sessions))
+            self._assert_results_equal(results, expected_results)
+
+    def test_multi_evaluation(self):
+        evaluations = [LogLikelihood(), Perplexity(), PerplexityCond()]
+        self.assertEqual(MultiEvaluation(evaluations).evaluate(self.click_model, self.test_sessions),
+                         [evaluation.evaluate(self.click_model, self.test_sessions) for evaluation in evaluations])
+
+    def test_log2_sums_at_rank(self):
+        rnd = random.Random(1)
+        click_prob_matrix = [[rnd.uniform(0.01, 1) for _ in range(4)] for _ in range(100)]
+        click_prob_matrix[3][2] = None
+
+        log2_sum_at_rank = [1.0]
+        _add_log2_sums_at_rank(click_prob_matrix, log2_sum_at_rank)
+
+        self.assertEqual(len(log2_sum_at_rank), 4)
+        for rank, log2_sum in enumerate(log2_sum_at_rank):
+            expected_log2_sum = 1.0 if rank == 0 else 0.0
+            for click_probs in click_prob_matrix:
+                if click_probs[rank] is not None:
+                    expected_log2_sum += math.log(click_probs[rank], 2)
+            self.assertAlmostEqual(log2_sum, expected_log2_sum, places=10)
+
+    def test_multi_evaluation_processes(self):
+        evaluations = [LogLikelihood(), Perplexity(), PerplexityCond()]
+        results = MultiEvaluation(evaluations, batch_size=30).evaluate(self.click_model, self.test_sessions)
+        parallel_results = MultiEvaluation(evaluations, batch_size=30, processes=2).evaluate(self.click_model,
+                                                                                             self.test_sessions)
+        self.assertEqual(parallel_results, results)
+
+    def test_bootstrap_resample(self):
+        evaluations = [LogLikelihood(), Perplexity(), PerplexityCond()]
+        estimates = BootstrapEvaluation(evaluations, resample_num=1, seed=3).evaluate(self.click_model,
+                                                                                    self.test_sessions)
+
+        # The same resample, drawn and evaluated directly
+        rnd = random.Random(3)
+        session_num = len(self.test_sessions)
+        resample = [self.test_sessions[int(rnd.random() * session_num)] for _ in range(session_num)]
+        resampled_results = MultiEvaluation(evaluations).evaluate(self.click_model, resample)
+
+        self._assert_results_equal([estimates[0].value, (estimates[1][0].value, [e.value for e in estimates[1][1]]),
+                                    (estimates[2][0].value, [e.value for e in estimates[2][1]])],
+                                   self._get_loop_results())
+        self._assert_results_equal([estimates[0].mean, (estimates[1][0].mean, [e.mean for e in estimates[1][1]]),
+                                    (estimates[2][0].mean, [e.mean for e in estimates[2][1]])],
+                                   resampled_results)
+        self.assertEqual(estimates[0].std_error, 0)
+        self.assertEqual(estimates[0].lower, estimates[0].upper)
+
+    def test_bootstrap_all_nan(self):
+        # None of the resamples contains a search session with a result at some rank
+        nan = float('nan')
+        estimate = BootstrapEvaluation([Perplexity()])._get_estimate((1.5, [1.5, 2.0]),
+                                                                      [(nan, [1.4, nan]), (nan, [1.6, nan])])
+        self.assertEqual(estimate[1][0].value, 1.5)
+        self.assertAlmostEqual(estimate[1][0].mean, 1.5)
+        self.assertEqual(estimate[1][1].value, 2.0)
+        for nan_estimate in (estimate[0], estimate[1][1]):
+            self.assertTrue(all(math.isnan(x) for x in nan_estimate[1:]))
+
+    def test_click_model_factories(self):
+        sketch_click_models = []
+
+        def create_sketch_click_model():
+            sketch_click_models.append(SketchDCTR(2 ** 12, 2))
+            return sketch_click_models[-1]
+
+        rmse = CTRPrediction().evaluate(DCTR(), self.test_sessions)
+        self.assertAlmostEqual(CTRPrediction(create_sketch_click_model).evaluate(DCTR(), self.test_sessions), rmse,
+                               places=3)
+        self.assertTrue(sketch_click_models)
+        self.assertTrue(all(len(click_model.params[click_model.param_names.ctr].clicks.get_counters()) == 2 ** 13
+                            for click_model in sketch_click_models))
+
+        results = CrossValidation({'UBM': UBM, 'UBM-1': lambda: UBM(EMInference(1))}, [LogLikelihood()],
+                                  fold_num=2, processes=2, seed=1).run(self.test_sessions)
+        self.assertEqual(sorted(results), ['UBM', 'UBM-1'])
+        self.assertNotEqual(results['UBM'].mean, results['UBM-1'].mean)
+
+
+class MetricAccumulatorTestCase(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        # SERPs deeper than ten results
+        generator = SessionGenerator(query_num=50, serp_depth=15, docs_per_query=20, seed=2)
+        cls.click_model = DCTR()
+        cls.click_model.train(generator.generate(500))
+        cls.click_model.freeze()
+
+        cls.test_sessions = generator.generate(200)
+        for search_session in cls.test_sessions[::4]:
+            del search_session.web_results[12:]
+
+    def _get_loop_perplexity_at_rank(self):
+        log2_sum_at_rank = [0.0] * 15
+        session_num_at_rank = [0] * 15
+        for search_session in self.test_sessions:
+            full_click_probs = self.click_model.get_full_click_probs(search_session)
+            for rank, result in enumerate(search_session.web_results):
+                p = full_click_probs[rank] if result.click else 1 - full_click_probs[rank]
+                log2_sum_at_rank[rank] += math.log(p, 2)
+                session_num_at_rank[rank] += 1
+        return [2 ** (-x / n) for x, n in zip(log2_sum_at_rank, session_num_at_rank)]
+
+    def test_deep_serps(self):
+        expected_perplexity_at_rank = self._get_loop_perplexity_at_rank()
+
+        # Search sessions are read from a generator
+        _, perplexity_at_rank = MultiEvaluation([Perplexity()], batch_size=30).evaluate(
+            self.click_model, (search_session for search_session in self.test_sessions))[0]
+        self.assertEqual(len(perplexity_at_rank), 15)
+        for x, expected_x in zip(perplexity_at_rank, expected_perplexity_at_rank):
+            self.assertAlmostEqual(x, expected_x, places=12)
+
+    def test_concatenate_accumulators(self):
+        evaluations = [LogLikelihood(), Perplexity(), PerplexityCond()]
+        expected_results = MultiEvaluation(evaluations).evaluate(self.click_model, self.test_sessions)
+
+        # Shards of different maximum depths
+        evaluation = MultiEvaluation(evaluations)
+        accumulators = evaluation.accumulate(self.click_model, self.test_sessions[::4])
+        other_sessions = [search_session for i, search_session in enumerate(self.test_sessions) if i % 4]
+        for accumulator, other in zip(accumulators, evaluation.accumulate(self.click_model, other_sessions)):
+            accumulator += other
+
+        loglikelihood, perplexity, perplexity_cond = [accumulator.get_result() for accumulator in accumulators]
+        expected_loglikelihood, expected_perplexity, expected_perplexity_cond = expected_results
+        self.assertAlmostEqual(loglikelihood, expected_loglikelihood, places=12)
+        for (value, value_at_rank), (expected_value, expected_value_at_rank) in \
+                [(perplexity, expected_perplexity), (perplexity_cond, expected_perplexity_cond)]:
+            self.assertAlmostEqual(value, expected_value, places=12)
+            self.assertEqual(len(value_at_rank), 15)
+            for x, expected_x in zip(value_at_rank, expected_value_at_rank):
+                self.assertAlmostEqual(x, expected_x, places=12)
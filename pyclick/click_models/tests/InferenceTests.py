@@ -0,0 +1,240 @@
+#
+# Copyright (C) 2015  Ilya Markov
+#
+# Full copyright notice can be found in LICENSE.
+#
+from __future__ import division
+import copy
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import unittest
+from multiprocessing import AuthenticationError
+
+from pyclick.click_models.DistributedInference import DistributedEMInference
+from pyclick.click_models.Inference import EMInference
+from pyclick.click_models.InferenceCallback import InferenceCallback, InferenceProfiler, ParamPruning, \
+    TrainingProgress
+from pyclick.click_models.ParamContainer import QueryDocumentParamContainer
+from pyclick.click_models.UBM import UBM
+from pyclick.utils.SessionGenerator import SessionGenerator
+
+
+__author__ = 'Ilya Markov'
+
+
+class Interruption(Exception):
+    pass
+
+
+class InterruptingCallback(InferenceCallback):
+    """Interrupts training at the end of the given iteration."""
+
+    def __init__(self, iteration):
+        self.iteration = iteration
+
+    def on_iteration_end(self, iteration, click_model):
+        if iteration == self.iteration:
+            raise Interruption()
+
+
+class SnapshotCallback(InferenceCallback):
+    """Keeps a copy of the click model at the end of each iteration."""
+
+    def __init__(self):
+        self.click_models = []
+
+    def on_iteration_end(self, iteration, click_model):
+        self.click_models.append(copy.deepcopy(click_model))
+
+
+class InferenceTestCase(unittest.TestCase):
+
+    def setUp(self):
+        generator = SessionGenerator(query_num=50, serp_depth=5, docs_per_query=8, seed=1)
+        self.train_sessions = generator.generate(300)
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    @staticmethod
+    def _get_values(click_model):
+        return dict((param_name, sorted(param.value() for param in container))
+                    for param_name, container in click_model.params.items())
+
+    def test_max_delta_by_key(self):
+        click_model = UBM(EMInference(3))
+        click_model.train(self.train_sessions)
+
+        # The same parameters stored in the reverse order, e.g., loaded from another source
+        reordered_click_model = UBM()
+        reordered_click_model.params = dict(click_model.params)
+        attr = click_model.params[click_model.param_names.attr]
+        reordered_attr = QueryDocumentParamContainer(attr._param_class, *attr._param_args)
+        for query, results in reversed(list(attr._items())):
+            for search_result, param in reversed(list(results.items())):
+                reordered_attr.set(param, query, search_result)
+        reordered_click_model.params[click_model.param_names.attr] = reordered_attr
+
+        self.assertEqual(EMInference.get_max_delta(click_model, reordered_click_model), 0)
+        self.assertEqual(EMInference.get_max_delta(reordered_click_model, click_model), 0)
+        self.assertEqual(sum(1 for _ in attr), sum(1 for _ in reordered_attr))
+
+        del reordered_attr._container[query]
+        self.assertIsNone(EMInference.get_max_delta(click_model, reordered_click_model))
+        self.assertIsNone(EMInference.get_max_delta(reordered_click_model, click_model))
+
+    def test_warm_start_converged(self):
+        click_model = UBM(EMInference(50, tolerance=1e-4))
+        iterations_done = click_model.train(self.train_sessions)
+        self.assertLess(iterations_done, 50)
+
+        # The initial model is compared with the first iteration by key, so a converged model stops at once
+        warm_click_model = UBM(EMInference(50, tolerance=1e-4))
+        self.assertEqual(warm_click_model.train(self.train_sessions, initial_model=click_model), 1)
+        self.assertEqual(UBM(EMInference(2)).train(self.train_sessions), 2)
+
+    def test_checkpoint_resume(self):
+        checkpoint_path = os.path.join(self.directory, 'checkpoint')
+        click_model = UBM(EMInference(6))
+        click_model.train(self.train_sessions)
+
+        inference = EMInference(6, checkpoint_path=checkpoint_path)
+        self.assertRaises(Interruption, UBM(inference).train, self.train_sessions, [InterruptingCallback(3)])
+        self.assertTrue(os.path.exists(checkpoint_path))
+
+        resumed_click_model = UBM(EMInference(6, checkpoint_path=checkpoint_path))
+        profiler = InferenceProfiler()
+        self.assertEqual(resumed_click_model.train(self.train_sessions, [profiler]), 6)
+        self.assertEqual(len(profiler.iterations), 3)
+        self.assertEqual(self._get_values(resumed_click_model), self._get_values(click_model))
+        self.assertFalse(os.path.exists(checkpoint_path))
+
+        # The inference keeps no parameters of the run
+        self.assertEqual(sorted(vars(inference)), ['checkpoint_interval', 'checkpoint_path', 'iter_num', 'tolerance'])
+
+    def test_checkpoint_mismatch(self):
+        checkpoint_path = os.path.join(self.directory, 'checkpoint')
+        self.assertRaises(Interruption, UBM(EMInference(6, checkpoint_path=checkpoint_path)).train,
+                          self.train_sessions, [InterruptingCallback(1)])
+
+        # The same number of search sessions, one of which is different
+        other_sessions = list(self.train_sessions)
+        other_sessions[-1] = SessionGenerator(query_num=50, serp_depth=5, docs_per_query=8, seed=2).generate(1)[0]
+        self.assertRaises(ValueError, UBM(EMInference(6, checkpoint_path=checkpoint_path)).train, other_sessions)
+        self.assertRaises(ValueError, UBM(EMInference(7, checkpoint_path=checkpoint_path)).train,
+                          self.train_sessions)
+        self.assertRaises(ValueError, UBM(EMInference(6, tolerance=1e-4, checkpoint_path=checkpoint_path)).train,
+                          self.train_sessions)
+        self.assertEqual(UBM(EMInference(6, checkpoint_path=checkpoint_path)).train(self.train_sessions), 6)
+
+    def test_profiler(self):
+        profiler = InferenceProfiler()
+        snapshots = SnapshotCallback()
+        click_model = UBM(EMInference(3))
+        click_model.train(self.train_sessions, [snapshots, profiler])
+
+        self.assertEqual(len(profiler.iterations), 3)
+        for iteration, snapshot in zip(profiler.iterations, snapshots.click_models):
+            self.assertEqual(sorted(iteration),
+                             ['param_num', 'session_params_time', 'sessions_per_sec', 'time', 'update_time'])
+            self.assertEqual(iteration['param_num'], sum(len(values) for values in self._get_values(snapshot).values()))
+            self.assertEqual(sorted(iteration['update_time']), ['UBMAttrEM', 'UBMExamEM'])
+            self.assertLessEqual(iteration['session_params_time'] + sum(iteration['update_time'].values()),
+                                 iteration['time'])
+            self.assertAlmostEqual(iteration['sessions_per_sec'], len(self.train_sessions) / iteration['time'])
+
+        summary = profiler.get_summary()
+        self.assertEqual(summary['iteration_num'], 3)
+        self.assertAlmostEqual(summary['time'], sum(iteration['time'] for iteration in profiler.iterations))
+
+    def test_training_progress(self):
+        reports = []
+        progress = TrainingProgress(session_interval=100, report=reports.append)
+        snapshots = SnapshotCallback()
+        click_model = UBM(EMInference(3))
+        click_model.train(self.train_sessions, [snapshots, progress])
+
+        keys = ['elapsed', 'eta', 'iter_num', 'iteration', 'rss', 'session_num']
+        self.assertEqual([(report['iteration'], report['session_num']) for report in reports],
+                         [(iteration, session_num) for iteration in range(3) for session_num in (100, 200, 300, 300)])
+        for report in reports:
+            done = (report['iteration'] * 300 + report['session_num']) / 900
+            self.assertAlmostEqual(report['eta'], report['elapsed'] * (1 - done) / done)
+            self.assertEqual(report['iter_num'], 3)
+            self.assertGreater(report['rss'], 0)
+        self.assertEqual(reports[-1]['eta'], 0)
+
+        self.assertEqual(progress.history, reports[3::4])
+        for iteration, report in enumerate(progress.history):
+            self.assertEqual(sorted(report), sorted(keys + ['loglikelihood', 'max_delta']))
+            self.assertLess(report['loglikelihood'], 0)
+            if iteration == 0:
+                # The set of parameters changes in the first iteration
+                self.assertIsNone(report['max_delta'])
+            else:
+                self.assertAlmostEqual(report['max_delta'], EMInference.get_max_delta(
+                    snapshots.click_models[iteration - 1], snapshots.click_models[iteration]))
+        for report in reports[:3]:
+            self.assertEqual(sorted(report), keys)
+
+    def test_training_progress_read_only(self):
+        # The log-likelihood does not add parameters removed by ParamPruning back to the model
+        click_model = UBM(EMInference(3))
+        click_model.train(self.train_sessions, [ParamPruning(min_observation_num=5)])
+        progress_click_model = UBM(EMInference(3))
+        progress_click_model.train(self.train_sessions, [ParamPruning(min_observation_num=5),
+                                                         TrainingProgress(report=lambda report: None)])
+        self.assertEqual(self._get_values(progress_click_model), self._get_values(click_model))
+
+    def test_distributed(self):
+        # A free port on localhost
+        listening_socket = socket.socket()
+        listening_socket.bind(('localhost', 0))
+        address = listening_socket.getsockname()
+        listening_socket.close()
+
+        shards = [self.train_sessions[:120], self.train_sessions[120:240]]
+        workers = [threading.Thread(target=DistributedEMInference(address, b'secret').run_worker,
+                                    args=(UBM(), shard)) for shard in shards]
+
+        def start_workers():
+            # Connections with a wrong key and those closed before reporting the shard are dropped
+            self.assertRaises(AuthenticationError, DistributedEMInference(address, b'wrong')._connect)
+            DistributedEMInference(address, b'secret')._connect().close()
+            for worker in workers:
+                worker.daemon = True
+                worker.start()
+
+        launcher = threading.Thread(target=start_workers)
+        launcher.daemon = True
+        launcher.start()
+
+        # The coordinator holds the last shard, which is profiled
+        reports = []
+        profiler = InferenceProfiler()
+        inference = DistributedEMInference(address, b'secret', worker_num=2, iter_num=5)
+        click_model = UBM(inference)
+        self.assertEqual(click_model.train(self.train_sessions[240:],
+                                           [TrainingProgress(report=reports.append), profiler]), 5)
+        for worker in [launcher] + workers:
+            worker.join(10)
+            self.assertFalse(worker.is_alive())
+
+        self.assertEqual(inference.session_num, len(self.train_sessions))
+        self.assertEqual([report['iteration'] for report in reports], list(range(5)))
+        self.assertTrue(all(report['session_num'] == len(self.train_sessions) for report in reports))
+        self.assertEqual(len(profiler.iterations), 5)
+        self.assertTrue(all(sorted(iteration['update_time']) == ['UBMAttrEM', 'UBMExamEM']
+                            for iteration in profiler.iterations))
+
+        expected_click_model = UBM(EMInference(5))
+        expected_click_model.train(self.train_sessions)
+        for param_name, values in self._get_values(click_model).items():
+            expected_values = self._get_values(expected_click_model)[param_name]
+            self.assertEqual(len(values), len(expected_values))
+            for value, expected_value in zip(values, expected_values):
+                self.assertAlmostEqual(value, expected_value, places=10)
@@ -0,0 +1,69 @@
+#
+# Copyright (C) 2015  Ilya Markov
+#
+# Full copyright notice can be found in LICENSE.
+#
+import unittest
+
+from pyclick.click_models.CTR import DCTR
+from pyclick.click_models.Evaluation import LogLikelihood, Perplexity
+from pyclick.click_models.Inference import EMInference
+from pyclick.click_models.ModelComparison import ModelComparison
+from pyclick.click_models.SDBN import SDBN
+from pyclick.click_models.UBM import UBM
+from pyclick.utils.SessionGenerator import SessionGenerator
+
+
+__author__ = 'Ilya Markov'
+
+
+class ModelComparisonTestCase(unittest.TestCase):
+
+    def setUp(self):
+        generator = SessionGenerator(query_num=50, serp_depth=5, docs_per_query=8, seed=1)
+        self.train_sessions = generator.generate(300)
+        self.test_sessions = generator.generate(100)
+        # A test query that does not occur in the train set
+        self.test_sessions[0].query = 'unseen'
+
+        train_queries = set(search_session.query for search_session in self.train_sessions)
+        self.seen_test_sessions = [search_session for search_session in self.test_sessions
+                                   if search_session.query in train_queries]
+
+    def test_prepare(self):
+        train_sessions, test_sessions = ModelComparison([DCTR], [LogLikelihood()]).prepare(self.train_sessions,
+                                                                                           self.test_sessions)
+        self.assertEqual(len(train_sessions), len(self.train_sessions))
+        self.assertEqual([search_session.web_results for search_session in test_sessions],
+                         [search_session.web_results for search_session in self.seen_test_sessions])
+
+        # The prepared sessions share the results of the given ones and keep their clicks
+        for search_session, prepared_session in zip(self.train_sessions, train_sessions):
+            self.assertIs(prepared_session.query, search_session.query)
+            self.assertIs(prepared_session.web_results, search_session.web_results)
+            self.assertEqual(prepared_session.get_clicks(), search_session.get_clicks())
+            self.assertEqual(prepared_session.get_last_click_rank(), search_session.get_last_click_rank())
+
+    def test_run(self):
+        evaluations = [LogLikelihood(), Perplexity()]
+        comparison = ModelComparison({'SDBN': SDBN, 'UBM-2': lambda: UBM(EMInference(2))}, evaluations, processes=2)
+        reports = comparison.run(self.train_sessions, self.test_sessions)
+        self.assertEqual(sorted(reports), ['SDBN', 'UBM-2'])
+
+        for name, click_model in [('SDBN', SDBN()), ('UBM-2', UBM(EMInference(2)))]:
+            report = reports[name]
+            self.assertGreater(report.train_time, 0)
+            self.assertGreater(report.eval_time, 0)
+            self.assertGreaterEqual(report.memory, 0)
+
+            # The same values as training and evaluating the model directly
+            click_model.train(self.train_sessions)
+            click_model.freeze()
+            test_sessions = self.seen_test_sessions
+            loglikelihood, (perplexity, perplexity_at_rank) = report.values
+            self.assertAlmostEqual(loglikelihood, evaluations[0].evaluate(click_model, test_sessions), places=12)
+            expected_perplexity, expected_perplexity_at_rank = evaluations[1].evaluate(click_model, test_sessions)
+            self.assertAlmostEqual(perplexity, expected_perplexity, places=12)
+            self.assertEqual(len(perplexity_at_rank), 5)
+            for x, expected_x in zip(perplexity_at_rank, expected_perplexity_at_rank):
+                self.assertAlmostEqual(x, expected_x, places=12)
@@ -0,0 +1,120 @@
+#
+# Copyright (C) 2015  Ilya Markov
+#
+# Full copyright notice can be found in LICENSE.
+#
+import io
+import unittest
+
+from pyclick.click_models.CTR import CTRParamMLE
+from pyclick.click_models.ParamContainer import QueryDocumentParamContainer, RankParamContainer, \
+    RankPrevClickParamContainer
+from pyclick.search_session.SearchResult import SearchResult
+from pyclick.search_session.SearchSession import SearchSession
+
+
+__author__ = 'Ilya Markov'
+
+
+class ParamContainerTestCase(unittest.TestCase):
+
+    @staticmethod
+    def _get_session(query, clicks):
+        session = SearchSession(query)
+        for rank, click in enumerate(clicks):
+            session.web_results.append(SearchResult('doc%d' % rank, click))
+        return session
+
+    def test_frozen_query_document_lookup(self):
+        container = QueryDocumentParamContainer(CTRParamMLE)
+        container.get('query', 'doc0').update(self._get_session('query', [1]), 0)
+        container.freeze()
+
+        self.assertTrue(container.is_frozen())
+        self.assertAlmostEqual(container.get('query', 'doc0').value(), 2 / 3.0)
+        self.assertAlmostEqual(container.get('query', 'unseen').value(), 0.5)
+        self.assertAlmostEqual(container.get('unseen', 'doc0').value(), 0.5)
+        self.assertEqual(sum(1 for _ in container), 1)
+
+    def test_unfrozen_query_document_lookup(self):
+        container = QueryDocumentParamContainer(CTRParamMLE)
+        container.freeze()
+        container.unfreeze()
+
+        self.assertFalse(container.is_frozen())
+        container.get('query', 'doc0')
+        self.assertEqual(sum(1 for _ in container), 1)
+
+    def test_frozen_rank_lookup(self):
+        container = RankParamContainer(CTRParamMLE, 2)
+        container.freeze()
+        self.assertAlmostEqual(container.get(5).value(), 0.5)
+
+        container = RankPrevClickParamContainer(CTRParamMLE, 2)
+        container.freeze()
+        self.assertAlmostEqual(container.get(1, 5).value(), 0.5)
+
+    def test_compile(self):
+        container = QueryDocumentParamContainer(CTRParamMLE)
+        container.get('query', 'doc0').update(self._get_session('query', [1]), 0)
+        compiled = container.compile()
+
+        self.assertTrue(compiled.is_compiled())
+        self.assertTrue(compiled.is_frozen())
+        self.assertFalse(container.is_compiled())
+        self.assertAlmostEqual(compiled.get('query', 'doc0').value(), container.get('query', 'doc0').value())
+        self.assertAlmostEqual(compiled.get('query', 'unseen').value(), 0.5)
+        self.assertRaises(RuntimeError, compiled.unfreeze)
+
+    def test_to_from_binary(self):
+        container = QueryDocumentParamContainer(CTRParamMLE)
+        container.get('query', 'doc0').update(self._get_session('query', [1]), 0)
+        container.get(1, 2).update(self._get_session(1, [0]), 0)
+        container.get(u'\u0437\u0430\u043f\u0440\u043e\u0441', 'doc0')
+
+        stream = io.BytesIO()
+        container.to_binary(stream)
+        stream.seek(0)
+        container_decoded = QueryDocumentParamContainer(CTRParamMLE)
+        container_decoded.from_binary(stream)
+
+        container_decoded.freeze()
+        self.assertListEqual(sorted(param.value() for param in container_decoded),
+                             sorted(param.value() for param in container))
+        self.assertAlmostEqual(container_decoded.get(1, 2).value(), 1 / 3.0)
+
+    def test_to_from_binary_non_ascii_results(self):
+        container = QueryDocumentParamContainer(CTRParamMLE)
+        results = [u'\u0434\u043e\u043a', 'doc', u'\u6587\u66f8', u'doc\u00e9']
+        for rank, result in enumerate(results):
+            for _ in range(rank + 1):
+                container.get('query', result).update(self._get_session('query', [1]), 0)
+
+        stream = io.BytesIO()
+        container.to_binary(stream)
+        stream.seek(0)
+        container_decoded = QueryDocumentParamContainer(CTRParamMLE)
+        container_decoded.from_binary(stream)
+
+        container_decoded.freeze()
+        for result in results:
+            self.assertAlmostEqual(container_decoded.get('query', result).value(),
+                                   container.get('query', result).value())
+
+    def test_prune(self):
+        container = QueryDocumentParamContainer(CTRParamMLE)
+        for _ in range(3):
+            container.get('query', 'doc0').update(self._get_session('query', [1]), 0)
+        container.get('query', 'doc1').update(self._get_session('query', [0, 1]), 1)
+        container.get('rare', 'doc0').update(self._get_session('rare', [1]), 0)
+        container.get('unseen', 'doc0')
+
+        self.assertEqual(container.prune(min_observation_num=2), 3)
+        self.assertEqual(sum(1 for _ in container), 1)
+        self.assertEqual(sorted(container._container), ['query'])
+
+        container.freeze()
+        self.assertAlmostEqual(container.get('query', 'doc0').value(), 0.8)
+        self.assertAlmostEqual(container.get('rare', 'doc0').value(), 0.5)
+        self.assertEqual(container.prune(epsilon=0.3), 0)
+        self.assertEqual(container.prune(epsilon=0.5), 1)
@@ -0,0 +1,6 @@
+#
+# Copyright (C) 2015  Ilya Markov
+#
+# Full copyright notice can be found in LICENSE.
+#
+__author__ = 'Ilya Markov'
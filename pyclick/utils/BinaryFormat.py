@@ -0,0 +1,252 @@
+#
+# Copyright (C) 2015  Ilya Markov
+#
+# Full copyright notice can be found in LICENSE.
+#
+import numbers
+import struct
+
+__author__ = 'Ilya Markov'
+
+
+class BinaryFormat:
+    """
+    Low-level helpers for the binary format of click models (see ClickModel.to_binary).
+
+    All numbers are stored in the little-endian byte order.
+    Keys (queries and search results) are stored with a type tag,
+    so that both string and integer identifiers survive the round trip.
+    Large collections of records are written in chunks,
+    each prefixed with the number of records and the number of bytes in the chunk.
+    This way, a chunk can be read with a single call and decoded from memory,
+    while neither the writer nor the reader need to hold the whole collection in a buffer.
+    """
+
+    MAGIC = b'PYCLICK'
+    """The signature at the beginning of each binary model."""
+
+    VERSION = 1
+    """The version of the binary format."""
+
+    CHUNK_SIZE = 4096
+    """The maximum number of records in a chunk."""
+
+    _UINT8 = struct.Struct('<B')
+    _UINT32 = struct.Struct('<I')
+    _INT64 = struct.Struct('<q')
+    _CHUNK_HEADER = struct.Struct('<II')
+
+    _KEY_STR = b's'
+    _KEY_INT = b'i'
+    _KEY_MIXED = b'm'
+
+    @staticmethod
+    def write_uint8(stream, value):
+        stream.write(BinaryFormat._UINT8.pack(value))
+
+    @staticmethod
+    def read_uint8(stream):
+        return BinaryFormat._UINT8.unpack(BinaryFormat.read_exactly(stream, BinaryFormat._UINT8.size))[0]
+
+    @staticmethod
+    def write_uint32(stream, value):
+        stream.write(BinaryFormat._UINT32.pack(value))
+
+    @staticmethod
+    def read_uint32(stream):
+        return BinaryFormat._UINT32.unpack(BinaryFormat.read_exactly(stream, BinaryFormat._UINT32.size))[0]
+
+    @staticmethod
+    def write_string(stream, value):
+        data = value.encode('utf-8')
+        stream.write(BinaryFormat._UINT32.pack(len(data)))
+        stream.write(data)
+
+    @staticmethod
+    def read_string(stream):
+        length = BinaryFormat.read_uint32(stream)
+        return BinaryFormat.read_exactly(stream, length).decode('utf-8')
+
+    @staticmethod
+    def read_exactly(stream, size):
+        """
+        Reads exactly the given number of bytes from the given stream.
+
+        :param stream: The binary stream.
+        :param size: The number of bytes to read.
+        :returns: The bytes read from the stream.
+        """
+        data = stream.read(size)
+        if len(data) != size:
+            raise ValueError("Unexpected end of a binary click model")
+        return data
+
+    @staticmethod
+    def pack_uint32(buf, value):
+        buf += BinaryFormat._UINT32.pack(value)
+
+    @staticmethod
+    def unpack_uint32(buf, offset):
+        return BinaryFormat._UINT32.unpack_from(buf, offset)[0], offset + BinaryFormat._UINT32.size
+
+    @staticmethod
+    def pack_key(buf, key):
+        """
+        Appends the given key (a string or an integer) to the given bytearray.
+
+        :param buf: The bytearray to append to.
+        :param key: The key.
+        """
+        if BinaryFormat.is_int_key(key):
+            buf += BinaryFormat._KEY_INT
+            buf += BinaryFormat._INT64.pack(key)
+        else:
+            data = BinaryFormat.encode_key(key)
+            buf += BinaryFormat._KEY_STR
+            buf += BinaryFormat._UINT32.pack(len(data))
+            buf += data
+
+    @staticmethod
+    def is_int_key(key):
+        """Checks whether the given key is stored as an integer (bool keys are not)."""
+        return isinstance(key, numbers.Integral) and not isinstance(key, bool)
+
+    @staticmethod
+    def encode_key(key):
+        """
+        Returns the UTF-8 bytes of the given string key.
+        Byte strings (str in Python 2) are assumed to be in UTF-8 already and are returned as they are.
+
+        :param key: The string key.
+        :returns: The bytes of the key.
+        """
+        return key if isinstance(key, bytes) else key.encode('utf-8')
+
+    @staticmethod
+    def unpack_key(buf, offset):
+        """
+        Decodes a key from the given buffer at the given offset.
+
+        :param buf: The buffer.
+        :param offset: The offset of the key in the buffer.
+        :returns: The key and the offset right after the key.
+        """
+        tag = buf[offset:offset + 1]
+        offset += 1
+
+        if tag == BinaryFormat._KEY_INT:
+            return BinaryFormat._INT64.unpack_from(buf, offset)[0], offset + BinaryFormat._INT64.size
+
+        length = BinaryFormat._UINT32.unpack_from(buf, offset)[0]
+        offset += BinaryFormat._UINT32.size
+        return bytes(buf[offset:offset + length]).decode('utf-8'), offset + length
+
+    @staticmethod
+    def pack_keys(buf, keys):
+        """
+        Appends the given list of keys to the given bytearray.
+        Keys of the same type are packed in bulk, so that they can be decoded with a few calls.
+
+        :param buf: The bytearray to append to.
+        :param keys: The list of keys.
+        """
+        if all(BinaryFormat.is_int_key(key) for key in keys):
+            buf += BinaryFormat._KEY_INT
+            buf += struct.pack('<%dq' % len(keys), *keys)
+        elif not any(BinaryFormat.is_int_key(key) for key in keys):
+            encoded_keys = [BinaryFormat.encode_key(key) for key in keys]
+            buf += BinaryFormat._KEY_STR
+            buf += struct.pack('<%dI' % len(keys), *[len(data) for data in encoded_keys])
+            data = b''.join(encoded_keys)
+            buf += BinaryFormat._UINT32.pack(len(data))
+            buf += data
+        else:
+            buf += BinaryFormat._KEY_MIXED
+            for key in keys:
+                BinaryFormat.pack_key(buf, key)
+
+    @staticmethod
+    def unpack_keys(buf, offset, key_num):
+        """
+        Decodes a list of keys packed by pack_keys.
+
+        :param buf: The buffer.
+        :param offset: The offset of the keys in the buffer.
+        :param key_num: The number of keys.
+        :returns: The list of keys and the offset right after the keys.
+        """
+        tag = buf[offset:offset + 1]
+        offset += 1
+
+        if tag == BinaryFormat._KEY_INT:
+            keys = list(struct.unpack_from('<%dq' % key_num, buf, offset))
+            return keys, offset + 8 * key_num
+
+        if tag == BinaryFormat._KEY_STR:
+            lengths = struct.unpack_from('<%dI' % key_num, buf, offset)
+            offset += 4 * key_num
+            size = BinaryFormat._UINT32.unpack_from(buf, offset)[0]
+            offset += BinaryFormat._UINT32.size
+            data = bytes(buf[offset:offset + size])
+
+            keys = []
+            start = 0
+            for length in lengths:
+                keys.append(data[start:start + length].decode('utf-8'))
+                start += length
+            return keys, offset + size
+
+        keys = []
+        for _ in range(key_num):
+            key, offset = BinaryFormat.unpack_key(buf, offset)
+            keys.append(key)
+        return keys, offset
+
+    @staticmethod
+    def write_chunks(stream, records, pack_record):
+        """
+        Writes the given records in chunks, followed by an empty chunk that marks the end of the records.
+
+        :param stream: The binary stream.
+        :param records: The iterable of records.
+        :param pack_record: The function that appends a given record to a given bytearray.
+        """
+        buf = bytearray()
+        count = 0
+
+        for record in records:
+            pack_record(buf, record)
+            count += 1
+
+            if count == BinaryFormat.CHUNK_SIZE:
+                stream.write(BinaryFormat._CHUNK_HEADER.pack(count, len(buf)))
+                stream.write(buf)
+                buf = bytearray()
+                count = 0
+
+        if count:
+            stream.write(BinaryFormat._CHUNK_HEADER.pack(count, len(buf)))
+            stream.write(buf)
+        stream.write(BinaryFormat._CHUNK_HEADER.pack(0, 0))
+
+    @staticmethod
+    def read_chunks(stream, unpack_record):
+        """
+        Reads records written by write_chunks.
+
+        :param stream: The binary stream.
+        :param unpack_record: The function that decodes a record from a given buffer at a given offset
+            and returns the record and the offset right after it.
+        :returns: The generator of records.
+        """
+        while True:
+            count, size = BinaryFormat._CHUNK_HEADER.unpack(
+                BinaryFormat.read_exactly(stream, BinaryFormat._CHUNK_HEADER.size))
+            if not count:
+                return
+
+            buf = BinaryFormat.read_exactly(stream, size)
+            offset = 0
+            for _ in range(count):
+                record, offset = unpack_record(buf, offset)
+                yield record
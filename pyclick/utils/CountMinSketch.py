@@ -0,0 +1,177 @@
+#
+# Copyright (C) 2015  Ilya Markov
+#
+# Full copyright notice can be found in LICENSE.
+#
+from __future__ import division
+from array import array
+import math
+import random
+import struct
+
+try:
+    from hashlib import blake2b
+
+    def _get_digest(key):
+        return blake2b(key, digest_size=8).digest()
+except ImportError:
+    from hashlib import md5
+
+    def _get_digest(key):
+        return md5(key).digest()[:8]
+
+__author__ = 'Ilya Markov'
+
+
+class CountMinSketch(object):
+    """
+    A count-min sketch: an approximate counter of keys in a fixed amount of memory
+    (Cormode and Muthukrishnan, An improved data stream summary: the count-min sketch and its applications, 2005).
+
+    The sketch is a table of depth rows and width columns.
+    Each row has its own hash function that maps a key to a column:
+    a key is first hashed into 61 bits (using BLAKE2b or, in Python 2, MD5),
+    then each row applies its own function from a universal family to the hash.
+    adding a key increments its counter in each row and the estimate of a key is the minimum of its counters.
+    Counters are updated conservatively, i.e., only the counters that are smaller than the new estimate are increased,
+    which never makes the estimates worse than the standard update.
+
+    Error bounds: let N be the total of all added counts. For any key, the estimate is never less than the true count,
+    and with probability at least 1 - exp(-depth) it exceeds the true count by at most e / width * N
+    (see from_error for choosing the width and depth given the error and its probability).
+    The sketch uses 8 * width * depth bytes.
+    """
+
+    _PRIME = 2 ** 61 - 1
+    """The Mersenne prime used by the hash functions of rows."""
+
+    def __init__(self, width, depth, seed=0):
+        """
+        Initializes an empty sketch.
+
+        :param width: The number of counters in a row.
+        :param depth: The number of rows.
+        :param seed: The seed of the hash functions, an integer in [0, 2^32) (it is stored as a 32-bit number).
+            Only sketches with the same seed and size can be merged.
+        """
+        if not 0 <= seed < 2 ** 32:
+            raise ValueError("The seed of a count-min sketch must be in [0, 2^32), got %d" % seed)
+
+        self.width = width
+        self.depth = depth
+        self.seed = seed
+        self.total = 0
+        """The total of all added counts."""
+
+        rand = random.Random(seed)
+        self._hash_params = [(rand.randint(1, self._PRIME - 1), rand.randint(0, self._PRIME - 1))
+                             for _ in range(depth)]
+        self._counters = array('d', [0]) * (width * depth)
+
+    @classmethod
+    def from_error(cls, epsilon, delta, seed=0):
+        """
+        Creates a sketch whose estimates exceed the true counts by at most epsilon * N with probability 1 - delta,
+        where N is the total of all added counts.
+
+        :param epsilon: The maximum error relative to the total count.
+        :param delta: The probability of exceeding the maximum error.
+        :param seed: The seed of the hash functions.
+        :returns: The sketch.
+        """
+        return cls(int(math.ceil(math.e / epsilon)), int(math.ceil(math.log(1 / delta))), seed)
+
+    def get_error(self):
+        """
+        Returns the maximum error of estimates, which holds with probability 1 - exp(-depth).
+
+        :returns: The maximum difference between an estimate and the true count.
+        """
+        return math.e / self.width * self.total
+
+    def get_indices(self, key):
+        """
+        Returns the positions of the counters of the given key, one in each row.
+
+        :param key: The key (bytes).
+        :returns: The list of positions of counters.
+        """
+        key_hash = struct.unpack('<Q', _get_digest(key))[0] % self._PRIME
+        return [(a * key_hash + b) % self._PRIME % self.width + row * self.width
+                for row, (a, b) in enumerate(self._hash_params)]
+
+    def add(self, key, count=1):
+        """
+        Adds the given count to the given key.
+
+        :param key: The key (bytes).
+        :param count: The non-negative count to add.
+        """
+        self.add_at(self.get_indices(key), count)
+
+    def add_at(self, indices, count=1):
+        """
+        Adds the given count to the key with the given positions of counters (see get_indices).
+
+        :param indices: The positions of counters of the key.
+        :param count: The non-negative count to add.
+        """
+        if not count:
+            return
+
+        counters = self._counters
+        estimate = min(counters[index] for index in indices) + count
+        for index in indices:
+            if counters[index] < estimate:
+                counters[index] = estimate
+        self.total += count
+
+    def estimate(self, key):
+        """
+        Returns the estimated count of the given key.
+
+        :param key: The key (bytes).
+        :returns: The estimated count, which is never less than the true count.
+        """
+        return self.estimate_at(self.get_indices(key))
+
+    def estimate_at(self, indices):
+        """
+        Returns the estimated count of the key with the given positions of counters (see get_indices).
+
+        :param indices: The positions of counters of the key.
+        :returns: The estimated count.
+        """
+        counters = self._counters
+        return min(counters[index] for index in indices)
+
+    def __iadd__(self, other):
+        """
+        Merges the other sketch into the current one, as if all keys of the other sketch were added to this one
+        (the error bounds of the merged sketch hold with the total count of both sketches,
+        but the conservative update of the merged counters is not repeated).
+
+        :param other: The sketch with the same width, depth and seed.
+        :returns: The merged sketch.
+        """
+        assert (self.width, self.depth, self.seed) == (other.width, other.depth, other.seed)
+
+        for index, counter in enumerate(other._counters):
+            self._counters[index] += counter
+        self.total += other.total
+        return self
+
+    def get_counters(self):
+        """Returns the array of counters (row by row), e.g., for serialization."""
+        return self._counters
+
+    def set_counters(self, counters, total):
+        """
+        Restores the sketch from the given counters and total count (see get_counters).
+
+        :param counters: The array of width * depth counters.
+        :param total: The total of all added counts.
+        """
+        assert len(counters) == self.width * self.depth
+        self._counters = array('d', counters)
+        self.total = total
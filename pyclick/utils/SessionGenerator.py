@@ -0,0 +1,94 @@
+#
+# Copyright (C) 2015  Ilya Markov
+#
+# Full copyright notice can be found in LICENSE.
+#
+from __future__ import division
+import bisect
+import random
+
+from pyclick.click_models.task_centric.TaskCentricSearchSession import TaskCentricSearchSession
+from pyclick.search_session.SearchResult import SearchResult
+
+__author__ = 'Ilya Markov'
+
+
+class SessionGenerator(object):
+    """
+    A generator of synthetic search sessions for testing and benchmarking click models.
+
+    Query frequencies follow the Zipf's law: the i-th most frequent query is issued with the probability
+    proportional to 1 / i^zipf_exponent.
+    Each query has a pool of candidate documents with random attractiveness,
+    and each SERP shows a random sample of these documents.
+    A document is clicked with the probability proportional to its attractiveness
+    and to the examination probability 1 / (rank + 1),
+    scaled so that the expected fraction of clicked results is close to click_rate.
+    Consecutive search sessions are grouped into search tasks (see TaskCentricSearchSession).
+    """
+
+    RELEVANCE_GRADES = 4
+    """The number of relevance grades of documents."""
+
+    def __init__(self, query_num=1000, zipf_exponent=1.0, serp_depth=10, click_rate=0.2, docs_per_query=20,
+                 sessions_per_task=1, seed=None):
+        """
+        Initializes the generator.
+
+        :param query_num: The number of distinct queries.
+        :param zipf_exponent: The exponent of the Zipf's distribution of query frequencies.
+        :param serp_depth: The number of results on a SERP.
+        :param click_rate: The expected fraction of clicked results.
+        :param docs_per_query: The number of candidate documents of a query (at least serp_depth).
+        :param sessions_per_task: The number of consecutive search sessions in a search task.
+        :param seed: The seed of the random generator.
+        """
+        self.query_num = query_num
+        self.serp_depth = serp_depth
+        self.docs_per_query = max(docs_per_query, serp_depth)
+        self.sessions_per_task = sessions_per_task
+        self._random = random.Random(seed)
+
+        self._query_cdf = []
+        total = 0.0
+        for i in range(query_num):
+            total += 1 / (i + 1) ** zipf_exponent
+            self._query_cdf.append(total)
+
+        self.relevances = {}
+        """
+        The graded relevance labels of candidate documents (from 0 to RELEVANCE_GRADES - 1,
+        derived from their attractiveness): relevances[query][document] -> relevance.
+        """
+        self._attractiveness = {}
+        self._doc_lists = {}
+        self._exam = [1 / (rank + 1) for rank in range(serp_depth)]
+        self._click_scale = click_rate / (0.5 * sum(self._exam) / serp_depth)
+        self._session_num = 0
+
+    def generate(self, session_num):
+        """
+        Generates the given number of search sessions.
+
+        :param session_num: The number of search sessions.
+        :returns: The list of search sessions (TaskCentricSearchSession objects).
+        """
+        return [self._generate_session() for _ in range(session_num)]
+
+    def _generate_session(self):
+        query = 'q%d' % bisect.bisect_left(self._query_cdf, self._random.random() * self._query_cdf[-1])
+        docs = self._attractiveness.get(query)
+        if docs is None:
+            docs = dict(('%s-d%d' % (query, doc), self._random.random()) for doc in range(self.docs_per_query))
+            self._attractiveness[query] = docs
+            self._doc_lists[query] = sorted(docs)
+            self.relevances[query] = dict((doc, int(attr * self.RELEVANCE_GRADES)) for doc, attr in docs.items())
+
+        session = TaskCentricSearchSession('t%d' % (self._session_num // self.sessions_per_task), query)
+        self._session_num += 1
+
+        for rank, doc in enumerate(self._random.sample(self._doc_lists[query], self.serp_depth)):
+            click_prob = min(1.0, self._click_scale * docs[doc] * self._exam[rank])
+            session.web_results.append(SearchResult(doc, int(self._random.random() < click_prob)))
+
+        return session
@@ -0,0 +1,175 @@
+#
+# Copyright (C) 2015  Ilya Markov
+#
+# Full copyright notice can be found in LICENSE.
+#
+from __future__ import division
+import math
+
+__author__ = 'Ilya Markov'
+
+
+class Statistics:
+    """
+    Statistical methods used for evaluating click models
+    (implemented here so that evaluation does not depend on scikit-learn or SciPy).
+    """
+
+    BETA_MAX_ITERATIONS = 200
+    """The maximum number of iterations of the continued fraction in regularized_beta."""
+
+    BETA_EPSILON = 1e-15
+    """The relative precision of the continued fraction in regularized_beta."""
+
+    @staticmethod
+    def auc(labels, scores):
+        """
+        Computes the area under the ROC curve (AUC) of the given scores
+        in O(n log n) time using the rank-sum (Mann-Whitney) statistic.
+        Tied scores get the average of their ranks, i.e., a tied positive-negative pair counts as one half.
+
+        :param labels: The list of labels. A label is positive if it is greater than zero
+            (e.g., a graded relevance label of a relevant document) and negative otherwise.
+        :param scores: The list of predicted scores, where scores[i] corresponds to labels[i].
+        :returns: The AUC.
+        """
+        order = sorted(range(len(scores)), key=scores.__getitem__)
+        positive_num = 0
+        positive_rank_sum = 0.0
+
+        start = 0
+        while start < len(order):
+            end = start + 1
+            while end < len(order) and scores[order[end]] == scores[order[start]]:
+                end += 1
+
+            # Ranks start + 1, ..., end are tied, so each of them gets their average
+            average_rank = (start + end + 1) / 2
+            for i in order[start:end]:
+                if labels[i] > 0:
+                    positive_num += 1
+                    positive_rank_sum += average_rank
+            start = end
+
+        negative_num = len(order) - positive_num
+        if not positive_num or not negative_num:
+            raise ValueError("AUC is not defined when only one class is present in labels")
+
+        return (positive_rank_sum - positive_num * (positive_num + 1) / 2) / (positive_num * negative_num)
+
+    @staticmethod
+    def percentile(values, q):
+        """
+        Returns the given percentile of the given sorted values,
+        linearly interpolating between the closest ranks.
+
+        :param values: The sorted list of values.
+        :param q: The percentile as a fraction in [0, 1].
+        :returns: The percentile.
+        """
+        position = q * (len(values) - 1)
+        lower = int(math.floor(position))
+        upper = min(lower + 1, len(values) - 1)
+        return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+    @staticmethod
+    def pearson(pairs):
+        """
+        Computes the Pearson correlation coefficient in a single pass over the given pairs of values,
+        without keeping them in memory.
+        Means and co-moments are updated incrementally (Welford's method), which is numerically stable.
+
+        :param pairs: The iterable of pairs of values (x, y).
+        :returns: The Pearson correlation coefficient and the two-sided p-value
+            of the null hypothesis that the correlation is zero.
+        """
+        n = 0
+        mean_x = mean_y = 0.0
+        m2_x = m2_y = c_xy = 0.0
+
+        for x, y in pairs:
+            n += 1
+            dx = x - mean_x
+            mean_x += dx / n
+            dy = y - mean_y
+            mean_y += dy / n
+            m2_x += dx * (x - mean_x)
+            m2_y += dy * (y - mean_y)
+            c_xy += dx * (y - mean_y)
+
+        if n < 2:
+            raise ValueError("Pearson correlation needs at least two pairs of values")
+        if not m2_x or not m2_y:
+            return float('nan'), float('nan')
+
+        cor = max(-1.0, min(1.0, c_xy / math.sqrt(m2_x * m2_y)))
+        return cor, Statistics.pearson_p_value(cor, n)
+
+    @staticmethod
+    def pearson_p_value(cor, n):
+        """
+        Returns the two-sided p-value of the given Pearson correlation coefficient
+        under the null hypothesis of no correlation.
+        The statistic t = cor * sqrt((n - 2) / (1 - cor^2)) follows the Student's t-distribution
+        with n - 2 degrees of freedom.
+
+        :param cor: The Pearson correlation coefficient.
+        :param n: The number of pairs of values.
+        :returns: The p-value.
+        """
+        df = n - 2
+        if df <= 0:
+            return 1.0
+        if abs(cor) >= 1.0:
+            return 0.0
+
+        # P(|T| >= |t|) = I_x(df / 2, 1 / 2), where x = df / (df + t^2) = 1 - cor^2
+        return Statistics.regularized_beta(df / 2, 0.5, 1 - cor ** 2)
+
+    @staticmethod
+    def regularized_beta(a, b, x):
+        """
+        Returns the regularized incomplete beta function I_x(a, b),
+        evaluated using the continued fraction representation (modified Lentz's method).
+
+        :param a: The first shape parameter (positive).
+        :param b: The second shape parameter (positive).
+        :param x: The point in [0, 1].
+        :returns: The value of I_x(a, b).
+        """
+        if x <= 0:
+            return 0.0
+        if x >= 1:
+            return 1.0
+
+        log_front = math.lgamma(a + b) - math.lgamma(a) - math.lgamma(b) + a * math.log(x) + b * math.log(1 - x)
+
+        # The continued fraction converges quickly for x < (a + 1) / (a + b + 2),
+        # otherwise the symmetry I_x(a, b) = 1 - I_{1-x}(b, a) is used
+        if x < (a + 1) / (a + b + 2):
+            return math.exp(log_front) * Statistics._beta_continued_fraction(a, b, x) / a
+        return 1 - math.exp(log_front) * Statistics._beta_continued_fraction(b, a, 1 - x) / b
+
+    @staticmethod
+    def _beta_continued_fraction(a, b, x):
+        tiny = 1e-300
+
+        c = 1.0
+        d = 1 - (a + b) * x / (a + 1)
+        d = 1 / (d if abs(d) > tiny else tiny)
+        result = d
+
+        for m in range(1, Statistics.BETA_MAX_ITERATIONS + 1):
+            for numerator in (m * (b - m) * x / ((a + 2 * m - 1) * (a + 2 * m)),
+                              -(a + m) * (a + b + m) * x / ((a + 2 * m) * (a + 2 * m + 1))):
+                d = 1 + numerator * d
+                d = 1 / (d if abs(d) > tiny else tiny)
+                c = 1 + numerator / c
+                c = c if abs(c) > tiny else tiny
+                delta = c * d
+                result *= delta
+
+            if abs(delta - 1) < Statistics.BETA_EPSILON:
+                break
+
+        return result
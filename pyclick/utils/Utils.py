@@ -3,10 +3,22 @@
 #
 # Full copyright notice can be found in LICENSE.
 #
+import collections
+import multiprocessing
+import os
+import sys
 
 __author__ = 'Ilya Markov'
 
 
+_forked_func = None
+"""The function applied by worker processes of Utils.fork_map."""
+
+
+def _call_forked_func(arg):
+    return _forked_func(arg)
+
+
 class Utils:
     """
     Utility methods.
@@ -41,3 +53,130 @@ class Utils:
             if search_session.query in queries:
                 search_sessions_filtered.append(search_session)
         return search_sessions_filtered
+
+    @staticmethod
+    def intern_sessions(search_sessions):
+        """
+        Replaces equal queries and search result identifiers in the given search sessions
+        with a single shared instance each, which reduces memory and speeds up parameter lookups.
+
+        :param search_sessions: The list of search sessions.
+        :return: The number of distinct queries and search result identifiers.
+        """
+        ids = {}
+        for search_session in search_sessions:
+            search_session.query = ids.setdefault(search_session.query, search_session.query)
+            for result in search_session.web_results:
+                result.id = ids.setdefault(result.id, result.id)
+        return len(ids)
+
+    @staticmethod
+    def get_click_model_factories(click_models):
+        """
+        Returns the names of the given click models and the functions that create untrained instances of them.
+
+        :param click_models: The list of click model classes, e.g., [PBM, UBM], which are created without arguments,
+            or the dictionary {name: factory}, where factory is a function that creates an untrained click model
+            with the desired configuration, e.g., {'UBM-10': functools.partial(UBM, EMInference(10))}.
+        :return: The list of pairs (name, factory).
+        """
+        if isinstance(click_models, dict):
+            return list(click_models.items())
+        return [(click_model_class.__name__, click_model_class) for click_model_class in click_models]
+
+    @staticmethod
+    def get_rss():
+        """
+        Returns the current resident set size (RSS) of the current process in bytes.
+        Falls back to the peak RSS (see get_peak_rss) if the current one is not available.
+
+        :return: The RSS in bytes.
+        """
+        try:
+            with open('/proc/self/statm') as statm:
+                return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+        except (IOError, OSError, ValueError):
+            return Utils.get_peak_rss()
+
+    @staticmethod
+    def get_peak_rss():
+        """
+        Returns the peak resident set size (RSS) of the current process in bytes
+        (0 if the platform does not report it).
+
+        :return: The peak RSS in bytes.
+        """
+        try:
+            import resource
+        except ImportError:
+            return 0
+
+        peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux reports kilobytes, while macOS reports bytes
+        return peak_rss if sys.platform == 'darwin' else peak_rss * 1024
+
+    @staticmethod
+    def fork_map(func, args, processes):
+        """
+        Applies the given function to each of the given arguments in a pool of worker processes
+        and returns the list of results in the order of the arguments (see fork_imap).
+
+        :param func: The function of one argument.
+        :param args: The iterable of arguments.
+        :param processes: The number of worker processes.
+        :return: The list of results.
+        """
+        return list(Utils.fork_imap(func, args, processes))
+
+    @staticmethod
+    def fork_imap(func, args, processes, max_pending=None, max_tasks_per_child=None):
+        """
+        Applies the given function to each of the given arguments in a pool of worker processes
+        and yields the results in the order of the arguments.
+
+        Workers are forked from the current process,
+        so the function (which can be a closure or a bound method) and all data it refers to,
+        e.g., a trained click model, are shared with the workers without copying.
+        Only the arguments and the results are passed between processes, so they must be picklable.
+        Arguments are consumed lazily: at most max_pending of them are submitted to the workers
+        before the oldest result is yielded, so a generator of arguments is processed in bounded memory.
+        Requires the 'fork' start method (i.e., a Unix platform).
+        Only one fork_imap can be running at a time.
+
+        :param func: The function of one argument.
+        :param args: The iterable of arguments.
+        :param processes: The number of worker processes.
+        :param max_pending: The maximum number of submitted arguments, whose results are not yielded yet
+            (two per process by default).
+        :param max_tasks_per_child: The number of arguments, after which a worker process is replaced by a new one
+            (e.g., 1 to process each argument in a fresh process). If not set, workers live as long as the pool.
+        :return: The generator of results.
+        """
+        global _forked_func
+
+        if max_pending is None:
+            max_pending = 2 * processes
+
+        try:
+            context = multiprocessing.get_context('fork')
+        except AttributeError:
+            # Python 2 always forks worker processes on Unix
+            context = multiprocessing
+
+        _forked_func = func
+        try:
+            pool = context.Pool(processes, maxtasksperchild=max_tasks_per_child)
+            try:
+                pending = collections.deque()
+                for arg in args:
+                    pending.append(pool.apply_async(_call_forked_func, (arg,)))
+                    if len(pending) >= max_pending:
+                        yield pending.popleft().get()
+
+                while pending:
+                    yield pending.popleft().get()
+            finally:
+                pool.terminate()
+                pool.join()
+        finally:
+            _forked_func = None
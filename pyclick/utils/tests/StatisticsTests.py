@@ -0,0 +1,66 @@
+#
+# Copyright (C) 2015  Ilya Markov
+#
+# Full copyright notice can be found in LICENSE.
+#
+from __future__ import division
+import math
+import random
+import unittest
+
+from pyclick.utils.Statistics import Statistics
+
+
+__author__ = 'Ilya Markov'
+
+
+class StatisticsTestCase(unittest.TestCase):
+
+    def test_auc(self):
+        rnd = random.Random(1)
+        for _ in range(20):
+            labels = [rnd.randint(0, 3) for _ in range(50)]
+            # Few distinct scores, so that there are ties
+            scores = [rnd.randint(0, 10) / 10 for _ in range(50)]
+
+            positive_scores = [score for label, score in zip(labels, scores) if label > 0]
+            negative_scores = [score for label, score in zip(labels, scores) if label <= 0]
+            pair_scores = [1.0 if p > n else 0.5 if p == n else 0.0 for p in positive_scores for n in negative_scores]
+
+            self.assertAlmostEqual(Statistics.auc(labels, scores), sum(pair_scores) / len(pair_scores))
+
+        self.assertRaises(ValueError, Statistics.auc, [1, 2], [0.1, 0.2])
+
+    def test_pearson(self):
+        rnd = random.Random(1)
+        for n in (3, 4, 6):
+            xs = [rnd.gauss(0, 1) for _ in range(n)]
+            ys = [x + rnd.gauss(0, 2) for x in xs]
+
+            mean_x = sum(xs) / n
+            mean_y = sum(ys) / n
+            expected_cor = sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys)) / \
+                math.sqrt(sum((x - mean_x) ** 2 for x in xs) * sum((y - mean_y) ** 2 for y in ys))
+
+            cor, p = Statistics.pearson(zip(xs, ys))
+            self.assertAlmostEqual(cor, expected_cor)
+            self.assertAlmostEqual(p, self._get_t_test_p_value(cor, n), places=10)
+
+        self.assertTrue(math.isnan(Statistics.pearson([(1, 1), (1, 2)])[0]))
+
+    @staticmethod
+    def _get_t_test_p_value(cor, n):
+        """
+        Returns the two-sided p-value of the t-test of the given correlation
+        using the closed-form CDF of the Student's t-distribution with 1, 2 or 4 degrees of freedom.
+        """
+        df = n - 2
+        t = abs(cor) * math.sqrt(df / (1 - cor ** 2))
+        if df == 1:
+            return 1 - 2 / math.pi * math.atan(t)
+        if df == 2:
+            return 1 - t / math.sqrt(2 + t ** 2)
+        if df == 4:
+            x = 1 + t ** 2 / 4
+            return 1 - 0.75 * t / math.sqrt(x) * (1 - t ** 2 / (12 * x))
+        raise ValueError("No closed form for %d degrees of freedom" % df)